@@ -0,0 +1,88 @@
+# File: benchmark_preprocess.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/classifier/benchmark_preprocess.py
+# 预处理基准测试：按输入分辨率比较单张图片的端到端延迟
+#   legacy: 全分辨率解码 + ToTensor + 全尺寸前向传播（原实现）
+#   fast:   JPEG draft 缩小解码 + 缩放/中心裁剪到224 + 归一化 + 224x224 前向传播
+# 用法: python3 benchmark_preprocess.py [--sizes 640x480 4000x3000 ...] [--repeats 5] [--no-legacy]
+import argparse
+import io
+import time
+
+import numpy as np
+import torch
+import torchvision.transforms as transforms
+from PIL import Image
+
+from image_classification import ImageClassifier, preprocess_image
+
+DEFAULT_SIZES = ['320x240', '640x480', '1280x960', '1920x1440', '4000x3000']
+
+
+def make_jpeg(width, height, quality=90):
+    """生成一张指定分辨率的合成JPEG图片（平滑渐变加噪声），返回字节串"""
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    noise = rng.normal(0, 20, (height, width)).astype(np.float32)
+    pixels = np.stack([
+        np.clip(x + noise, 0, 255),
+        np.clip(y + noise, 0, 255),
+        np.clip((x + y) / 2 - noise, 0, 255),
+    ], axis=-1).astype(np.uint8)
+    output = io.BytesIO()
+    Image.fromarray(pixels).save(output, format='JPEG', quality=quality)
+    return output.getvalue()
+
+
+def time_ms(func, repeats):
+    """返回多次调用的中位数耗时（毫秒）"""
+    timings = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start_time) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='按输入分辨率测量预处理与推理延迟')
+    parser.add_argument('--sizes', nargs='+', default=DEFAULT_SIZES, help='宽x高 列表')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--no-legacy', action='store_true', help='跳过原实现（大图时很慢）')
+    args = parser.parse_args()
+
+    classifier = ImageClassifier()
+    to_tensor = transforms.ToTensor()
+
+    def run_fast(data):
+        with Image.open(io.BytesIO(data)) as img:
+            array = preprocess_image(img)
+        return classifier.classify_arrays([array])[0]
+
+    def run_legacy(data):
+        with Image.open(io.BytesIO(data)) as img:
+            tensor = to_tensor(img).unsqueeze_(0)
+        with torch.no_grad():
+            return classifier.model(tensor)
+
+    def run_preprocess_only(data):
+        with Image.open(io.BytesIO(data)) as img:
+            return preprocess_image(img)
+
+    print(f"torch线程数: {torch.get_num_threads()}, 每项重复: {args.repeats}（取中位数）")
+    print(f"{'resolution':<12}{'jpeg(KB)':>10}{'preprocess(ms)':>16}{'fast(ms)':>12}{'legacy(ms)':>12}{'speedup':>10}")
+    for size in args.sizes:
+        width, height = (int(value) for value in size.lower().split('x'))
+        data = make_jpeg(width, height)
+        run_fast(data)  # 预热
+
+        preprocess_ms = time_ms(lambda: run_preprocess_only(data), args.repeats)
+        fast_ms = time_ms(lambda: run_fast(data), args.repeats)
+        if args.no_legacy:
+            legacy_text, speedup_text = '-', '-'
+        else:
+            legacy_ms = time_ms(lambda: run_legacy(data), args.repeats)
+            legacy_text, speedup_text = f"{legacy_ms:.1f}", f"{legacy_ms / fast_ms:.1f}x"
+        print(f"{size:<12}{len(data) / 1024:>10.0f}{preprocess_ms:>16.1f}{fast_ms:>12.1f}"
+              f"{legacy_text:>12}{speedup_text:>10}")
@@ -0,0 +1,100 @@
+# File: benchmark_variants.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/classifier/benchmark_variants.py
+# 模型变体对比报告：在同一组图片上比较各变体的加载时间、单张推理延迟，以及与 fp32 eager 输出的 top-1 一致率
+# 用法: python3 benchmark_variants.py <图片目录> [--variants fp32 int8_dynamic ...] [--calibration-dir <目录>]
+import argparse
+import io
+import json
+import time
+
+import torch
+from PIL import Image
+
+from image_classification import ImageClassifier, MODEL_VARIANTS, list_images
+
+
+def percentile(values, q):
+    """返回已排序列表的q分位数"""
+    index = min(len(values) - 1, int(round(q * (len(values) - 1))))
+    return values[index]
+
+
+def benchmark_variant(variant, images, calibration_dir, repeats):
+    """测量一个变体的加载时间和逐张推理延迟，返回 (统计信息, 每张图片的标签)
+
+    images 为图片文件的原始字节，每次推理重新打开，使 JPEG 和线上一样走 draft() 缩小解码的路径
+    （计入延迟的包括解码和预处理）。
+    """
+    start_time = time.perf_counter()
+    classifier = ImageClassifier(variant=variant, calibration_dir=calibration_dir)
+    load_seconds = time.perf_counter() - start_time
+
+    # 预热一次，排除首次调用的初始化开销
+    classifier.classify(Image.open(io.BytesIO(images[0])))
+
+    labels = []
+    latencies = []
+    for data in images:
+        for _ in range(repeats):
+            img = Image.open(io.BytesIO(data))
+            start_time = time.perf_counter()
+            label = classifier.classify(img)
+            latencies.append((time.perf_counter() - start_time) * 1000)
+        labels.append(label)
+
+    latencies.sort()
+    stats = {
+        'variant': variant,
+        'load_seconds': load_seconds,
+        'mean_ms': sum(latencies) / len(latencies),
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+    }
+    return stats, labels
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='比较各模型变体的精度与延迟')
+    parser.add_argument('image_dir', help='测试图片目录')
+    parser.add_argument('--variants', nargs='+', default=list(MODEL_VARIANTS), choices=MODEL_VARIANTS)
+    parser.add_argument('--calibration-dir', help='int8_static 变体的校准图片目录（默认使用测试图片目录）')
+    parser.add_argument('--repeats', type=int, default=3, help='每张图片重复推理的次数')
+    parser.add_argument('--threads', type=int, default=0, help='torch线程数，0表示使用默认值')
+    parser.add_argument('--json', help='把报告另存为JSON文件')
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    paths = list_images(args.image_dir)
+    if not paths:
+        raise SystemExit(f"目录中没有图片: {args.image_dir}")
+    # 只把文件内容读入内存，避免计时中包含磁盘读取；解码留到每次推理时进行
+    images = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            images.append(f.read())
+    calibration_dir = args.calibration_dir or args.image_dir
+
+    # 以当前线上实现（fp32 eager）的输出作为一致率的基准
+    variants = ['fp32'] + [variant for variant in args.variants if variant != 'fp32']
+    report = []
+    reference = None
+    for variant in variants:
+        stats, labels = benchmark_variant(variant, images, calibration_dir, args.repeats)
+        if reference is None:
+            reference = labels
+        stats['top1_agreement'] = sum(a == b for a, b in zip(labels, reference)) / len(labels)
+        report.append(stats)
+
+    print(f"图片数: {len(images)}, 每张重复: {args.repeats}, torch线程数: {torch.get_num_threads()}")
+    print(f"{'variant':<15}{'load(s)':>10}{'mean(ms)':>12}{'p50(ms)':>12}{'p95(ms)':>12}{'speedup':>10}{'top1一致率':>12}")
+    baseline_ms = report[0]['mean_ms']
+    for stats in report:
+        print(f"{stats['variant']:<15}{stats['load_seconds']:>10.2f}{stats['mean_ms']:>12.1f}"
+              f"{stats['p50_ms']:>12.1f}{stats['p95_ms']:>12.1f}"
+              f"{baseline_ms / stats['mean_ms']:>10.2f}{stats['top1_agreement'] * 100:>11.1f}%")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=4)
@@ -0,0 +1,54 @@
+# File: buffer_pool.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/classifier/buffer_pool.py
+# 有界的内存缓冲区池：S3 对象直接读入复用的缓冲区，避免突发流量时反复申请和释放内存
+import io
+import queue
+import threading
+
+
+class BufferPool:
+    """可复用的 BytesIO 缓冲区池
+
+    max_buffers 限制同时借出的缓冲区数量（全部借出时 acquire 阻塞），
+    max_retained_bytes 限制归还后继续保留的单个缓冲区大小，过大的缓冲区直接丢弃。
+    """
+
+    def __init__(self, max_buffers=32, max_retained_bytes=8 * 1024 * 1024):
+        self.max_retained_bytes = max_retained_bytes
+        self._free = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_buffers)
+        self._lock = threading.Lock()
+        self.allocated = 0
+        self.reused = 0
+
+    def acquire(self):
+        """借出一个空缓冲区，优先复用已归还的缓冲区"""
+        self._slots.acquire()
+        try:
+            buffer = self._free.get_nowait()
+            with self._lock:
+                self.reused += 1
+        except queue.Empty:
+            buffer = io.BytesIO()
+            with self._lock:
+                self.allocated += 1
+        buffer.seek(0)
+        return buffer
+
+    def release(self, buffer):
+        """归还缓冲区；不清空内容，下次写入时覆盖并截断，以保留已分配的内存"""
+        try:
+            if buffer.seek(0, io.SEEK_END) <= self.max_retained_bytes:
+                self._free.put(buffer)
+        finally:
+            self._slots.release()
+
+    def fill(self, buffer, stream, chunk_size=64 * 1024):
+        """把流中的全部数据写入缓冲区，返回写入的字节数，并把读写位置移回开头"""
+        buffer.seek(0)
+        for chunk in iter(lambda: stream.read(chunk_size), b''):
+            buffer.write(chunk)
+        size = buffer.tell()
+        buffer.truncate()
+        buffer.seek(0)
+        return size
@@ -1,35 +1,278 @@
-import torch
-import torchvision
-import torchvision.transforms as transforms
-import torch.nn as nn
-import torch.nn.functional as F
-import torchvision.models as models
 from urllib.request import urlopen
 from PIL import Image
 import numpy as np
+import argparse
 import json
+import logging
+import os
 import sys
 import time
-from torchvision.models import ResNet18_Weights
-
-url = str(sys.argv[1])
-#img = Image.open(urlopen(url))
-img = Image.open(url)
-
-# 旧的加载方式（会产生警告）
-# model = models.resnet18(pretrained=True)
-# 新的加载方式（不会产生警告）
-model = torchvision.models.resnet18(weights=ResNet18_Weights.DEFAULT)
-
-model.eval()
-img_tensor = transforms.ToTensor()(img).unsqueeze_(0)
-outputs = model(img_tensor)
-_, predicted = torch.max(outputs.data, 1)
-
-with open('./imagenet-labels.json') as f:
-    labels = json.load(f)
-result = labels[np.array(predicted)[0]]
-img_name = url.split("/")[-1]
-#save_name = f"({img_name}, {result})"
-save_name = f"{img_name},{result}"
-print(f"{save_name}")
+
+logger = logging.getLogger(__name__)
+
+# torch/torchvision 导入耗时数秒，延迟到真正构建模型时才导入（见 import_torch）
+torch = None
+torchvision = None
+nn = None
+
+# 标签文件默认与本脚本放在同一目录
+LABELS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'imagenet-labels.json')
+
+# 可选的模型变体
+# fp32:          eager 模式 fp32（原始实现）
+# torchscript:   TorchScript 脚本化并冻结的计算图
+# channels_last: 使用 channels_last 内存布局的 eager 模型
+# int8_dynamic:  动态量化（全连接层权重量化为INT8）
+# int8_static:   静态训练后量化（需要本地校准图片集）
+MODEL_VARIANTS = ('fp32', 'torchscript', 'channels_last', 'int8_dynamic', 'int8_static')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp')
+
+# 预处理参数：短边缩放到 RESIZE_SIZE 后中心裁剪为 INPUT_SIZE，再按 ImageNet 均值/标准差归一化
+RESIZE_SIZE = 256
+INPUT_SIZE = 224
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+def list_images(directory):
+    """返回目录中所有图片文件的路径（按文件名排序）"""
+    return [
+        os.path.join(directory, name)
+        for name in sorted(os.listdir(directory))
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    ]
+
+
+def preprocess_image(img, resize_size=RESIZE_SIZE, crop_size=INPUT_SIZE):
+    """把刚打开（尚未解码）的PIL图像预处理为 crop_size x crop_size 的 HWC uint8 数组
+
+    JPEG 使用 draft() 在解码时直接按 1/2、1/4、1/8 缩小，避免解码完整分辨率；
+    随后把短边缩放到 resize_size 并中心裁剪。
+    """
+    if img.format == 'JPEG':
+        img.draft('RGB', (resize_size, resize_size))
+    img = img.convert('RGB')
+
+    width, height = img.size
+    scale = resize_size / min(width, height)
+    new_width = max(crop_size, round(width * scale))
+    new_height = max(crop_size, round(height * scale))
+    img = img.resize((new_width, new_height), Image.BILINEAR, reducing_gap=3.0)
+
+    left = (new_width - crop_size) // 2
+    top = (new_height - crop_size) // 2
+    img = img.crop((left, top, left + crop_size, top + crop_size))
+    return np.array(img)
+
+
+def import_torch():
+    """延迟导入 torch/torchvision，使只需要预处理的进程不必承担导入开销"""
+    global torch, torchvision, nn
+    if torch is None:
+        import torch as torch_module
+        import torch.nn as nn_module
+        import torchvision as torchvision_module
+        torch, torchvision, nn = torch_module, torchvision_module, nn_module
+
+
+def load_state_dict(path):
+    """从本地权重文件加载 state_dict，尽量使用内存映射以避免整体读入"""
+    try:
+        return torch.load(path, map_location='cpu', mmap=True, weights_only=True)
+    except TypeError:
+        # 旧版本 torch 不支持 mmap/weights_only 参数
+        return torch.load(path, map_location='cpu')
+
+
+def save_weights(model, path):
+    """把 state_dict 写入本地文件：先写本进程专用的临时文件再原子替换，多个进程同时写出时互不干扰"""
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        torch.save(model.state_dict(), temp_path)
+        os.replace(temp_path, path)
+    except (OSError, RuntimeError):
+        # 目录不存在时新版 torch 抛出 RuntimeError
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def export_weights(path):
+    """把预训练权重序列化为本地文件"""
+    import_torch()
+    from torchvision.models import ResNet18_Weights
+
+    model = torchvision.models.resnet18(weights=ResNet18_Weights.DEFAULT)
+    save_weights(model, path)
+    return model
+
+
+def load_fp32_model(weights_path=None):
+    """加载 eager 模式的 fp32 ResNet18
+
+    指定 weights_path 时优先从本地权重文件加载；文件不存在时使用 torchvision 预训练权重，
+    并尝试写出该文件，下次启动即可直接从本地加载（写出失败时只记录日志，继续使用内存中的模型）。
+    """
+    import_torch()
+    if weights_path and os.path.exists(weights_path):
+        model = torchvision.models.resnet18(weights=None)
+        state_dict = load_state_dict(weights_path)
+        try:
+            model.load_state_dict(state_dict, assign=True)
+        except TypeError:
+            model.load_state_dict(state_dict)
+    elif weights_path:
+        from torchvision.models import ResNet18_Weights
+
+        logger.warning(f"本地权重文件不存在，改用预训练权重并写出: {weights_path}")
+        model = torchvision.models.resnet18(weights=ResNet18_Weights.DEFAULT)
+        try:
+            save_weights(model, weights_path)
+        except (OSError, RuntimeError) as e:
+            logger.warning(f"写出本地权重文件失败，本次使用内存中的预训练权重: {weights_path}, {str(e)}")
+    else:
+        from torchvision.models import ResNet18_Weights
+
+        # 旧的加载方式（会产生警告）
+        # model = models.resnet18(pretrained=True)
+        # 新的加载方式（不会产生警告）
+        model = torchvision.models.resnet18(weights=ResNet18_Weights.DEFAULT)
+    model.eval()
+    return model
+
+
+def quantize_static(calibration_batches, weights_path=None):
+    """静态训练后量化：融合 conv/bn/relu，用校准图片统计激活范围后转换为INT8模型"""
+    from torchvision.models.quantization import resnet18 as quantizable_resnet18
+
+    engines = torch.backends.quantized.supported_engines
+    backend = 'x86' if 'x86' in engines else ('fbgemm' if 'fbgemm' in engines else 'qnnpack')
+    torch.backends.quantized.engine = backend
+
+    model = quantizable_resnet18(weights=None, quantize=False)
+    model.load_state_dict(load_fp32_model(weights_path).state_dict())
+    model.eval()
+    model.fuse_model()
+    model.qconfig = torch.ao.quantization.get_default_qconfig(backend)
+    torch.ao.quantization.prepare(model, inplace=True)
+    with torch.no_grad():
+        for batch in calibration_batches:
+            model(batch)
+    torch.ao.quantization.convert(model, inplace=True)
+    return model
+
+
+class ImageClassifier:
+    """常驻内存的分类器：模型和标签只在创建时加载一次"""
+
+    def __init__(self, labels_path=LABELS_PATH, variant='fp32', calibration_dir=None, weights_path=None,
+                 num_threads=None):
+        if variant not in MODEL_VARIANTS:
+            raise ValueError(f"未知的模型变体: {variant}，可选: {', '.join(MODEL_VARIANTS)}")
+        import_torch()
+        # 在构建模型（包括静态量化校准）之前设置 torch 线程数
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.variant = variant
+        self.weights_path = weights_path
+        # 归一化常量预先乘以255，直接作用于uint8像素值
+        self.mean = torch.tensor(IMAGENET_MEAN).view(1, 3, 1, 1) * 255
+        self.std = torch.tensor(IMAGENET_STD).view(1, 3, 1, 1) * 255
+        self.batch_buffer = None
+        self.model = self._build_model(variant, calibration_dir)
+
+        with open(labels_path) as f:
+            self.labels = json.load(f)
+
+    def _build_model(self, variant, calibration_dir):
+        if variant == 'int8_static':
+            if not calibration_dir:
+                raise ValueError("int8_static 变体需要指定校准图片目录")
+            arrays = []
+            for path in list_images(calibration_dir):
+                with Image.open(path) as img:
+                    arrays.append(preprocess_image(img))
+            if not arrays:
+                raise ValueError(f"校准图片目录中没有图片: {calibration_dir}")
+            logger.info(f"使用 {len(arrays)} 张图片进行静态量化校准")
+            return quantize_static((self.to_batch([array]) for array in arrays), self.weights_path)
+
+        model = load_fp32_model(self.weights_path)
+        if variant == 'torchscript':
+            with torch.no_grad():
+                model = torch.jit.freeze(torch.jit.script(model))
+        elif variant == 'channels_last':
+            model = model.to(memory_format=torch.channels_last)
+        elif variant == 'int8_dynamic':
+            model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+        return model
+
+    def to_batch(self, arrays):
+        """把预处理后的 HWC uint8 数组写入预分配的NCHW张量，并原地完成归一化
+
+        返回的张量是内部缓冲区的视图，下次调用时会被覆盖（非线程安全）。
+        """
+        count = len(arrays)
+        if self.batch_buffer is None or self.batch_buffer.shape[0] < count:
+            self.batch_buffer = torch.empty((count, 3, INPUT_SIZE, INPUT_SIZE), dtype=torch.float32)
+        batch = self.batch_buffer[:count]
+        for index, array in enumerate(arrays):
+            batch[index].copy_(torch.from_numpy(array).permute(2, 0, 1))
+        batch.sub_(self.mean).div_(self.std)
+        return batch
+
+    def warm_up(self):
+        """用一张空白图像做一次前向传播，把首次推理的初始化开销提前到启动阶段"""
+        self.classify_arrays([np.zeros((INPUT_SIZE, INPUT_SIZE, 3), dtype=np.uint8)])
+
+    def _forward(self, batch):
+        if self.variant == 'channels_last':
+            batch = batch.contiguous(memory_format=torch.channels_last)
+        return self.model(batch)
+
+    def classify_arrays(self, arrays):
+        """对一批已预处理的数组进行分类（一次前向传播），按输入顺序返回标签列表"""
+        with torch.no_grad():
+            outputs = self._forward(self.to_batch(arrays))
+        _, predicted = torch.max(outputs.data, 1)
+        return [self.labels[label_index] for label_index in predicted.tolist()]
+
+    def classify(self, img):
+        """对一张已打开的PIL图像进行分类，返回标签"""
+        return self.classify_arrays([preprocess_image(img)])[0]
+
+    def classify_batch(self, images):
+        """对一批PIL图像进行分类，按输入顺序返回标签列表"""
+        return self.classify_arrays([preprocess_image(img) for img in images])
+
+    def classify_file(self, path):
+        """对本地图像文件进行分类，返回标签"""
+        #img = Image.open(urlopen(url))
+        with Image.open(path) as img:
+            return self.classify(img)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='使用 ResNet18 对图片进行分类')
+    parser.add_argument('image', nargs='?', help='图片路径')
+    parser.add_argument('--variant', default='fp32', choices=MODEL_VARIANTS, help='模型变体')
+    parser.add_argument('--calibration-dir', help='int8_static 变体使用的校准图片目录')
+    parser.add_argument('--weights', help='本地权重文件路径')
+    parser.add_argument('--export-weights', metavar='PATH', help='把预训练权重写出到本地文件后退出（用于制作AMI）')
+    args = parser.parse_args()
+
+    if args.export_weights:
+        export_weights(args.export_weights)
+        print(f"权重已写出: {args.export_weights}")
+        sys.exit(0)
+    if not args.image:
+        parser.error('需要指定图片路径')
+
+    url = str(args.image)
+    classifier = ImageClassifier(variant=args.variant, calibration_dir=args.calibration_dir,
+                                 weights_path=args.weights)
+    result = classifier.classify_file(url)
+    img_name = url.split("/")[-1]
+    #save_name = f"({img_name}, {result})"
+    save_name = f"{img_name},{result}"
+    print(f"{save_name}")
@@ -0,0 +1,157 @@
+# File: pipeline.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/classifier/pipeline.py
+# 多阶段流水线：各阶段由独立线程执行，阶段之间用有界队列连接，队列满时上游阻塞形成背压
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Stage:
+    """流水线中的一个阶段：若干线程从输入队列取任务，处理后放入输出队列
+
+    handler 的约定：
+    - 源阶段（input_queue 为 None）：handler() 返回新任务列表
+    - batch_size 为 1：handler(item) 返回下游任务，返回 None 表示任务已结束
+    - batch_size 大于 1：handler(items) 返回下游任务列表
+    """
+
+    def __init__(self, name, handler, input_queue=None, output_queue=None,
+                 workers=1, batch_size=1, linger=0):
+        self.name = name
+        self.handler = handler
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.workers = workers
+        self.batch_size = batch_size
+        self.linger = linger
+        self.threads = []
+        self.lock = threading.Lock()
+        self.busy_seconds = 0.0
+        self.processed = 0
+
+    def start(self, stop_event):
+        for index in range(self.workers):
+            thread = threading.Thread(
+                target=self._run, args=(stop_event,),
+                name=f"{self.name}-{index}", daemon=True
+            )
+            thread.start()
+            self.threads.append(thread)
+
+    def take_stats(self):
+        """返回并清零自上次统计以来的忙碌时间和处理数量"""
+        with self.lock:
+            busy, processed = self.busy_seconds, self.processed
+            self.busy_seconds, self.processed = 0.0, 0
+        return busy, processed
+
+    def _collect(self, stop_event):
+        """从输入队列收集一批任务：阻塞等待第一项，再在等待窗口内尽量凑满批次"""
+        try:
+            items = [self.input_queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.time() + self.linger
+        while len(items) < self.batch_size and not stop_event.is_set():
+            remaining = deadline - time.time()
+            try:
+                if remaining > 0:
+                    items.append(self.input_queue.get(timeout=remaining))
+                else:
+                    items.append(self.input_queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _emit(self, results, stop_event):
+        if self.output_queue is None:
+            return
+        for result in results:
+            if result is None:
+                continue
+            # 下游队列满时阻塞，形成背压
+            while not stop_event.is_set():
+                try:
+                    self.output_queue.put(result, timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+
+    def _run(self, stop_event):
+        while not stop_event.is_set():
+            try:
+                if self.input_queue is None:
+                    items = None
+                elif self.batch_size > 1:
+                    items = self._collect(stop_event)
+                    if not items:
+                        continue
+                else:
+                    try:
+                        items = self.input_queue.get(timeout=0.5)
+                    except queue.Empty:
+                        continue
+
+                start_time = time.time()
+                if items is None:
+                    results = self.handler()
+                    count = len(results)
+                elif self.batch_size > 1:
+                    results = self.handler(items)
+                    count = len(items)
+                else:
+                    results = [self.handler(items)]
+                    count = 1
+                with self.lock:
+                    self.busy_seconds += time.time() - start_time
+                    self.processed += count
+
+                self._emit(results, stop_event)
+            except Exception as e:
+                logger.exception(f"流水线阶段 {self.name} 出错: {str(e)}")
+
+
+class Pipeline:
+    """按顺序连接的多个阶段，并定期在日志中输出各阶段的占用情况"""
+
+    def __init__(self, stages, stats_interval=60):
+        self.stages = stages
+        self.stats_interval = stats_interval
+        self.stop_event = threading.Event()
+
+    def start(self):
+        for stage in self.stages:
+            stage.start(self.stop_event)
+
+    def stop(self):
+        self.stop_event.set()
+
+    def log_stats(self, elapsed):
+        """输出各阶段的输入队列深度、线程忙碌率和处理数量"""
+        parts = []
+        for stage in self.stages:
+            busy, processed = stage.take_stats()
+            occupancy = busy / (elapsed * stage.workers) * 100 if elapsed > 0 else 0.0
+            if stage.input_queue is not None:
+                depth = f"{stage.input_queue.qsize()}/{stage.input_queue.maxsize}"
+            else:
+                depth = "-"
+            parts.append(f"{stage.name}[队列 {depth}, 忙碌 {occupancy:.0f}%, 处理 {processed}]")
+        logger.info("流水线状态: " + " ".join(parts))
+
+    def run_forever(self):
+        """启动所有阶段并阻塞当前线程，定期输出占用情况"""
+        self.start()
+        self.monitor()
+
+    def monitor(self):
+        """阻塞当前线程，定期输出各阶段占用情况，直到流水线停止"""
+        last_time = time.time()
+        while not self.stop_event.is_set():
+            self.stop_event.wait(self.stats_interval)
+            now = time.time()
+            self.log_stats(now - last_time)
+            last_time = now
@@ -1,11 +1,41 @@
 # File: worker.py version 1.0 release 2025-06-25 by Wenguang Zuo
 # wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/classifier/worker.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/classifier/worker_config.json
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/classifier/image_classification.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/classifier/pipeline.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/classifier/buffer_pool.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/classifier/metrics.py
+import time
+
+# 进程启动时间，用于统计冷启动耗时（需在其他导入之前记录）
+PROCESS_START_TIME = time.time()
+
 import boto3
+import base64
+import io
 import os
-import subprocess
 import json
-import time
 import logging
+import multiprocessing
+import queue
+import threading
+import urllib.request
+import uuid
+import zlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+try:
+    import psutil  # 可选依赖，用于获取物理核数
+except ImportError:
+    psutil = None
+
+from image_classification import ImageClassifier, preprocess_image
+from buffer_pool import BufferPool
+from pipeline import Pipeline, Stage
+from metrics import MetricsRegistry, start_file_exporter, start_http_exporter
 
 # 配置日志
 logging.basicConfig(
@@ -14,133 +44,712 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 通过环境变量指定配置文件路径
+# 如果是Windows 系统
+if os.name == 'nt':
+    CONFIG_PATH = os.environ.get('WORKER_CONFIG_PATH', r".\code\app\worker_config.json")
+# 如果是Linux 系统
+else:
+    CONFIG_PATH = os.environ.get('WORKER_CONFIG_PATH', '/home/us2-user/classifier/worker_config.json')
+
+# 读取配置文件
+try:
+    with open(CONFIG_PATH, 'r') as f:
+        config = json.load(f)
+except FileNotFoundError:
+    logger.error("未找到配置文件 worker_config.json")
+    raise
+
 # AWS 配置
-AWS_REGION = 'us-east-1'
-INPUT_BUCKET = 'project2-input-bucket-abc'
-OUTPUT_BUCKET = 'project2-output-bucket-xyz'
-REQUEST_QUEUE_URL = 'https://sqs.us-east-1.amazonaws.com/257288819129/request-queue'
-RESPONSE_QUEUE_URL = 'https://sqs.us-east-1.amazonaws.com/257288819129/response-queue'
+AWS_REGION = config.get("AWS_REGION", "us-east-1")
+INPUT_BUCKET = config.get("INPUT_BUCKET", "project2-input-bucket-abc")
+OUTPUT_BUCKET = config.get("OUTPUT_BUCKET", "project2-output-bucket-xyz")
+REQUEST_QUEUE_URL = config.get("REQUEST_QUEUE_URL", "https://sqs.us-east-1.amazonaws.com/257288819129/request-queue")
+# 默认响应队列：请求消息中没有 reply_to（web层未启用节点响应队列）时使用
+RESPONSE_QUEUE_URL = config.get("RESPONSE_QUEUE_URL", "https://sqs.us-east-1.amazonaws.com/257288819129/response-queue")
+# 非空时 S3/SQS 使用该地址（本地测试时指向 LocalStack、ElasticMQ、MinIO 等兼容实现）
+AWS_ENDPOINT_URL = config.get("AWS_ENDPOINT_URL", "")
+
+# 批处理配置（带默认值）
+# BATCH_MAX_SIZE: 一次前向传播最多处理的图像数
+# BATCH_LINGER_SECONDS: 推理阶段收到第一张图像后，继续等待更多图像的时间窗口
+BATCH_MAX_SIZE = config.get("BATCH_MAX_SIZE", 10)
+BATCH_LINGER_SECONDS = config.get("BATCH_LINGER_SECONDS", 0.2)
+SQS_MAX_MESSAGES = 10  # SQS 单次 receive_message 的上限
+
+# 多进程配置（带默认值）
+# WORKER_PROCESSES: 推理进程数，1 为单进程模式，0 为每个物理核一个进程
+# TORCH_THREADS_PER_PROCESS: 每个进程的 torch 线程数，0 为按核数平均分配
+WORKER_PROCESSES = config.get("WORKER_PROCESSES", 1)
+TORCH_THREADS_PER_PROCESS = config.get("TORCH_THREADS_PER_PROCESS", 0)
+SUPERVISOR_CHECK_INTERVAL = config.get("SUPERVISOR_CHECK_INTERVAL", 5)
+SUPERVISOR_REPORT_INTERVAL = config.get("SUPERVISOR_REPORT_INTERVAL", 60)
+
+# 流水线配置（带默认值）
+# MAX_INFLIGHT_MESSAGES: 每个推理进程最多持有的已接收、未处理完的请求消息数（默认 2 * BATCH_MAX_SIZE）。
+#   被持有的消息在请求队列中不可见，限制其数量可避免少数worker囤积任务，使积压对自动伸缩器可见
+MAX_INFLIGHT_MESSAGES = config.get("MAX_INFLIGHT_MESSAGES", 2 * BATCH_MAX_SIZE)
+# PIPELINE_QUEUE_SIZE: 阶段之间队列的最大长度，队列满时上游阶段阻塞
+PIPELINE_QUEUE_SIZE = config.get("PIPELINE_QUEUE_SIZE", 20)
+FETCH_THREADS = config.get("FETCH_THREADS", 4)
+DECODE_THREADS = config.get("DECODE_THREADS", 2)
+PUBLISH_THREADS = config.get("PUBLISH_THREADS", 4)
+PIPELINE_STATS_INTERVAL = config.get("PIPELINE_STATS_INTERVAL", 60)
+
+# 输出配置（带默认值）
+# PUBLISH_LINGER_SECONDS: 发布阶段凑批的等待窗口，响应的发送和请求的删除每批最多10条
+# RESULT_WRITE_THREADS: 后台写入S3结果的线程数
+# RESULT_AGGREGATE: 为 true 时每批结果合并写入 RESULT_AGGREGATE_PREFIX 下的一个对象，而不是每张图片一个对象
+PUBLISH_LINGER_SECONDS = config.get("PUBLISH_LINGER_SECONDS", 0.05)
+RESULT_WRITE_THREADS = config.get("RESULT_WRITE_THREADS", 8)
+RESULT_AGGREGATE = config.get("RESULT_AGGREGATE", False)
+RESULT_AGGREGATE_PREFIX = config.get("RESULT_AGGREGATE_PREFIX", "batches/")
+SQS_BATCH_RETRIES = config.get("SQS_BATCH_RETRIES", 1)
 
-s3 = boto3.client('s3', region_name=AWS_REGION)
-sqs = boto3.client('sqs', region_name=AWS_REGION)
+# 内存缓冲区池配置（带默认值）
+# BUFFER_POOL_SIZE: 同时借出的缓冲区上限，用满时下载阶段阻塞
+# BUFFER_MAX_RETAINED_BYTES: 归还后继续保留复用的单个缓冲区大小上限
+BUFFER_POOL_SIZE = config.get("BUFFER_POOL_SIZE", 32)
+BUFFER_MAX_RETAINED_BYTES = config.get("BUFFER_MAX_RETAINED_BYTES", 8 * 1024 * 1024)
 
-def process_image(filename):
+# 模型配置（带默认值）
+# MODEL_VARIANT: fp32 / torchscript / channels_last / int8_dynamic / int8_static
+# CALIBRATION_DIR: int8_static 变体使用的本地校准图片目录
+MODEL_VARIANT = config.get("MODEL_VARIANT", "fp32")
+CALIBRATION_DIR = config.get("CALIBRATION_DIR", "")
+# MODEL_WEIGHTS_PATH: 本地预序列化的权重文件（以内存映射方式加载），不存在时下载一次并写出
+MODEL_WEIGHTS_PATH = config.get("MODEL_WEIGHTS_PATH", "/home/ec2-user/classifier/resnet18-weights.pt")
+
+# 就绪信号配置（带默认值）
+# READY_FILE: 模型加载并预热完成后写出的本地文件
+# READY_TAG_KEY: 就绪后给当前EC2实例打上的标签，自动伸缩器据此区分已就绪和仍在冷启动的实例
+READY_FILE = config.get("READY_FILE", "/tmp/worker_ready.json")
+READY_TAG_ENABLED = config.get("READY_TAG_ENABLED", True)
+READY_TAG_KEY = config.get("READY_TAG_KEY", "WorkerReady")
+
+# 指标导出配置（带默认值）
+# METRICS_PORT: 本地HTTP导出端口（/metrics 与 /metrics.json），0 表示不启用；监督模式下第 i 个推理进程使用 METRICS_PORT + i
+# METRICS_FILE: 定期写出JSON指标快照的文件路径，空字符串表示不启用；其中的 {index} 替换为推理进程编号
+# 默认端口避开 node_exporter 常用的 9100
+METRICS_PORT = config.get("METRICS_PORT", 9546)
+METRICS_FILE = config.get("METRICS_FILE", "")
+METRICS_FILE_INTERVAL = config.get("METRICS_FILE_INTERVAL", 10)
+
+# 是否在响应消息的 trace 属性中附带各阶段时间戳（web层据此给出请求的时间线，带默认值）
+TRACE_ENABLED = config.get("TRACE_ENABLED", True)
+
+s3 = boto3.client('s3', region_name=AWS_REGION, endpoint_url=AWS_ENDPOINT_URL or None)
+sqs = boto3.client('sqs', region_name=AWS_REGION, endpoint_url=AWS_ENDPOINT_URL or None)
+
+# 队列不存在时 SQS 返回的错误码（query 协议和 JSON 协议）
+MISSING_QUEUE_ERROR_CODES = ('AWS.SimpleQueueService.NonExistentQueue', 'QueueDoesNotExist')
+
+# 图像下载使用的内存缓冲区池
+buffer_pool = BufferPool(BUFFER_POOL_SIZE, BUFFER_MAX_RETAINED_BYTES)
+# 后台写入S3结果的线程池
+result_writer = ThreadPoolExecutor(max_workers=RESULT_WRITE_THREADS, thread_name_prefix='result-writer')
+
+# 常驻内存的分类器，在主函数启动时加载一次
+classifier = None
+# 监督模式下与监督进程共享的已处理计数
+processed_counter = None
+first_inference_time = None
+
+# 本进程持有的请求消息名额，见 MAX_INFLIGHT_MESSAGES
+inflight_slots = threading.Semaphore(MAX_INFLIGHT_MESSAGES)
+
+# 指标（每个推理进程各自统计和导出）
+metrics = MetricsRegistry()
+received_total = metrics.counter('worker_tasks_received_total', '从请求队列收到的任务数')
+completed_total = metrics.counter('worker_tasks_completed_total', '成功发布结果的任务数')
+failed_total = metrics.counter('worker_tasks_failed_total', '处理失败、放回请求队列的任务数')
+inflight_tasks = metrics.gauge('worker_inflight_tasks', '已接收但尚未发布的任务数')
+queue_wait_seconds = metrics.histogram('worker_queue_wait_seconds', '请求消息从web层入队到被worker接收的时间')
+download_seconds = {
+    source: metrics.histogram('worker_download_seconds', '把图像读入内存的耗时（s3: 从输入桶下载, inline: 从消息解码）',
+                              labels={'source': source})
+    for source in ('s3', 'inline')
+}
+preprocess_seconds = metrics.histogram('worker_preprocess_seconds', '单张图像解码和预处理的耗时')
+inference_seconds = metrics.histogram('worker_inference_seconds', '一批图像前向传播的耗时')
+inference_batch_size = metrics.histogram('worker_inference_batch_size', '每次前向传播的图像数',
+                                         buckets=(1, 2, 4, 8, 16, 32, 64))
+publish_seconds = metrics.histogram('worker_publish_seconds', '一批结果的发布耗时（写S3、发送响应、删除请求）')
+end_to_end_seconds = metrics.histogram('worker_end_to_end_seconds', '请求消息入队到结果发布完成的时间')
+
+def download_image(filename):
+    """从输入桶把图像直接读入内存缓冲区（不落盘），返回从缓冲区池借出的缓冲区"""
+    buffer = buffer_pool.acquire()
     try:
-        logger.info(f"开始处理图像: {filename}")
-        
-        # 下载图片
-        input_path = f"/tmp/{filename}"
-        s3.download_file(INPUT_BUCKET, filename, input_path)
-        logger.debug(f"图片已下载到: {input_path}")
-        
-        # 执行分类器
-        result = subprocess.check_output(
-            ['python3', '/home/ec2-user/classifier/image_classification.py', input_path],
-            stderr=subprocess.STDOUT
-        )
-        
-        # 解析结果 (格式: filename,result)
-        _, classification = result.decode('utf-8').strip().split(',', 1)
-        logger.info(f"分类结果: {classification}")
-        
-        # 保存结果到输出桶
-        s3.put_object(
-            Bucket=OUTPUT_BUCKET,
-            Body=f'{filename},{classification}',
-            # 将filenam扩展名修改为.csv
-            Key=os.path.splitext(filename)[0] + '.csv'
+        response = s3.get_object(Bucket=INPUT_BUCKET, Key=filename)
+        size = buffer_pool.fill(buffer, response['Body'])
+    except Exception:
+        buffer_pool.release(buffer)
+        raise
+    logger.debug(f"图片已读入内存: {filename}, {size} 字节")
+    return buffer
+
+def decode_inline_payload(payload, encoding):
+    """把请求消息中内联的图像还原为字节（web层对小图像使用 base64，可选 zlib 压缩）"""
+    data = base64.b64decode(payload)
+    if encoding == 'zlib+base64':
+        data = zlib.decompress(data)
+    elif encoding != 'base64':
+        raise ValueError(f"未知的内联编码: {encoding}")
+    return data
+
+def save_result(filename, classification):
+    """保存结果到输出桶"""
+    s3.put_object(
+        Bucket=OUTPUT_BUCKET,
+        Body=f'{filename},{classification}',
+        # 将filenam扩展名修改为.csv
+        Key=os.path.splitext(filename)[0] + '.csv'
+    )
+    logger.debug(f"结果已保存到S3: {OUTPUT_BUCKET}/{filename}")
+
+def receive_tasks():
+    """接收阶段：长轮询请求队列，把消息解析为任务
+
+    每条消息占用一个处理名额，发布阶段处理完后归还；没有空闲名额时不接收新消息。
+    """
+    inflight_slots.acquire()
+    slots = 1
+    while slots < SQS_MAX_MESSAGES and inflight_slots.acquire(blocking=False):
+        slots += 1
+    try:
+        response = sqs.receive_message(
+            QueueUrl=REQUEST_QUEUE_URL,
+            MaxNumberOfMessages=slots,
+            WaitTimeSeconds=20,
+            MessageAttributeNames=['All']  # 获取所有消息属性
         )
-        logger.debug(f"结果已保存到S3: {OUTPUT_BUCKET}/{filename}")
+    except Exception as e:
+        logger.error(f"AWS服务错误: {str(e)}")
+        inflight_slots.release(slots)
+        time.sleep(10)
+        return []
 
-        # 删除input文件
-        os.remove(input_path)
-        logger.debug("临时文件已删除")
+    tasks = []
+    completed = False
+    try:
+        for message in response.get('Messages', []):
+            receipt_handle = message['ReceiptHandle']
+            try:
+                body = json.loads(message['Body'])
+                if not isinstance(body, dict):
+                    raise ValueError("message body is not a JSON object")
+            except ValueError:
+                logger.error("无效的JSON消息体")
+                # 删除无效消息（失败时只记录日志，消息在可见性超时后会再次被收到并删除）
+                try:
+                    sqs.delete_message(
+                        QueueUrl=REQUEST_QUEUE_URL,
+                        ReceiptHandle=receipt_handle
+                    )
+                except Exception as e:
+                    logger.error(f"删除无效消息失败: {str(e)}")
+                continue
 
-        return classification
-        
-    except subprocess.CalledProcessError as e:
-        logger.error(f"分类器执行失败: {e.output.decode('utf-8')}")
-        return None
+            task = {
+                'filename': body.get('filename'),
+                'request_id': body.get('request_id'),
+                'receipt_handle': receipt_handle,
+                # web层入队时间，用于计算排队等待时间和端到端耗时
+                'enqueued_at': body.get('timestamp'),
+                # 小图像由web层直接内联在消息中，此时无需访问输入桶
+                'payload': body.get('payload'),
+                'encoding': body.get('encoding', 'base64'),
+                # 发出请求的web节点的响应队列
+                'reply_to': body.get('reply_to'),
+                'buffer': None,
+                'image': None,
+                'classification': None,
+                'error': None,
+                # 各阶段完成时间 {阶段: 时间}，随响应消息传回web层
+                'trace': {'worker_received': time.time()}
+            }
+            logger.info(f"收到新任务: {task['filename']}, RequestID: {task['request_id']}")
+            if task['enqueued_at']:
+                queue_wait_seconds.observe(max(0.0, time.time() - task['enqueued_at']))
+            tasks.append(task)
+        completed = True
+    finally:
+        # 归还未用到的名额（收到的消息少于请求数或消息无效已被删除）；
+        # 解析中途出错时本批任务不会进入流水线，全部归还
+        unused = slots - len(tasks) if completed else slots
+        if unused:
+            inflight_slots.release(unused)
+    received_total.inc(len(tasks))
+    inflight_tasks.inc(len(tasks))
+    return tasks
+
+def fetch_task(task):
+    """下载阶段：把图像读入内存（内联图像直接从消息解码，否则从输入桶读取）"""
+    start_time = time.perf_counter()
+    source = 's3' if task['payload'] is None else 'inline'
+    try:
+        if task['payload'] is not None:
+            buffer = buffer_pool.acquire()
+            try:
+                size = buffer_pool.fill(buffer, io.BytesIO(decode_inline_payload(task['payload'], task['encoding'])))
+            except Exception:
+                buffer_pool.release(buffer)
+                raise
+            task['buffer'] = buffer
+            task['payload'] = None
+            logger.debug(f"内联图像已解码: {task['filename']}, {size} 字节")
+        else:
+            task['buffer'] = download_image(task['filename'])
+        download_seconds[source].observe(time.perf_counter() - start_time)
+        task['trace']['fetched'] = time.time()
+    except Exception as e:
+        logger.exception(f"下载图像时出错: {task['filename']}, {str(e)}")
+        task['error'] = str(e)
+    return task
+
+def decode_task(task):
+    """解码阶段：直接从内存缓冲区解码并预处理图像（缩放、裁剪），随后归还缓冲区"""
+    if task['error']:
+        return task
+    try:
+        with preprocess_seconds.time(), Image.open(task['buffer']) as img:
+            task['image'] = preprocess_image(img)
+        task['trace']['decoded'] = time.time()
     except Exception as e:
-        logger.exception(f"处理图像时出错: {str(e)}")
+        logger.exception(f"解码图像时出错: {task['filename']}, {str(e)}")
+        task['error'] = str(e)
+    finally:
+        buffer_pool.release(task['buffer'])
+        task['buffer'] = None
+    return task
+
+def infer_tasks(tasks):
+    """推理阶段：把一批已预处理的图像合并为一次前向传播"""
+    global first_inference_time
+    ready = [task for task in tasks if not task['error']]
+    if ready:
+        try:
+            start_time = time.time()
+            labels = classifier.classify_arrays([task['image'] for task in ready])
+            elapsed = time.time() - start_time
+            inference_seconds.observe(elapsed)
+            inference_batch_size.observe(len(ready))
+            for task in ready:
+                task['trace']['inference_started'] = start_time
+                task['trace']['inferred'] = start_time + elapsed
+            logger.info(f"批量推理完成: {len(ready)} 张图像, 耗时 {elapsed:.3f} 秒")
+            if first_inference_time is None:
+                first_inference_time = time.time()
+                logger.info(f"首次推理完成，距进程启动 {first_inference_time - PROCESS_START_TIME:.2f} 秒")
+            for task, classification in zip(ready, labels):
+                task['classification'] = classification
+                logger.info(f"分类结果: {task['filename']} -> {classification}")
+        except Exception as e:
+            logger.exception(f"批量推理时出错: {str(e)}")
+            for task in ready:
+                task['error'] = str(e)
+    # 释放预处理后的图像数据
+    for task in tasks:
+        task['image'] = None
+    return tasks
+
+def sqs_batch(operation, queue_url, entries, missing_ok=False):
+    """执行一次SQS批量操作（最多10条），对非调用方错误的失败条目重试，返回最终失败的条目Id集合
+
+    missing_ok 为真时队列不存在视为成功（例如发出请求的web节点已退出并删除了它的响应队列）。
+    """
+    pending = entries
+    failed_ids = set()
+    for attempt in range(SQS_BATCH_RETRIES + 1):
+        try:
+            response = operation(QueueUrl=queue_url, Entries=pending)
+            failures = response.get('Failed', [])
+        except Exception as e:
+            if missing_ok and getattr(e, 'response', {}).get('Error', {}).get('Code') in MISSING_QUEUE_ERROR_CODES:
+                logger.warning(f"队列不存在，跳过 {len(pending)} 条消息: {queue_url}")
+                return failed_ids
+            logger.error(f"SQS批量操作出错: {str(e)}")
+            failures = [{'Id': entry['Id'], 'SenderFault': False, 'Message': str(e)} for entry in pending]
+
+        retry_ids = set()
+        for failure in failures:
+            if failure.get('SenderFault') or attempt == SQS_BATCH_RETRIES:
+                logger.error(f"批量操作条目失败: Id {failure['Id']}, {failure.get('Code')}, {failure.get('Message')}")
+                failed_ids.add(failure['Id'])
+            else:
+                retry_ids.add(failure['Id'])
+        pending = [entry for entry in pending if entry['Id'] in retry_ids]
+        if not pending:
+            break
+    return failed_ids
+
+def write_results(tasks):
+    """把一批结果提交到后台线程写入S3，返回与 tasks 一一对应的 Future 列表"""
+    if RESULT_AGGREGATE:
+        # 聚合模式：整批结果写入一个对象，每行一个 filename,classification
+        key = f"{RESULT_AGGREGATE_PREFIX}{int(time.time() * 1000)}-{uuid.uuid4().hex}.csv"
+        body = '\n'.join(f"{task['filename']},{task['classification']}" for task in tasks)
+        future = result_writer.submit(
+            s3.put_object, Bucket=OUTPUT_BUCKET, Body=body, Key=key
+        )
+        return [future] * len(tasks)
+    return [
+        result_writer.submit(save_result, task['filename'], task['classification'])
+        for task in tasks
+    ]
+
+def response_attributes(task):
+    """响应消息属性：request_id，以及启用时的阶段时间戳（JSON，毫秒精度）"""
+    attributes = {
+        'request_id': {
+            'StringValue': task['request_id'],
+            'DataType': 'String'
+        }
+    }
+    if TRACE_ENABLED and task.get('trace'):
+        trace = {stage: round(timestamp, 3) for stage, timestamp in task['trace'].items()}
+        trace['published'] = round(time.time(), 3)
+        attributes['trace'] = {
+            'StringValue': json.dumps(trace, separators=(',', ':')),
+            'DataType': 'String'
+        }
+    return attributes
+
+def publish_tasks(tasks):
+    """发布阶段：批量发送响应、批量删除请求消息；S3写入在后台与SQS调用重叠进行
+
+    只有响应发送成功且结果已写入S3的请求才会被删除；
+    其余请求（包括处理失败的）通过批量修改可见性立即放回队列重新处理。
+    """
+    start_time = time.perf_counter()
+    done = [task for task in tasks if not task['error'] and task['classification']]
+    failed = [task for task in tasks if task['error'] or not task['classification']]
+    succeeded = []
+
+    if done:
+        # 先提交S3写入，与下面的SQS批量发送并行
+        write_futures = write_results(done)
+
+        # 按 reply_to 分组，把结果批量发送到发出请求的web节点的响应队列（未指定时使用默认响应队列），
+        # 使用消息属性携带request_id和阶段时间戳
+        by_queue = defaultdict(list)
+        for index, task in enumerate(done):
+            by_queue[task.get('reply_to') or RESPONSE_QUEUE_URL].append((index, task))
+        send_failed = set()
+        for queue_url, entries in by_queue.items():
+            send_failed |= sqs_batch(sqs.send_message_batch, queue_url, [
+                {
+                    'Id': str(index),
+                    'MessageBody': json.dumps({
+                        'result': task['classification'],
+                        'filename': task['filename']
+                    }),
+                    'MessageAttributes': response_attributes(task)
+                }
+                for index, task in entries
+            ], missing_ok=queue_url != RESPONSE_QUEUE_URL)
+
+        for index, (task, future) in enumerate(zip(done, write_futures)):
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"保存结果到S3失败: {task['filename']}, {str(e)}")
+                failed.append(task)
+                continue
+            if str(index) in send_failed:
+                failed.append(task)
+            else:
+                succeeded.append(task)
+                logger.info(f"结果已发送到响应队列: {task['request_id']}")
+
+    if succeeded:
+        # 成功处理后批量删除消息
+        delete_failed = sqs_batch(sqs.delete_message_batch, REQUEST_QUEUE_URL, [
+            {'Id': str(index), 'ReceiptHandle': task['receipt_handle']}
+            for index, task in enumerate(succeeded)
+        ])
+        if delete_failed:
+            logger.warning(f"{len(delete_failed)} 条请求消息删除失败，可见性超时后将被重复处理")
+        logger.debug(f"已删除 {len(succeeded) - len(delete_failed)} 条请求消息")
+
+        if processed_counter is not None:
+            with processed_counter.get_lock():
+                processed_counter.value += len(succeeded)
+
+    if failed:
+        # 处理失败，将消息放回队列（立即可见）
+        for task in failed:
+            logger.warning(f"处理失败，将消息放回队列: {task['filename']}")
+        sqs_batch(sqs.change_message_visibility_batch, REQUEST_QUEUE_URL, [
+            {'Id': str(index), 'ReceiptHandle': task['receipt_handle'], 'VisibilityTimeout': 0}
+            for index, task in enumerate(failed)
+        ])
+
+    now = time.time()
+    for task in succeeded:
+        if task.get('enqueued_at'):
+            end_to_end_seconds.observe(max(0.0, now - task['enqueued_at']))
+    completed_total.inc(len(succeeded))
+    failed_total.inc(len(failed))
+    inflight_tasks.dec(len(tasks))
+    inflight_slots.release(len(tasks))
+    publish_seconds.observe(time.perf_counter() - start_time)
+    return []
+
+def build_pipeline():
+    """构建 接收 -> 下载 -> 解码 -> 推理 -> 发布 五阶段流水线"""
+    fetch_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    decode_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    infer_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    publish_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    stages = [
+        Stage('receive', receive_tasks, output_queue=fetch_queue),
+        Stage('fetch', fetch_task, fetch_queue, decode_queue, workers=FETCH_THREADS),
+        Stage('decode', decode_task, decode_queue, infer_queue, workers=DECODE_THREADS),
+        Stage('infer', infer_tasks, infer_queue, publish_queue,
+              batch_size=BATCH_MAX_SIZE, linger=BATCH_LINGER_SECONDS),
+        Stage('publish', publish_tasks, publish_queue, workers=PUBLISH_THREADS,
+              batch_size=SQS_MAX_MESSAGES, linger=PUBLISH_LINGER_SECONDS),
+    ]
+    for stage in stages:
+        if stage.input_queue is not None:
+            metrics.gauge('worker_stage_queue_depth', '各流水线阶段输入队列中等待的任务数',
+                          labels={'stage': stage.name}, function=stage.input_queue.qsize)
+    return Pipeline(stages, stats_interval=PIPELINE_STATS_INTERVAL)
+
+def get_instance_id():
+    """通过 IMDSv2 获取当前EC2实例ID，不在EC2上运行时返回None"""
+    try:
+        token_request = urllib.request.Request(
+            'http://169.254.169.254/latest/api/token', method='PUT',
+            headers={'X-aws-ec2-metadata-token-ttl-seconds': '60'}
+        )
+        token = urllib.request.urlopen(token_request, timeout=1).read().decode()
+        id_request = urllib.request.Request(
+            'http://169.254.169.254/latest/meta-data/instance-id',
+            headers={'X-aws-ec2-metadata-token': token}
+        )
+        return urllib.request.urlopen(id_request, timeout=1).read().decode()
+    except Exception:
         return None
 
+def signal_ready(startup_info):
+    """发布就绪信号：写出本地就绪文件，并给当前实例打上就绪标签"""
+    if READY_FILE:
+        try:
+            temp_path = f"{READY_FILE}.{os.getpid()}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump(startup_info, f)
+            os.replace(temp_path, READY_FILE)
+            logger.info(f"就绪文件已写出: {READY_FILE}")
+        except OSError as e:
+            logger.error(f"写出就绪文件失败: {str(e)}")
 
-if __name__ == '__main__':
-    logger.info("Worker 启动")
-    
-    while True:
+    if READY_TAG_ENABLED:
+        instance_id = get_instance_id()
+        if not instance_id:
+            logger.info("未获取到实例ID（可能不在EC2上运行），跳过就绪标签")
+            return
         try:
-            # 从请求 SQS 获取消息
-            logger.debug("轮询请求队列...")
-            response = sqs.receive_message(
-                QueueUrl=REQUEST_QUEUE_URL,
-                MaxNumberOfMessages=1,
-                WaitTimeSeconds=20,
-                MessageAttributeNames=['All']  # 获取所有消息属性
+            ec2 = boto3.client('ec2', region_name=AWS_REGION)
+            ec2.create_tags(
+                Resources=[instance_id],
+                Tags=[{'Key': READY_TAG_KEY, 'Value': 'true'}]
             )
-            
-            if 'Messages' in response:
-                for message in response['Messages']:
-                    try:
-                        body = json.loads(message['Body'])
-                        filename = body.get('filename')
-                        request_id = body.get('request_id')
-                        receipt_handle = message['ReceiptHandle']
-                        
-                        # 添加消息属性到日志
-                        attrs = message.get('MessageAttributes', {})
-                        logger.info(f"收到新任务: {filename}, RequestID: {request_id}")
-                        
-                        # 处理图像
-                        classification = process_image(filename)
-                        if classification:
-                            # 发送结果到响应队列，使用消息属性携带request_id
-                            sqs.send_message(
-                                QueueUrl=RESPONSE_QUEUE_URL,
-                                MessageBody=json.dumps({
-                                    'result': classification
-                                }),
-                                MessageAttributes={
-                                    'request_id': {
-                                        'StringValue': request_id,
-                                        'DataType': 'String'
-                                    }
-                                }
-                            )
-                            logger.info(f"结果已发送到响应队列: {request_id}")
-                            
-                            # 成功处理后删除消息
-                            sqs.delete_message(
-                                QueueUrl=REQUEST_QUEUE_URL,
-                                ReceiptHandle=receipt_handle
-                            )
-                            logger.debug("请求消息已删除")
-                        else:
-                            # 处理失败，将消息放回队列
-                            logger.warning(f"处理失败，将消息放回队列: {filename}")
-                            sqs.change_message_visibility(
-                                QueueUrl=REQUEST_QUEUE_URL,
-                                ReceiptHandle=receipt_handle,
-                                VisibilityTimeout=0  # 立即可见
-                            )
-                    except json.JSONDecodeError:
-                        logger.error("无效的JSON消息体")
-                        # 删除无效消息
-                        sqs.delete_message(
-                            QueueUrl=REQUEST_QUEUE_URL,
-                            ReceiptHandle=receipt_handle
-                        )
-                    except Exception as e:
-                        logger.exception(f"处理消息时出错: {str(e)}")
-            else:
-                # 队列为空时暂停
-                logger.debug("队列为空，等待5秒")
-                time.sleep(5)
-                
-        except boto3.exceptions.Boto3Error as e:
-            logger.error(f"AWS服务错误: {str(e)}")
-            time.sleep(10)
+            logger.info(f"实例 {instance_id} 已打上就绪标签 {READY_TAG_KEY}=true")
         except Exception as e:
-            logger.exception(f"未处理的错误: {str(e)}")
-            time.sleep(10)
\ No newline at end of file
+            logger.error(f"设置就绪标签失败: {str(e)}")
+
+def clear_ready():
+    """撤销就绪信号：删除本地就绪文件和实例的就绪标签（同一实例上重启的 worker 在模型加载完成前不应显示为就绪）"""
+    if READY_FILE:
+        try:
+            os.remove(READY_FILE)
+            logger.info(f"已删除就绪文件: {READY_FILE}")
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"删除就绪文件失败: {str(e)}")
+
+    if READY_TAG_ENABLED:
+        instance_id = get_instance_id()
+        if not instance_id:
+            return
+        try:
+            ec2 = boto3.client('ec2', region_name=AWS_REGION)
+            ec2.delete_tags(Resources=[instance_id], Tags=[{'Key': READY_TAG_KEY}])
+            logger.info(f"已删除实例 {instance_id} 的就绪标签 {READY_TAG_KEY}")
+        except Exception as e:
+            logger.error(f"删除就绪标签失败: {str(e)}")
+
+# 监督模式下由子进程入口设置的 torch 线程数，None 为使用 torch 的默认值
+torch_num_threads = None
+
+def load_model():
+    """加载并预热模型，完成后发布就绪信号"""
+    global classifier
+
+    load_start = time.time()
+    # 模型和标签只加载一次，后续所有消息复用
+    classifier = ImageClassifier(variant=MODEL_VARIANT, calibration_dir=CALIBRATION_DIR,
+                                 weights_path=MODEL_WEIGHTS_PATH, num_threads=torch_num_threads)
+    classifier.warm_up()
+
+    now = time.time()
+    startup_info = {
+        'pid': os.getpid(),
+        'variant': MODEL_VARIANT,
+        'model_load_seconds': round(now - load_start, 3),
+        'startup_seconds': round(now - PROCESS_START_TIME, 3),
+        'ready_time': now
+    }
+    logger.info(f"分类模型加载完成: {MODEL_VARIANT}, 加载耗时 {startup_info['model_load_seconds']} 秒, "
+                f"距进程启动 {startup_info['startup_seconds']} 秒")
+    signal_ready(startup_info)
+
+def start_metrics_exporters(index=0):
+    """启动本进程的指标导出（HTTP端口和/或JSON文件）"""
+    if METRICS_PORT:
+        try:
+            start_http_exporter(metrics, METRICS_PORT + index)
+            logger.info(f"指标导出端口: {METRICS_PORT + index}")
+        except OSError as e:
+            logger.error(f"启动指标导出端口失败: {METRICS_PORT + index}, {str(e)}")
+    if METRICS_FILE:
+        path = METRICS_FILE.replace('{index}', str(index))
+        start_file_exporter(metrics, path, METRICS_FILE_INTERVAL)
+        logger.info(f"指标快照文件: {path}")
+
+def run_worker(counter=None, index=0):
+    """单个推理进程的主循环：先加载模型，再启动流水线"""
+    global processed_counter
+
+    processed_counter = counter
+    clear_ready()
+    start_metrics_exporters(index)
+    logger.info(f"批处理配置: 最大批次 {BATCH_MAX_SIZE}, 等待窗口 {BATCH_LINGER_SECONDS} 秒")
+    logger.info(f"流水线配置: 队列长度 {PIPELINE_QUEUE_SIZE}, 下载线程 {FETCH_THREADS}, "
+                f"解码线程 {DECODE_THREADS}, 发布线程 {PUBLISH_THREADS}")
+
+    # 模型就绪后才开始接收消息，否则冷启动期间收到的消息会在等待模型时耗尽可见性超时
+    load_model()
+    pipeline = build_pipeline()
+    pipeline.start()
+    pipeline.monitor()
+
+def physical_core_count():
+    """返回物理核数，未安装psutil时按 sysfs 拓扑信息把可用的逻辑CPU分组计数"""
+    if psutil is not None:
+        count = psutil.cpu_count(logical=False)
+        if count:
+            return count
+    return len(cpu_cores(available_cpus()))
+
+def available_cpus():
+    """返回当前进程可用的CPU编号列表"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def read_cpu_topology(cpu, name):
+    try:
+        with open(f"/sys/devices/system/cpu/cpu{cpu}/topology/{name}") as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+def cpu_cores(cpus):
+    """把逻辑CPU按物理核分组（同一物理核上的超线程在同一组），按 sysfs 拓扑信息读取，
+    读取不到时每个逻辑CPU单独成组"""
+    cores = {}
+    for cpu in cpus:
+        core_id = read_cpu_topology(cpu, 'core_id')
+        key = (read_cpu_topology(cpu, 'physical_package_id'), core_id) if core_id is not None else ('cpu', cpu)
+        cores.setdefault(key, []).append(cpu)
+    return list(cores.values())
+
+def worker_process_main(index, processed_counter, cpus, num_threads):
+    """子进程入口：绑定CPU后运行推理主循环，torch 线程数在加载模型时设置"""
+    global torch_num_threads
+
+    if cpus and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cpus)
+    torch_num_threads = num_threads
+    logger.info(f"推理进程 {index} 启动: pid {os.getpid()}, CPU {cpus}, torch线程数 {num_threads}")
+    run_worker(processed_counter, index)
+
+def run_supervisor(num_processes):
+    """监督进程：启动多个推理进程，重启崩溃的子进程并定期报告各进程吞吐量
+
+    每个子进程使用各自的 boto3 客户端独立轮询同一个请求队列，
+    由 SQS 在进程之间分发消息（boto3 客户端不能跨进程共享）。
+    """
+    clear_ready()
+    # 使用spawn避免在已导入torch的进程中fork
+    ctx = multiprocessing.get_context('spawn')
+    # 按物理核分配CPU：每个进程获得完整的物理核，同一物理核的超线程不会分给两个进程
+    cores = cpu_cores(available_cpus())
+    cores_per_process = max(1, len(cores) // num_processes)
+    num_threads = TORCH_THREADS_PER_PROCESS or cores_per_process
+    counters = [ctx.Value('L', 0) for _ in range(num_processes)]
+    restarts = [0] * num_processes
+
+    def start_process(index):
+        assigned = sorted(cpu for i in range(cores_per_process)
+                          for cpu in cores[(index * cores_per_process + i) % len(cores)])
+        process = ctx.Process(
+            target=worker_process_main,
+            args=(index, counters[index], assigned, num_threads),
+            name=f"worker-{index}"
+        )
+        process.start()
+        return process
+
+    logger.info(f"监督模式启动: {num_processes} 个推理进程, 每进程 {cores_per_process} 个物理核, "
+                f"{num_threads} 个torch线程")
+    processes = [start_process(index) for index in range(num_processes)]
+    last_counts = [0] * num_processes
+    last_report_time = time.time()
+
+    try:
+        while True:
+            time.sleep(SUPERVISOR_CHECK_INTERVAL)
+
+            # 重启已退出的子进程
+            for index, process in enumerate(processes):
+                if not process.is_alive():
+                    restarts[index] += 1
+                    logger.warning(f"推理进程 {index} (pid {process.pid}) 已退出, 退出码 {process.exitcode}, 第 {restarts[index]} 次重启")
+                    processes[index] = start_process(index)
+
+            # 定期报告各进程吞吐量
+            now = time.time()
+            elapsed = now - last_report_time
+            if elapsed >= SUPERVISOR_REPORT_INTERVAL:
+                total_rate = 0.0
+                for index, counter in enumerate(counters):
+                    count = counter.value
+                    rate = (count - last_counts[index]) / elapsed
+                    total_rate += rate
+                    last_counts[index] = count
+                    logger.info(f"推理进程 {index} (pid {processes[index].pid}): 累计处理 {count} 张, 吞吐量 {rate:.2f} 张/秒, 重启 {restarts[index]} 次")
+                logger.info(f"总吞吐量: {total_rate:.2f} 张/秒")
+                last_report_time = now
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join(timeout=10)
+        logger.info("所有推理进程已停止")
+
+
+if __name__ == '__main__':
+    logger.info(f"配置文件路径: {CONFIG_PATH}")
+    logger.info("Worker 启动")
+
+    num_processes = WORKER_PROCESSES or physical_core_count()
+    if num_processes > 1:
+        run_supervisor(num_processes)
+    else:
+        run_worker()
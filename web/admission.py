@@ -0,0 +1,139 @@
+# File: admission.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/admission.py
+# 准入控制：限制web层同时处理的请求数，并按请求队列深度和worker的处理速率估计排队时间，
+# 超过上限时立即拒绝（429 + Retry-After），而不是接受注定超时的请求
+import logging
+import math
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionController:
+    """在途请求上限 + 排队时间估计
+
+    - 在途请求数：try_acquire(cost) 成功后计入，调用方处理结束时 release(cost)；
+      超过 max_inflight 时拒绝（没有在途请求时总是接受，使大于上限的批量请求也能执行）
+    - 排队时间估计：(请求队列中的消息数 + 上次采样后新接受的请求数) / 处理速率，
+      队列深度每 sample_interval 秒采样一次，处理速率取 get_drain_rate() 的指数移动平均；超过 max_wait 秒时拒绝。
+      只有最近一次采样到的处理速率大于 0 时才检查：worker 冷启动或全部空闲时没有可靠的估计，
+      此时的突发请求交给自动伸缩器消化，而不是被拒绝。
+      请求队列由所有web节点共用，而处理速率只反映本节点的响应，因此队列深度按 get_node_count() 均分到各节点
+
+    max_inflight 或 max_wait 为 0 时不启用对应的检查。在途请求超限时按处理速率估计 Retry-After，
+    因此处理速率在 max_wait 为 0 时也会采样。
+    """
+
+    def __init__(self, get_client, queue_url, shutdown_event, get_drain_rate, get_node_count=None,
+                 max_inflight=0, max_wait=0, sample_interval=5, smoothing=0.3,
+                 min_retry_after=1, max_retry_after=60):
+        self.get_client = get_client
+        self.queue_url = queue_url
+        self.shutdown_event = shutdown_event
+        self.get_drain_rate = get_drain_rate
+        self.get_node_count = get_node_count
+        self.max_inflight = max_inflight
+        self.max_wait = max_wait
+        self.sample_interval = sample_interval
+        self.smoothing = smoothing
+        self.min_retry_after = min_retry_after
+        self.max_retry_after = max_retry_after
+
+        self._lock = threading.Lock()
+        self.inflight = 0
+        self.queue_depth = 0
+        self.node_count = 1
+        # 处理速率的指数移动平均，以及最近一次采样的原始值
+        self.drain_rate = None
+        self.last_drain_rate = 0.0
+        self._admitted_since_sample = 0
+        self.admitted = 0
+        self.rejected = {'inflight': 0, 'wait': 0}
+
+    def start(self):
+        # 处理速率总是采样（在途请求超限时据此计算 Retry-After），队列深度只在启用排队时间检查时采样
+        threading.Thread(target=self._sample_loop, name='admission-sampler', daemon=True).start()
+
+    def _retry_after(self, seconds):
+        return int(min(self.max_retry_after, max(self.min_retry_after, math.ceil(seconds))))
+
+    def _wait(self, cost):
+        """在持有锁时估计排队时间（秒），没有可靠的处理速率时返回 None"""
+        if not self.drain_rate or self.last_drain_rate <= 0:
+            return None
+        return (self.queue_depth / self.node_count + self._admitted_since_sample + cost) / self.drain_rate
+
+    def estimated_wait(self, cost=1):
+        """按当前队列深度估计新请求的排队时间（秒），无法估计时返回 None"""
+        with self._lock:
+            return self._wait(cost)
+
+    def try_acquire(self, cost=1, held=0):
+        """尝试接受 cost 个请求，返回 (是否接受, 建议的重试等待秒数, 拒绝原因)
+
+        held 为调用方已经持有的数量（如批量请求读取请求体之前先取得的1个），
+        除此之外没有在途请求时同样总是接受。
+        """
+        with self._lock:
+            if self.max_inflight and self.inflight > held and self.inflight + cost > self.max_inflight:
+                self.rejected['inflight'] += 1
+                excess = self.inflight + cost - self.max_inflight
+                # 还没有处理速率时，建议至少等到下一次采样
+                rate = self.drain_rate or self.get_drain_rate()
+                return False, self._retry_after(excess / rate if rate else self.sample_interval), 'inflight'
+            if self.max_wait:
+                wait = self._wait(cost)
+                if wait is not None and wait > self.max_wait:
+                    self.rejected['wait'] += 1
+                    return False, self._retry_after(wait - self.max_wait), 'wait'
+            self.inflight += cost
+            self._admitted_since_sample += cost
+            self.admitted += cost
+            return True, None, None
+
+    def release(self, cost=1):
+        with self._lock:
+            self.inflight -= cost
+
+    def _sample_loop(self):
+        sqs = self.get_client()
+        while not self.shutdown_event.is_set():
+            try:
+                depth, node_count = 0, 1
+                if self.max_wait:
+                    attributes = sqs.get_queue_attributes(
+                        QueueUrl=self.queue_url,
+                        AttributeNames=['ApproximateNumberOfMessages', 'ApproximateNumberOfMessagesNotVisible']
+                    )['Attributes']
+                    # 正在处理的消息也需要在新请求之前完成
+                    depth = int(attributes.get('ApproximateNumberOfMessages', 0)) + \
+                        int(attributes.get('ApproximateNumberOfMessagesNotVisible', 0))
+                    node_count = max(1, self.get_node_count()) if self.get_node_count else 1
+                rate = self.get_drain_rate() or 0.0
+                with self._lock:
+                    self.queue_depth = depth
+                    self.node_count = node_count
+                    self._admitted_since_sample = 0
+                    self.last_drain_rate = rate
+                    if self.drain_rate is None:
+                        self.drain_rate = rate
+                    else:
+                        self.drain_rate += self.smoothing * (rate - self.drain_rate)
+            except Exception as e:
+                logger.error(f"获取请求队列深度失败: {str(e)}")
+            self.shutdown_event.wait(self.sample_interval)
+
+    def stats(self):
+        with self._lock:
+            wait = self._wait(0)
+            return {
+                'inflight': self.inflight,
+                'max_inflight': self.max_inflight,
+                'queue_depth': self.queue_depth,
+                'node_count': self.node_count,
+                'drain_rate': round(self.drain_rate or 0.0, 2),
+                'estimated_wait': None if wait is None else round(wait, 2),
+                'max_wait': self.max_wait,
+                'admitted': self.admitted,
+                'rejected': dict(self.rejected)
+            }
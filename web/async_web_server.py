@@ -0,0 +1,423 @@
+# File: async_web_server.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/async_web_server.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/web_server_config.json
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/cache.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/inline_payload.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/sqs_batcher.py
+# 异步服务模式：与 web_server.py 提供相同的接口，但基于 asyncio（aiohttp + aiobotocore），
+# 每个长轮询客户端只占用一个协程而不是一个线程。web_server.py（Flask）仍可作为备用方案运行。
+# 依赖: pip install aiohttp aiobotocore
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+
+from botocore.config import Config
+
+from cache import LRUCache
+from inline_payload import build_request_message
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+try:
+    from aiohttp import web
+    from aiobotocore.session import get_session
+except ImportError:
+    logger.error("异步服务模式需要安装 aiohttp 和 aiobotocore: pip install aiohttp aiobotocore")
+    raise
+
+# 通过环境变量指定配置文件路径（与 web_server.py 共用同一个配置文件）
+# 如果是Windows 系统
+if os.name == 'nt':
+    CONFIG_PATH = os.environ.get('WEB_SERVER_CONFIG_PATH', r".\code\web\web_server_config.json")
+# 如果是Linux 系统
+else:
+    CONFIG_PATH = os.environ.get('WEB_SERVER_CONFIG_PATH', '/home/us2-user/web/web_server_config.json')
+
+# 读取配置文件
+try:
+    with open(CONFIG_PATH, 'r') as f:
+        config = json.load(f)
+except FileNotFoundError:
+    logger.error("未找到配置文件 web_server_config.json")
+    raise
+
+# AWS 配置（带默认值）
+AWS_REGION = config.get("AWS_REGION", "us-east-1")
+INPUT_BUCKET = config.get("INPUT_BUCKET", "project2-input-bucket-abc")
+OUTPUT_BUCKET = config.get("OUTPUT_BUCKET", "project2-output-bucket-xyz")
+REQUEST_QUEUE_URL = config.get("REQUEST_QUEUE_URL", "https://sqs.us-east-1.amazonaws.com/257288819129/request-queue")
+RESPONSE_QUEUE_URL = config.get("RESPONSE_QUEUE_URL", "https://sqs.us-east-1.amazonaws.com/257288819129/response-queue")
+
+# 性能优化参数（带默认值）
+SQS_MAX_MESSAGES = config.get("SQS_MAX_MESSAGES", 10)
+CLEANUP_INTERVAL = config.get("CLEANUP_INTERVAL", 300)
+REQUEST_TIMEOUT = config.get("REQUEST_TIMEOUT", 360)
+LONG_POLL_TIMEOUT = config.get("LONG_POLL_TIMEOUT", 300)
+
+# 结果缓存参数（带默认值）
+RESULT_CACHE_MAX_ENTRIES = config.get("RESULT_CACHE_MAX_ENTRIES", 10000)
+RESULT_CACHE_TTL = config.get("RESULT_CACHE_TTL", 3600)
+
+# 异步服务参数（带默认值）
+ASYNC_SERVER_PORT = config.get("ASYNC_SERVER_PORT", 5000)
+ASYNC_MAX_POOL_CONNECTIONS = config.get("ASYNC_MAX_POOL_CONNECTIONS", 100)
+
+# 内联传输参数（与 web_server.py 相同）
+INLINE_PAYLOADS = config.get("INLINE_PAYLOADS", True)
+INLINE_MAX_MESSAGE_BYTES = config.get("INLINE_MAX_MESSAGE_BYTES", 262144)
+INLINE_COMPRESSION = config.get("INLINE_COMPRESSION", False)
+
+# 配置重试策略
+client_config = Config(
+    retries={
+        'max_attempts': 5,
+        'mode': 'adaptive'
+    },
+    max_pool_connections=ASYNC_MAX_POOL_CONNECTIONS
+)
+
+# 记录所有请求及其状态（只在事件循环线程中访问，无需加锁）
+request_records = {}
+
+# 内容哈希 -> 分类结果 的缓存
+label_cache = LRUCache(RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_TTL)
+# 内容哈希 -> 正在处理中的request_id
+inflight_requests = {}
+coalesced_count = 0
+
+
+def finish_request(record, **updates):
+    """更新请求记录并唤醒所有等待该请求的协程"""
+    record.update(updates)
+    record['event'].set()
+
+
+def release_inflight(digest, request_id):
+    """请求结束后移除内容哈希到request_id的在途映射"""
+    if inflight_requests.get(digest) == request_id:
+        del inflight_requests[digest]
+
+
+@web.middleware
+async def handle_errors(request, handler):
+    """统一错误处理中间件"""
+    try:
+        return await handler(request)
+    except web.HTTPException:
+        raise
+    except Exception as e:
+        logger.exception(f"API处理错误: {str(e)}")
+        return web.json_response({
+            'error': 'Internal server error',
+            'details': str(e)
+        }, status=500)
+
+
+async def process_request_status(request_id, poll_timeout=LONG_POLL_TIMEOUT):
+    """处理请求状态并返回标准化响应"""
+    # 获取请求记录
+    record = request_records.get(request_id)
+    if not record:
+        return web.json_response({
+            'request_id': request_id,
+            'status': 'not_found',
+            'message': 'Request ID not found'
+        }, status=404)
+
+    # 长轮询逻辑：等待完成事件
+    if record['status'] == 'pending':
+        try:
+            await asyncio.wait_for(record['event'].wait(), poll_timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    # 检查请求是否超时
+    if record['status'] == 'pending' and (time.time() - record['timestamp'] > REQUEST_TIMEOUT):
+        finish_request(record, status='timeout', expires_at=time.time() + REQUEST_TIMEOUT)
+
+    # 构建并返回标准化响应
+    if record['status'] == 'completed':
+        return web.Response(text=record['result'], content_type='text/plain')
+    return web.json_response({
+        'request_id': request_id,
+        'status': record['status'],
+        'message': 'Result not ready yet'
+    }, status=202)
+
+
+async def upload_file(request):
+    logger.info("收到新的分类请求")
+    global coalesced_count
+
+    # 读取 multipart 表单中的 myfile 部分
+    file_data = None
+    original_filename = None
+    if request.content_type.startswith('multipart/'):
+        reader = await request.multipart()
+        async for part in reader:
+            if part.name == 'myfile':
+                original_filename = part.filename
+                file_data = await part.read()
+                break
+
+    if file_data is None:
+        logger.warning("请求缺少文件部分")
+        return web.Response(text='No myfile part', status=400)
+    if not original_filename:
+        logger.warning("请求包含空文件名")
+        return web.Response(text='No selected file', status=400)
+
+    # 获取长轮询超时参数
+    poll_timeout = int(request.query.get('timeout', LONG_POLL_TIMEOUT))
+
+    # 相同内容最近已分类过，直接返回缓存结果
+    digest = hashlib.sha256(file_data).hexdigest()
+    cached_result = label_cache.get(digest)
+    if cached_result is not None:
+        logger.info(f"结果缓存命中: {digest}")
+        return web.Response(text=cached_result, content_type='text/plain')
+
+    # 相同内容的请求正在处理中时，复用其request_id
+    inflight_id = inflight_requests.get(digest)
+    inflight_record = request_records.get(inflight_id) if inflight_id else None
+    if inflight_record and inflight_record['status'] == 'pending':
+        coalesced_count += 1
+        logger.info(f"相同内容的请求正在处理中，合并到 RequestID: {inflight_id}")
+        return await process_request_status(inflight_id, poll_timeout)
+
+    # 生成唯一ID
+    filename = f"{uuid.uuid4()}_{original_filename}"
+    request_id = str(uuid.uuid4())
+    logger.info(f"生成文件名: {filename}, RequestID: {request_id}")
+
+    # 记录请求状态
+    inflight_requests[digest] = request_id
+    request_records[request_id] = {
+        'filename': filename,
+        'status': 'pending',
+        'timestamp': time.time(),
+        'result': None,
+        'digest': digest,
+        'event': asyncio.Event()
+    }
+
+    try:
+        body, attributes, inline = build_request_message(
+            filename, request_id, file_data,
+            inline=INLINE_PAYLOADS,
+            max_message_bytes=INLINE_MAX_MESSAGE_BYTES,
+            compress=INLINE_COMPRESSION
+        )
+        if inline:
+            logger.info(f"图像内联在请求消息中: {filename}, {len(file_data)} 字节")
+        else:
+            # 上传到S3
+            await request.app['s3'].put_object(Bucket=INPUT_BUCKET, Key=filename, Body=file_data)
+            logger.info(f"文件上传成功: {INPUT_BUCKET}/{filename}")
+
+        # 发送到SQS请求队列
+        await request.app['sqs'].send_message(
+            QueueUrl=REQUEST_QUEUE_URL,
+            MessageBody=body,
+            MessageAttributes=attributes
+        )
+        logger.info(f"请求发送到SQS队列: {REQUEST_QUEUE_URL}")
+    except Exception:
+        finish_request(request_records[request_id], status='error')
+        release_inflight(digest, request_id)
+        raise
+
+    return await process_request_status(request_id, poll_timeout)
+
+
+async def get_status(request):
+    """长轮询检查请求状态"""
+    poll_timeout = int(request.query.get('timeout', LONG_POLL_TIMEOUT))
+    return await process_request_status(request.match_info['request_id'], poll_timeout)
+
+
+async def get_result(request):
+    """通过文件名获取结果"""
+    filename = request.match_info['filename']
+    logger.info(f"获取结果请求: {filename}")
+
+    s3 = request.app['s3']
+    try:
+        response = await s3.get_object(Bucket=OUTPUT_BUCKET, Key=filename)
+        async with response['Body'] as stream:
+            result = (await stream.read()).decode('utf-8')
+    except s3.exceptions.NoSuchKey:
+        logger.warning(f"结果尚未就绪: {filename}")
+        return web.json_response({
+            'message': 'Result not ready yet',
+            'filename': filename
+        }, status=404)
+
+    logger.info(f"成功返回结果: {filename}")
+    return web.json_response({
+        'filename': filename,
+        'result': result
+    })
+
+
+async def get_cache_stats(request):
+    """返回结果缓存的命中率、淘汰次数和请求合并次数"""
+    stats = label_cache.stats()
+    stats['coalesced'] = coalesced_count
+    stats['inflight'] = len(inflight_requests)
+    return web.json_response(stats)
+
+
+async def process_sqs_messages(app):
+    """后台协程：处理SQS响应队列消息"""
+    logger.info("SQS消息处理协程启动")
+    sqs = app['sqs']
+
+    while True:
+        try:
+            response = await sqs.receive_message(
+                QueueUrl=RESPONSE_QUEUE_URL,
+                MaxNumberOfMessages=SQS_MAX_MESSAGES,
+                WaitTimeSeconds=20,  # 长轮询
+                MessageAttributeNames=['request_id']
+            )
+
+            messages = response.get('Messages', [])
+            if messages:
+                logger.info(f"收到 {len(messages)} 条响应消息")
+
+            processed_messages = []
+            for message in messages:
+                processed_messages.append({
+                    'Id': message['MessageId'],
+                    'ReceiptHandle': message['ReceiptHandle']
+                })
+                try:
+                    # 解析消息
+                    attrs = message.get('MessageAttributes', {})
+                    msg_request_id = attrs.get('request_id', {}).get('StringValue')
+                    if not msg_request_id:
+                        logger.warning("收到的消息缺少request_id属性，丢弃")
+                        continue
+
+                    # 更新请求状态
+                    body = json.loads(message['Body'])
+                    result = body.get('result')
+
+                    record = request_records.get(msg_request_id)
+                    if record is not None:
+                        finish_request(record, result=result, status='completed')
+                        logger.info(f"更新请求状态: {msg_request_id} -> completed")
+
+                        # 写入结果缓存
+                        digest = record.get('digest')
+                        if digest and result is not None:
+                            label_cache.put(digest, result)
+                            release_inflight(digest, msg_request_id)
+                    else:
+                        logger.warning(f"收到未知请求ID的响应: {msg_request_id}")
+                except (json.JSONDecodeError, KeyError) as e:
+                    logger.error(f"消息处理错误: {str(e)}，丢弃消息")
+
+            # 批量删除已处理消息
+            if processed_messages:
+                await sqs.delete_message_batch(
+                    QueueUrl=RESPONSE_QUEUE_URL,
+                    Entries=processed_messages
+                )
+                logger.debug(f"成功删除 {len(processed_messages)} 条SQS消息")
+
+        except asyncio.CancelledError:
+            break
+        except Exception as e:
+            logger.error(f"处理SQS消息时出错: {str(e)}")
+            await asyncio.sleep(5)  # 短暂暂停后重试
+
+    logger.info("SQS消息处理协程停止")
+
+
+async def cleanup_expired_records():
+    """后台协程：清理过期的请求记录"""
+    logger.info("请求记录清理协程启动")
+
+    while True:
+        try:
+            await asyncio.sleep(CLEANUP_INTERVAL)
+        except asyncio.CancelledError:
+            break
+
+        # 与 Flask 版本的规则相同：超过 REQUEST_TIMEOUT 仍未收到结果的请求标记为超时并唤醒等待者，
+        # 再保留 REQUEST_TIMEOUT 秒使查询能看到超时状态；已结束的记录在创建 REQUEST_TIMEOUT 秒后删除
+        now = time.time()
+        expired_ids, overdue_ids = [], []
+        for rid, record in list(request_records.items()):
+            if record['status'] == 'pending':
+                if now - record['timestamp'] > REQUEST_TIMEOUT:
+                    finish_request(record, status='timeout', expires_at=now + REQUEST_TIMEOUT)
+                    if record.get('digest'):
+                        release_inflight(record['digest'], rid)
+                    overdue_ids.append(rid)
+            elif now > record.get('expires_at', record['timestamp'] + REQUEST_TIMEOUT):
+                expired_ids.append(rid)
+        for rid in expired_ids:
+            record = request_records.pop(rid, None)
+            if record and record.get('digest'):
+                release_inflight(record['digest'], rid)
+        if expired_ids or overdue_ids:
+            logger.info(f"清理了 {len(expired_ids)} 条过期记录，{len(overdue_ids)} 条请求超时")
+
+    logger.info("请求记录清理协程停止")
+
+
+async def aws_clients(app):
+    """应用生命周期内共享的异步 S3/SQS 客户端"""
+    session = get_session()
+    async with session.create_client('s3', region_name=AWS_REGION, config=client_config) as s3, \
+            session.create_client('sqs', region_name=AWS_REGION, config=client_config) as sqs:
+        app['s3'] = s3
+        app['sqs'] = sqs
+        yield
+
+
+async def background_tasks(app):
+    """启动后台协程，应用关闭时取消"""
+    tasks = [
+        asyncio.create_task(process_sqs_messages(app)),
+        asyncio.create_task(cleanup_expired_records())
+    ]
+    yield
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    # 唤醒所有仍在长轮询的协程
+    for record in request_records.values():
+        record['event'].set()
+
+
+def create_app():
+    app = web.Application(middlewares=[handle_errors])
+    app.router.add_post('/classify', upload_file)
+    app.router.add_get('/status/{request_id}', get_status)
+    app.router.add_get('/result/{filename}', get_result)
+    app.router.add_get('/cache/stats', get_cache_stats)
+    app.cleanup_ctx.append(aws_clients)
+    app.cleanup_ctx.append(background_tasks)
+    return app
+
+
+# 主函数
+if __name__ == '__main__':
+    logger.info(f"配置文件路径: {CONFIG_PATH}")
+    logger.info("异步Web服务器启动")
+    web.run_app(create_app(), host='0.0.0.0', port=ASYNC_SERVER_PORT)
+    logger.info("异步Web服务器已停止")
@@ -0,0 +1,61 @@
+# File: aws_clients.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/aws_clients.py
+# 进程内共享的 AWS 客户端层：每种服务的 boto3 客户端只创建一次，所有请求线程复用其连接池
+import threading
+
+import boto3
+from botocore.config import Config
+
+
+class AwsClients:
+    """按服务名缓存 boto3 低层客户端
+
+    boto3 低层客户端本身是线程安全的，可以被多个请求线程同时使用；
+    只有创建过程（依赖 Session）需要加锁，因此只在首次创建时加锁。
+    HTTP 连接池大小由 max_pool_connections 决定，应不小于并发请求线程数。
+    endpoint_url 非空时所有服务都使用该地址（本地测试时指向 LocalStack、ElasticMQ 等兼容实现）。
+    connect_timeout、read_timeout 为单次尝试的连接和读取超时（秒），None 时使用 botocore 的默认值（60秒）。
+    """
+
+    def __init__(self, region, max_pool_connections=100, max_attempts=5, endpoint_url=None,
+                 connect_timeout=None, read_timeout=None):
+        self.region = region
+        self.endpoint_url = endpoint_url or None
+        timeouts = {}
+        if connect_timeout:
+            timeouts['connect_timeout'] = connect_timeout
+        if read_timeout:
+            timeouts['read_timeout'] = read_timeout
+        self.config = Config(
+            retries={
+                'max_attempts': max_attempts,
+                'mode': 'adaptive'
+            },
+            max_pool_connections=max_pool_connections,
+            **timeouts
+        )
+        self._lock = threading.Lock()
+        self._session = None
+        self._clients = {}
+
+    def get(self, service):
+        """返回指定服务的共享客户端，首次调用时创建"""
+        client = self._clients.get(service)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(service)
+                if client is None:
+                    if self._session is None:
+                        self._session = boto3.session.Session()
+                    client = self._session.client(service, region_name=self.region, config=self.config,
+                                                  endpoint_url=self.endpoint_url)
+                    self._clients[service] = client
+        return client
+
+    @property
+    def s3(self):
+        return self.get('s3')
+
+    @property
+    def sqs(self):
+        return self.get('sqs')
@@ -0,0 +1,93 @@
+# File: benchmark_completion.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/benchmark_completion.py
+# 完成通知基准测试：比较"睡眠轮询"与"完成事件"两种长轮询方式的唤醒延迟和CPU占用
+#   polling: 原实现，初始延迟后每 POLLING_INTERVAL 秒在全局 RLock 下重新读取记录
+#   event:   每个请求一个 threading.Event，结果到达时置位，等待线程立即唤醒
+# 用法: python3 benchmark_completion.py [--waiters 100 500] [--initial-delay 0] [--polling-interval 0.5]
+import argparse
+import random
+import threading
+import time
+from threading import RLock
+
+
+def percentile(values, q):
+    """返回已排序列表的q分位数"""
+    index = min(len(values) - 1, int(round(q * (len(values) - 1))))
+    return values[index]
+
+
+def run(mode, waiters, max_delay, initial_delay, polling_interval):
+    """模拟 waiters 个长轮询客户端，结果在 0~max_delay 秒内随机到达，返回 (唤醒延迟列表, CPU秒数, 墙钟秒数)"""
+    lock = RLock()
+    records = {}
+    for request_id in range(waiters):
+        records[request_id] = {'status': 'pending', 'event': threading.Event(), 'completed_at': None}
+
+    latencies = []
+    latencies_lock = threading.Lock()
+
+    def wait_polling(request_id):
+        time.sleep(initial_delay)
+        while True:
+            with lock:
+                record = records[request_id]
+                if record['status'] != 'pending':
+                    break
+            time.sleep(polling_interval)
+        with latencies_lock:
+            latencies.append(time.time() - record['completed_at'])
+
+    def wait_event(request_id):
+        with lock:
+            record = records[request_id]
+        record['event'].wait()
+        with latencies_lock:
+            latencies.append(time.time() - record['completed_at'])
+
+    def complete_all():
+        # 模拟响应队列消费线程：按随机到达时间依次完成请求
+        schedule = sorted((random.uniform(0, max_delay), request_id) for request_id in range(waiters))
+        start_time = time.time()
+        for delay, request_id in schedule:
+            pause = start_time + delay - time.time()
+            if pause > 0:
+                time.sleep(pause)
+            with lock:
+                record = records[request_id]
+                record['completed_at'] = time.time()
+                record['status'] = 'completed'
+            record['event'].set()
+
+    target = wait_polling if mode == 'polling' else wait_event
+    threads = [threading.Thread(target=target, args=(request_id,)) for request_id in range(waiters)]
+
+    cpu_start = time.process_time()
+    wall_start = time.time()
+    for thread in threads:
+        thread.start()
+    complete_all()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies), time.process_time() - cpu_start, time.time() - wall_start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='比较睡眠轮询与完成事件的唤醒延迟和CPU占用')
+    parser.add_argument('--waiters', type=int, nargs='+', default=[100, 500], help='并发等待的客户端数')
+    parser.add_argument('--max-delay', type=float, default=5.0, help='结果到达时间的上限（秒）')
+    parser.add_argument('--initial-delay', type=float, default=0.0,
+                        help='轮询方式的初始延迟（原实现为 INITIAL_POLLING_DELAY=10 秒）')
+    parser.add_argument('--polling-interval', type=float, default=0.5, help='轮询方式的轮询间隔（秒）')
+    args = parser.parse_args()
+
+    print(f"结果到达时间: 0~{args.max_delay} 秒, 轮询间隔: {args.polling_interval} 秒, 初始延迟: {args.initial_delay} 秒")
+    print(f"{'mode':<10}{'waiters':>9}{'p50(ms)':>11}{'p99(ms)':>11}{'max(ms)':>11}{'cpu(s)':>9}{'wall(s)':>9}")
+    for waiters in args.waiters:
+        for mode in ('polling', 'event'):
+            latencies, cpu_seconds, wall_seconds = run(
+                mode, waiters, args.max_delay, args.initial_delay, args.polling_interval
+            )
+            print(f"{mode:<10}{waiters:>9}{percentile(latencies, 0.50) * 1000:>11.1f}"
+                  f"{percentile(latencies, 0.99) * 1000:>11.1f}{latencies[-1] * 1000:>11.1f}"
+                  f"{cpu_seconds:>9.2f}{wall_seconds:>9.2f}")
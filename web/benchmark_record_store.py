@@ -0,0 +1,149 @@
+# File: benchmark_record_store.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/benchmark_record_store.py
+# 请求记录存储基准测试：在 10^5 ~ 10^6 条在途记录下比较
+#   safedict: 原实现，SafeUserDict（单个 RLock）+ 字典记录，清理时复制并遍历全部记录
+#   sharded:  record_store.RecordStore（分片锁）+ __slots__ 记录，清理时只弹出到期堆中已到期的记录
+# 测量指标：写入耗时、每条记录的内存、多线程查询吞吐量、清理 1% 到期记录的耗时
+# 用法: python3 benchmark_record_store.py [--records 100000 1000000] [--threads 8] [--expired-ratio 0.01]
+import argparse
+import gc
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import UserDict
+from threading import RLock
+
+from record_store import RecordStore, RequestRecord
+
+TTL = 360
+
+
+class SafeUserDict(UserDict):
+    """原实现的全局锁字典（与 web_server.py 中被替换的版本相同）"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = RLock()
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            super().__setitem__(key, value)
+
+    def get(self, key, default=None):
+        with self.lock:
+            return super().get(key, default)
+
+    def items(self):
+        with self.lock:
+            return list(super().items())
+
+    def pop(self, key, default=None):
+        with self.lock:
+            return super().pop(key, default)
+
+
+class SafeDictStore:
+    """把原实现包装成与 RecordStore 相同的接口"""
+
+    def __init__(self):
+        self.records = SafeUserDict()
+
+    def add(self, request_id, filename, timestamp):
+        self.records[request_id] = {
+            'filename': filename,
+            'status': 'completed',
+            'timestamp': timestamp,
+            'result': None,
+            'digest': None,
+            'event': threading.Event()
+        }
+
+    def get(self, request_id):
+        return self.records.get(request_id)
+
+    def expire(self, now):
+        # 原 cleanup_expired_records 的逻辑：复制全部记录后逐条判断
+        expired_ids = [
+            rid for rid, record in self.records.items()
+            if record['status'] in ('completed', 'error', 'timeout') and now - record['timestamp'] > TTL
+        ]
+        for rid in expired_ids:
+            self.records.pop(rid, None)
+        return len(expired_ids)
+
+
+class ShardedStore:
+    def __init__(self):
+        self.records = RecordStore(TTL)
+
+    def add(self, request_id, filename, timestamp):
+        record = RequestRecord(request_id, filename, timestamp=timestamp)
+        record.status = 'completed'
+        self.records.add(record)
+
+    def get(self, request_id):
+        return self.records.get(request_id)
+
+    def expire(self, now):
+        removed, _ = self.records.expire(now)
+        return len(removed)
+
+
+def run(store_class, records, threads, expired_ratio):
+    """返回 (写入秒数, 每条记录字节数, 查询次数/秒, 清理毫秒数, 清理条数)"""
+    request_ids = [str(uuid.uuid4()) for _ in range(records)]
+    now = time.time()
+    expired_count = int(records * expired_ratio)
+
+    gc.collect()
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    store = store_class()
+    for index, request_id in enumerate(request_ids):
+        # 前 expired_count 条记录已超过 TTL，其余记录的时间戳在 TTL 之内
+        timestamp = now - TTL - 1 if index < expired_count else now - (index % TTL)
+        store.add(request_id, 'image.jpg', timestamp)
+    insert_seconds = time.perf_counter() - start_time
+    memory_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # 多线程查询：每个线程查询各自的一段 request_id
+    lookups_per_thread = min(records // threads, 100000)
+
+    def lookup(offset):
+        for request_id in request_ids[offset:offset + lookups_per_thread]:
+            store.get(request_id)
+
+    workers = [threading.Thread(target=lookup, args=(index * lookups_per_thread,)) for index in range(threads)]
+    start_time = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    lookup_rate = threads * lookups_per_thread / (time.perf_counter() - start_time)
+
+    start_time = time.perf_counter()
+    expired = store.expire(now)
+    expire_ms = (time.perf_counter() - start_time) * 1000
+    return insert_seconds, memory_bytes / records, lookup_rate, expire_ms, expired
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='比较全局锁字典与分片记录存储')
+    parser.add_argument('--records', type=int, nargs='+', default=[100000, 1000000], help='在途记录数')
+    parser.add_argument('--threads', type=int, default=8, help='并发查询线程数')
+    parser.add_argument('--expired-ratio', type=float, default=0.01, help='清理时已到期记录的比例')
+    args = parser.parse_args()
+
+    print(f"查询线程: {args.threads}, 到期比例: {args.expired_ratio}")
+    print(f"{'store':<10}{'records':>10}{'insert(s)':>11}{'bytes/rec':>11}{'lookups/s':>12}"
+          f"{'expire(ms)':>12}{'expired':>9}")
+    for records in args.records:
+        for name, store_class in (('safedict', SafeDictStore), ('sharded', ShardedStore)):
+            insert_seconds, bytes_per_record, lookup_rate, expire_ms, expired = run(
+                store_class, records, args.threads, args.expired_ratio
+            )
+            print(f"{name:<10}{records:>10}{insert_seconds:>11.2f}{bytes_per_record:>11.0f}"
+                  f"{lookup_rate:>12.0f}{expire_ms:>12.1f}{expired:>9}")
+            gc.collect()
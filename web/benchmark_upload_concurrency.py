@@ -0,0 +1,153 @@
+# File: benchmark_upload_concurrency.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/benchmark_upload_concurrency.py
+# 上传并发基准测试：按客户端线程数测量 S3 上传 + SQS 入队的吞吐量
+#   locked: 原实现，每个请求在全局锁内新建 boto3 客户端再调用
+#   shared: 共享客户端层（aws_clients.AwsClients），无全局锁
+#   batched: 共享客户端层 + 请求消息合并为 send_message_batch（sqs_batcher.SqsBatchSender）
+# 默认直接访问 web_server_config.json 中配置的桶和队列（需要AWS凭证），
+# 测试对象写入 benchmark/ 前缀，入队的消息会被 worker 当作普通请求处理，因此请使用测试队列或加 --no-sqs。
+# 加 --simulate 时使用模拟客户端（固定网络延迟和客户端创建开销），可在本地离线运行。
+# 用法: python3 benchmark_upload_concurrency.py [--threads 1 4 16 64] [--requests 200] [--simulate]
+import argparse
+import io
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from threading import RLock
+
+from aws_clients import AwsClients
+from sqs_batcher import SqsBatchSender
+
+if os.name == 'nt':
+    CONFIG_PATH = os.environ.get('WEB_SERVER_CONFIG_PATH', r".\code\web\web_server_config.json")
+else:
+    CONFIG_PATH = os.environ.get('WEB_SERVER_CONFIG_PATH', '/home/us2-user/web/web_server_config.json')
+
+
+class SimulatedClient:
+    """模拟的 S3/SQS 客户端：每次调用固定耗时（网络往返期间释放GIL）"""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def upload_fileobj(self, fileobj, bucket, key):
+        time.sleep(self.latency)
+
+    def send_message(self, **kwargs):
+        time.sleep(self.latency)
+
+    def send_message_batch(self, QueueUrl, Entries):
+        time.sleep(self.latency)
+        return {'Successful': [{'Id': entry['Id'], 'MessageId': str(uuid.uuid4())} for entry in Entries]}
+
+
+class SimulatedClients:
+    """模拟的共享客户端层"""
+
+    def __init__(self, latency):
+        self.s3 = SimulatedClient(latency)
+        self.sqs = SimulatedClient(latency)
+
+
+def make_locked_request(region, client_config, simulate, latency, create_cost, use_sqs):
+    """构造原实现的请求函数：全局锁 + 每次新建客户端"""
+    s3_lock = RLock()
+    sqs_lock = RLock()
+
+    def new_client(service):
+        if simulate:
+            time.sleep(create_cost)
+            return SimulatedClient(latency)
+        import boto3
+        return boto3.client(service, region_name=region, config=client_config)
+
+    def do_request(bucket, queue_url, key, data):
+        with s3_lock:
+            new_client('s3').upload_fileobj(io.BytesIO(data), bucket, key)
+        if use_sqs:
+            with sqs_lock:
+                new_client('sqs').send_message(QueueUrl=queue_url, MessageBody=json.dumps({'filename': key}))
+    return do_request
+
+
+def make_shared_request(clients, use_sqs):
+    """构造共享客户端层的请求函数"""
+    def do_request(bucket, queue_url, key, data):
+        clients.s3.upload_fileobj(io.BytesIO(data), bucket, key)
+        if use_sqs:
+            clients.sqs.send_message(QueueUrl=queue_url, MessageBody=json.dumps({'filename': key}))
+    return do_request
+
+
+def make_batched_request(clients, queue_url, linger, use_sqs):
+    """构造共享客户端层 + 批量发送的请求函数，返回 (请求函数, 发送器)"""
+    sender = SqsBatchSender(lambda: clients.sqs, queue_url, linger=linger)
+
+    def do_request(bucket, queue_url, key, data):
+        clients.s3.upload_fileobj(io.BytesIO(data), bucket, key)
+        if use_sqs:
+            sender.send(json.dumps({'filename': key}))
+    return do_request, sender
+
+
+def measure(do_request, threads, requests, bucket, queue_url, data):
+    """用 threads 个线程完成 requests 次请求，返回每秒请求数"""
+    def task(index):
+        do_request(bucket, queue_url, f"benchmark/{uuid.uuid4()}_{index}.jpg", data)
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(task, range(requests)))
+    return requests / (time.perf_counter() - start_time)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='按客户端线程数测量上传吞吐量')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--requests', type=int, default=200, help='每组测试的请求数')
+    parser.add_argument('--size', type=int, default=64 * 1024, help='上传对象大小（字节）')
+    parser.add_argument('--no-sqs', action='store_true', help='只测S3上传，不向请求队列发送消息')
+    parser.add_argument('--simulate', action='store_true', help='使用模拟客户端离线运行')
+    parser.add_argument('--latency', type=float, default=0.03, help='模拟模式下每次调用的耗时（秒）')
+    parser.add_argument('--linger', type=float, default=0.005, help='batched 模式的批量发送等待窗口（秒）')
+    parser.add_argument('--create-cost', type=float, default=0.02, help='模拟模式下新建客户端的耗时（秒）')
+    args = parser.parse_args()
+
+    data = os.urandom(args.size)
+    use_sqs = not args.no_sqs
+    if args.simulate:
+        region, bucket, queue_url = 'us-east-1', 'simulated-bucket', 'simulated-queue'
+        shared_clients = SimulatedClients(args.latency)
+        client_config = None
+    else:
+        with open(CONFIG_PATH, 'r') as f:
+            config = json.load(f)
+        region = config.get("AWS_REGION", "us-east-1")
+        bucket = config.get("INPUT_BUCKET", "project2-input-bucket-abc")
+        queue_url = config.get("REQUEST_QUEUE_URL", "https://sqs.us-east-1.amazonaws.com/257288819129/request-queue")
+        shared_clients = AwsClients(region, max_pool_connections=max(args.threads))
+        client_config = shared_clients.config
+
+    batched_request, sender = make_batched_request(shared_clients, queue_url, args.linger, use_sqs)
+    modes = {
+        'locked': make_locked_request(region, client_config, args.simulate, args.latency, args.create_cost, use_sqs),
+        'shared': make_shared_request(shared_clients, use_sqs),
+        'batched': batched_request,
+    }
+
+    print(f"{'模拟' if args.simulate else 'AWS'}模式, 每组 {args.requests} 次请求, 对象大小 {args.size} 字节, "
+          f"{'S3+SQS' if use_sqs else '仅S3'}")
+    print(f"{'threads':>8}{'locked(req/s)':>16}{'shared(req/s)':>16}{'batched(req/s)':>17}{'speedup':>10}"
+          f"{'SQS calls/req':>15}")
+    for threads in args.threads:
+        batches_before = sender.stats()['batches']
+        results = {
+            mode: measure(do_request, threads, args.requests, bucket, queue_url, data)
+            for mode, do_request in modes.items()
+        }
+        # batched 模式下每个请求平均的 SQS API 调用次数（shared 模式为 1）
+        calls_per_request = (sender.stats()['batches'] - batches_before) / args.requests
+        print(f"{threads:>8}{results['locked']:>16.1f}{results['shared']:>16.1f}{results['batched']:>17.1f}"
+              f"{results['shared'] / results['locked']:>9.1f}x{calls_per_request:>15.2f}")
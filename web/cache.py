@@ -0,0 +1,187 @@
+# File: cache.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/cache.py
+# 线程安全的有界 LRU 缓存，支持过期时间，并统计命中、未命中和淘汰次数
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Lock
+import time
+
+
+class LRUCache:
+    """有界 LRU + TTL 缓存：超过 max_entries 时淘汰最久未使用的条目，超过 ttl 秒的条目视为过期"""
+
+    def __init__(self, max_entries=10000, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at < time.time():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.time() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def stats(self):
+        """返回缓存统计信息"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._data),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+
+class ByteBudgetCache:
+    """按内存预算限制的 LRU + TTL 缓存
+
+    条目大小之和超过 max_bytes 时淘汰最久未使用的条目。get_or_load() 在未命中时调用 loader 加载，
+    并发未命中同一个键的线程共享同一次加载；loader 返回 None 表示不存在，不写入缓存。
+    """
+
+    # 每个条目在值之外的估计开销（键、元组、字典槽位）
+    ENTRY_OVERHEAD = 200
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=3600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._loading = {}
+        self._lock = Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.shared_loads = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _size(self, key, value):
+        return len(key) + len(value) + self.ENTRY_OVERHEAD
+
+    def _lookup(self, key):
+        """在持有锁时查找未过期的值，不存在时返回 None"""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at, size = entry
+        if expires_at < time.time():
+            del self._data[key]
+            self.bytes -= size
+            self.expirations += 1
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._lookup(key)
+            if value is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        size = self._size(key, value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= old[2]
+            self._data[key] = (value, time.time() + self.ttl, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, _, evicted_size) = self._data.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        """返回缓存的值；未命中时调用 loader(key) 加载并缓存，同一键的并发未命中只加载一次"""
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                self.hits += 1
+                return value
+            self.misses += 1
+            future = self._loading.get(key)
+            owner = future is None
+            if owner:
+                future = self._loading[key] = Future()
+                self.loads += 1
+            else:
+                self.shared_loads += 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            value = loader(key)
+            if value is not None:
+                self.put(key, value)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._loading.pop(key, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def stats(self):
+        """返回缓存统计信息"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._data),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'loads': self.loads,
+                'shared_loads': self.shared_loads,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
@@ -1,6 +1,7 @@
 # File: custom_autoscaler.py version 2.0 release 2025-06-28 by Wenguang Zuo
 # wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/custom_autoscaler.py
 # wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/custom_autoscaler_config.json
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/metrics.py
 
 import boto3
 import time
@@ -8,6 +9,8 @@ import logging
 import json
 import os
 
+from metrics import MetricsRegistry, start_http_exporter
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -64,6 +67,26 @@ TAGS = config.get("TAGS", {
 # 启动脚本（带默认值）
 USER_DATA = config.get("USER_DATA", "#!/bin/bash")
 
+# worker 模型加载完成后给实例打上的就绪标签（与 worker_config.json 中的 READY_TAG_KEY 一致）
+READY_TAG_KEY = config.get("READY_TAG_KEY", "WorkerReady")
+
+# 指标导出端口（/metrics 与 /metrics.json），0 表示不启用
+METRICS_PORT = config.get("METRICS_PORT", 9101)
+
+# 指标
+metrics = MetricsRegistry()
+queue_depth_gauge = metrics.gauge('autoscaler_queue_depth', '最近一次检查时请求队列的消息数（可见消息加正在处理的不可见消息）')
+running_gauge = metrics.gauge('autoscaler_running_instances', '运行中或启动中的实例数')
+ready_gauge = metrics.gauge('autoscaler_ready_instances', '已加载模型的实例数')
+required_gauge = metrics.gauge('autoscaler_required_instances', '按队列深度计算的所需实例数')
+decisions_total = {
+    action: metrics.counter('autoscaler_decisions_total', '每次检查的伸缩决策', labels={'action': action})
+    for action in ('scale_up', 'scale_down', 'cooldown', 'hold')
+}
+launched_total = metrics.counter('autoscaler_instances_launched_total', '成功创建的实例数')
+terminated_total = metrics.counter('autoscaler_instances_terminated_total', '成功终止的实例数')
+check_seconds = metrics.histogram('autoscaler_check_seconds', '一次检查（查询队列和实例、执行伸缩）的耗时')
+
 # 创建AWS客户端
 ec2 = boto3.client('ec2', region_name=AWS_REGION)
 sqs = boto3.client('sqs', region_name=AWS_REGION)
@@ -72,14 +95,16 @@ sqs = boto3.client('sqs', region_name=AWS_REGION)
 def format_tags(tags):
     return [{'Key': k, 'Value': v} for k, v in tags.items()]
 
-# 获取队列深度
+# 获取队列深度（等待处理的消息 + worker已接收、正在处理的不可见消息）
 def get_queue_depth():
     try:
         response = sqs.get_queue_attributes(
             QueueUrl=SQS_QUEUE_URL,
-            AttributeNames=['ApproximateNumberOfMessages']
+            AttributeNames=['ApproximateNumberOfMessages', 'ApproximateNumberOfMessagesNotVisible']
         )
-        return int(response['Attributes']['ApproximateNumberOfMessages'])
+        attributes = response['Attributes']
+        return int(attributes['ApproximateNumberOfMessages']) + \
+            int(attributes.get('ApproximateNumberOfMessagesNotVisible', 0))
     except Exception as e:
         logger.error(f"获取队列深度失败: {str(e)}")
         return 0
@@ -98,10 +123,13 @@ def get_running_instances():
         instances = []
         for reservation in response['Reservations']:
             for instance in reservation['Instances']:
+                tags = {tag['Key']: tag['Value'] for tag in instance.get('Tags', [])}
                 instances.append({
                     'InstanceId': instance['InstanceId'],
                     'LaunchTime': instance['LaunchTime'],
-                    'State': instance['State']['Name']
+                    'State': instance['State']['Name'],
+                    # worker 已加载模型、可以处理请求
+                    'Ready': tags.get(READY_TAG_KEY) == 'true'
                 })
         
         return instances
@@ -134,6 +162,7 @@ def create_ec2_instance():
         )
         
         instance_id = response['Instances'][0]['InstanceId']
+        launched_total.inc()
         logger.info(f"创建新实例: {instance_id}")
         return instance_id
     except Exception as e:
@@ -144,6 +173,7 @@ def create_ec2_instance():
 def terminate_instance(instance_id):
     try:
         ec2.terminate_instances(InstanceIds=[instance_id])
+        terminated_total.inc()
         logger.info(f"终止实例: {instance_id}")
         return True
     except Exception as e:
@@ -156,15 +186,20 @@ if __name__ == '__main__':
     logger.info("File: custom_autoscaler.py version 2.0 release 2025-06-28 by Wenguang Zuo")
     logger.info(f"配置文件路径: {CONFIG_PATH}")
     logger.info("自动伸缩器启动，开始监控队列...")
+    if METRICS_PORT:
+        start_http_exporter(metrics, METRICS_PORT)
+        logger.info(f"指标导出端口: {METRICS_PORT}")
 
     # 初始化变量
     last_scaling_time = 0
     while True:
         try:
+            check_start = time.perf_counter()
             # 获取队列深度和当前实例数
             queue_depth = get_queue_depth()
             running_instances = get_running_instances()
             current_instance_count = len(running_instances)
+            ready_instance_count = sum(1 for instance in running_instances if instance['Ready'])
             
             # 计算所需实例数
             required_instances = min(
@@ -174,16 +209,21 @@ if __name__ == '__main__':
                     (queue_depth + TARGET_MESSAGES_PER_WORKER - 1) // TARGET_MESSAGES_PER_WORKER
                 )
             )
-            logger.debug(f"队列深度: {queue_depth}, 当前实例数: {current_instance_count}, 所需实例数: {required_instances}")    
+            logger.debug(f"队列深度: {queue_depth}, 当前实例数: {current_instance_count}, 已就绪: {ready_instance_count}, 所需实例数: {required_instances}")    
             current_time = time.time()
+            queue_depth_gauge.set(queue_depth)
+            running_gauge.set(current_instance_count)
+            ready_gauge.set(ready_instance_count)
+            required_gauge.set(required_instances)
             
             # 检查是否需要扩容
             if required_instances > current_instance_count and queue_depth >= SCALE_UP_THRESHOLD:
-                    logger.info(f"队列深度: {queue_depth}, 当前实例数: {current_instance_count}, 所需实例数: {required_instances} -> 扩容")
+                    logger.info(f"队列深度: {queue_depth}, 当前实例数: {current_instance_count}, 已就绪: {ready_instance_count}, 所需实例数: {required_instances} -> 扩容")
                 # 扩容不要等待
                 # if current_time - last_scaling_time < COOLDOWN:
                 #     logger.info(f"处于冷却期，跳过扩容")
                 # else:
+                    decisions_total['scale_up'].inc()
                     instances_to_add = required_instances - current_instance_count
                     logger.info(f"需要扩容，添加 {instances_to_add} 个实例")
                     
@@ -195,21 +235,28 @@ if __name__ == '__main__':
             
             # 检查是否需要缩容
             elif required_instances < current_instance_count and queue_depth <= SCALE_DOWN_THRESHOLD:
-                logger.info(f"队列深度: {queue_depth}, 当前实例数: {current_instance_count}, 所需实例数: {required_instances} -> 缩容")
+                logger.info(f"队列深度: {queue_depth}, 当前实例数: {current_instance_count}, 已就绪: {ready_instance_count}, 所需实例数: {required_instances} -> 缩容")
                 if current_time - last_scaling_time < COOLDOWN:
                     logger.info(f"处于冷却期，跳过缩容")
+                    decisions_total['cooldown'].inc()
                 else:
+                    decisions_total['scale_down'].inc()
                     instances_to_remove = current_instance_count - required_instances
                     logger.info(f"需要缩容，移除 {instances_to_remove} 个实例")
                     
-                    # 按启动时间排序，先终止最早的实例
-                    running_instances.sort(key=lambda x: x['LaunchTime'])
+                    # 优先终止尚未就绪的实例（仍在冷启动，还未处理请求），其次按启动时间先终止最早的实例
+                    running_instances.sort(key=lambda x: (x['Ready'], x['LaunchTime']))
                     
                     for i in range(instances_to_remove):
                         instance_id = running_instances[i]['InstanceId']
                         if terminate_instance(instance_id):
                             last_scaling_time = current_time
-            
+
+            else:
+                decisions_total['hold'].inc()
+
+            check_seconds.observe(time.perf_counter() - check_start)
+
             # 休眠
             time.sleep(CHECK_INTERVAL)
             
@@ -0,0 +1,53 @@
+# File: inline_payload.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/inline_payload.py
+# 请求消息构造：小图像直接内联在 SQS 消息体中（base64，可选 zlib 压缩），超过 SQS 大小上限的图像仍经 S3 传递
+import base64
+import json
+import time
+import zlib
+
+from sqs_batcher import message_size
+
+# SQS 单条消息（消息体 + 属性）的大小上限
+SQS_MAX_MESSAGE_BYTES = 256 * 1024
+
+
+def encode_payload(data, compress=False, compress_level=6):
+    """把图像字节编码为消息字段；启用压缩且压缩后更小时使用 zlib（JPEG/PNG 本身已压缩，通常收益很小）"""
+    encoding = 'base64'
+    if compress:
+        compressed = zlib.compress(data, compress_level)
+        if len(compressed) < len(data):
+            data, encoding = compressed, 'zlib+base64'
+    return {'payload': base64.b64encode(data).decode('ascii'), 'encoding': encoding}
+
+
+def build_request_message(filename, request_id, data, inline=True, max_message_bytes=SQS_MAX_MESSAGE_BYTES,
+                          compress=False, node_id=None, reply_to=None):
+    """构造请求消息，返回 (消息体, 消息属性, 是否内联)
+
+    内联后的消息不超过 max_message_bytes 时图像随消息发送，worker 无需访问输入桶；
+    否则消息只包含文件名，调用方需要先把图像上传到输入桶。
+    node_id 为发出请求的web节点，reply_to 为该节点的响应队列（为空时 worker 使用默认响应队列）。
+    """
+    message = {
+        'filename': filename,
+        'request_id': request_id,
+        'timestamp': time.time()
+    }
+    if node_id:
+        message['node_id'] = node_id
+    if reply_to:
+        message['reply_to'] = reply_to
+    attributes = {
+        'request_id': {
+            'StringValue': request_id,
+            'DataType': 'String'
+        }
+    }
+    # base64 使数据膨胀为 4/3 倍，不压缩时明显放不下的图像无需编码
+    if inline and (compress or len(data) * 4 // 3 < max_message_bytes):
+        body = json.dumps({**message, **encode_payload(data, compress)})
+        if message_size(body, attributes) <= max_message_bytes:
+            return body, attributes, True
+    return json.dumps(message), attributes, False
@@ -0,0 +1,262 @@
+# File: metrics.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/metrics.py
+# 进程内指标：直方图、计数器和仪表，输出 Prometheus 文本格式或 JSON；
+# 可通过本地 HTTP 端口或定期写入文件导出（web/metrics.py 与 classifier/metrics.py 内容相同）
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# 默认直方图分桶（秒）：1ms ~ 5min，大致按 2.5 倍递增
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0,
+                   60.0, 120.0, 300.0)
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+
+class Counter:
+    """只增不减的计数器"""
+
+    type = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+    def samples(self):
+        return [(self.name, self.labels, self._value)]
+
+    def snapshot(self):
+        return self._value
+
+
+class Gauge:
+    """可增可减的仪表；传入 function 时每次读取调用它取值"""
+
+    type = 'gauge'
+
+    def __init__(self, name, help_text, labels=(), function=None):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.function = function
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        self._value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    @property
+    def value(self):
+        if self.function is not None:
+            try:
+                return self.function()
+            except Exception:
+                return None
+        return self._value
+
+    def samples(self):
+        value = self.value
+        return [(self.name, self.labels, 'NaN' if value is None else value)]
+
+    def snapshot(self):
+        return self.value
+
+
+class Histogram:
+    """固定分桶直方图：observe() 只做一次二分查找和计数，开销很小"""
+
+    type = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    @contextmanager
+    def time(self):
+        """计时上下文：退出时记录耗时（秒）"""
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time)
+
+    def _state(self):
+        with self._lock:
+            return list(self._counts), self._sum, self._count
+
+    def percentile(self, q, counts=None, count=None):
+        """按分桶估计 q 分位数（返回所在分桶的上界）"""
+        if counts is None:
+            counts, _, count = self._state()
+        if not count:
+            return None
+        rank = q * count
+        cumulative = 0
+        for index, bucket_count in enumerate(counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return self.buckets[index] if index < len(self.buckets) else float('inf')
+        return float('inf')
+
+    def samples(self):
+        counts, total, count = self._state()
+        samples = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            samples.append((f'{self.name}_bucket', self.labels + (('le', le),), cumulative))
+        samples.append((f'{self.name}_sum', self.labels, total))
+        samples.append((f'{self.name}_count', self.labels, count))
+        return samples
+
+    def snapshot(self):
+        counts, total, count = self._state()
+        return {
+            'count': count,
+            'sum': round(total, 6),
+            'avg': round(total / count, 6) if count else None,
+            'p50': self.percentile(0.50, counts, count),
+            'p90': self.percentile(0.90, counts, count),
+            'p99': self.percentile(0.99, counts, count)
+        }
+
+
+class MetricsRegistry:
+    """按名称和标签注册指标；同名同标签的指标只创建一次"""
+
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, metric_class, name, help_text, labels, **kwargs):
+        name = self.prefix + name
+        labels = tuple(sorted((labels or {}).items()))
+        key = (name, labels)
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    metric = self._metrics[key] = metric_class(name, help_text, labels, **kwargs)
+        return metric
+
+    def counter(self, name, help_text='', labels=None):
+        return self._get(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text='', labels=None, function=None):
+        return self._get(Gauge, name, help_text, labels, function=function)
+
+    def histogram(self, name, help_text='', labels=None, buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help_text, labels, buckets=buckets)
+
+    def render_prometheus(self):
+        """输出 Prometheus 文本格式"""
+        lines = []
+        described = set()
+        for metric in sorted(list(self._metrics.values()), key=lambda m: (m.name, m.labels)):
+            if metric.name not in described:
+                described.add(metric.name)
+                lines.append(f'# HELP {metric.name} {metric.help}')
+                lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """输出 JSON 可序列化的字典：{指标名{标签}: 值或直方图摘要}"""
+        return {
+            metric.name + format_labels(metric.labels): metric.snapshot()
+            for metric in sorted(list(self._metrics.values()), key=lambda m: (m.name, m.labels))
+        }
+
+
+def start_http_exporter(registry, port, host='0.0.0.0'):
+    """在后台线程中启动 HTTP 导出端口：/metrics 为 Prometheus 文本格式，/metrics.json 为 JSON"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.startswith('/metrics.json'):
+                body = json.dumps(registry.snapshot()).encode('utf-8')
+                content_type = 'application/json'
+            elif self.path.startswith('/metrics'):
+                body = registry.render_prometheus().encode('utf-8')
+                content_type = 'text/plain; version=0.0.4'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-exporter', daemon=True).start()
+    return server
+
+
+def start_file_exporter(registry, path, interval=10):
+    """在后台线程中每 interval 秒把指标快照以 JSON 原子写入 path"""
+
+    def export():
+        while True:
+            time.sleep(interval)
+            temp_path = f"{path}.tmp"
+            try:
+                with open(temp_path, 'w') as f:
+                    json.dump({'time': time.time(), 'metrics': registry.snapshot()}, f)
+                os.replace(temp_path, path)
+            except Exception as e:
+                logger.error(f"写入指标文件失败: {path}, {str(e)}")
+
+    thread = threading.Thread(target=export, name='metrics-file-exporter', daemon=True)
+    thread.start()
+    return thread
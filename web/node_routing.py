@@ -0,0 +1,84 @@
+# File: node_routing.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/node_routing.py
+# 多web节点的响应路由：每个节点有自己的 node_id 和响应队列，请求消息中的 reply_to 告诉 worker
+# 把结果发回哪个队列，使节点之间不会消费（并删除）彼此的响应
+import logging
+import re
+import socket
+
+logger = logging.getLogger(__name__)
+
+# SQS 队列名只能包含字母、数字、- 和 _，最长80个字符
+QUEUE_NAME_MAX_LENGTH = 80
+
+
+def default_node_id():
+    """默认节点ID：主机名（同一台机器上运行多个节点时需在配置中分别指定 NODE_ID）"""
+    return socket.gethostname()
+
+
+def node_queue_name(prefix, node_id):
+    return re.sub(r'[^A-Za-z0-9_-]', '-', f"{prefix}{node_id}")[:QUEUE_NAME_MAX_LENGTH]
+
+
+class NodeRouting:
+    """节点身份和响应队列
+
+    queue_prefix 为空时所有节点共用 shared_queue_url（单节点部署，与原行为相同），
+    请求消息不带 reply_to，worker 发送到自己配置的 RESPONSE_QUEUE_URL；
+    否则 setup() 创建（或取得已存在的）名为 queue_prefix + node_id 的队列，作为本节点的响应队列。
+    """
+
+    def __init__(self, get_client, node_id, shared_queue_url, queue_prefix='', retention_seconds=3600):
+        self.get_client = get_client
+        self.node_id = node_id
+        self.queue_prefix = queue_prefix
+        self.retention_seconds = retention_seconds
+        self.queue_url = shared_queue_url
+
+    @property
+    def per_node(self):
+        return bool(self.queue_prefix)
+
+    @property
+    def reply_to(self):
+        """写入请求消息的响应队列地址；共用队列时为 None"""
+        return self.queue_url if self.per_node else None
+
+    def setup(self):
+        """创建本节点的响应队列（CreateQueue 对同名同属性的队列是幂等的），返回响应队列地址"""
+        if self.per_node:
+            name = node_queue_name(self.queue_prefix, self.node_id)
+            self.queue_url = self.get_client().create_queue(
+                QueueName=name,
+                Attributes={'MessageRetentionPeriod': str(max(60, int(self.retention_seconds)))}
+            )['QueueUrl']
+            logger.info(f"节点 {self.node_id} 的响应队列: {self.queue_url}")
+        return self.queue_url
+
+    def count_nodes(self):
+        """按节点响应队列的数量估计web节点数（共用响应队列时为 1）
+
+        未删除的已退出节点的队列也会被计入，结果偏大时可在配置中直接指定节点数。
+        """
+        if not self.per_node:
+            return 1
+        response = self.get_client().list_queues(QueueNamePrefix=node_queue_name(self.queue_prefix, ''))
+        return max(1, len(response.get('QueueUrls', [])))
+
+    def teardown(self, delete=False):
+        """节点退出时删除本节点的响应队列（只在节点不会以相同 node_id 重启时使用）"""
+        if not (self.per_node and delete):
+            return
+        try:
+            self.get_client().delete_queue(QueueUrl=self.queue_url)
+            logger.info(f"已删除节点响应队列: {self.queue_url}")
+        except Exception as e:
+            logger.error(f"删除节点响应队列失败: {self.queue_url}, {str(e)}")
+
+    def stats(self):
+        return {
+            'node_id': self.node_id,
+            'per_node_queue': self.per_node,
+            'response_queue_url': self.queue_url
+        }
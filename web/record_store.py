@@ -0,0 +1,144 @@
+# File: record_store.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/record_store.py
+# 请求记录存储：按 request_id 分片加锁，每个分片维护按到期时间排序的堆，过期清理只访问已到期的记录
+import heapq
+import threading
+import time
+
+
+class RequestRecord:
+    """单个请求的状态记录（使用 __slots__，每条记录不带 __dict__，内存占用更小）"""
+
+    __slots__ = ('request_id', 'filename', 'status', 'timestamp', 'result', 'digest', 'event', 'listeners',
+                 'trace', 'lock')
+
+    def __init__(self, request_id, filename, digest=None, timestamp=None):
+        self.request_id = request_id
+        self.filename = filename
+        self.status = 'pending'
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.result = None
+        self.digest = digest
+        # 请求结束（完成、出错或超时）时置位，长轮询线程在此等待
+        self.event = threading.Event()
+        # 需要同时等待多个请求的调用方（批量接口等）注册的队列，请求结束时记录被放入其中
+        self.listeners = None
+        # 各阶段时间戳 {阶段: 时间}，见 request_trace.STAGES
+        self.trace = {}
+        # 保护状态变化和 listeners（响应消费线程和清理线程可能同时结束同一请求）
+        self.lock = threading.Lock()
+
+    def finish(self, **updates):
+        """只应用第一次离开 pending 的状态变化，返回是否应用（请求已结束时不做任何修改）"""
+        with self.lock:
+            if self.status != 'pending':
+                return False
+            for name, value in updates.items():
+                setattr(self, name, value)
+            return True
+
+    def add_listener(self, listener):
+        """注册完成通知队列；已结束的请求立即放入（同一记录可能被放入多次，调用方需去重）"""
+        with self.lock:
+            if self.listeners is None:
+                self.listeners = []
+            self.listeners.append(listener)
+            finished = self.status != 'pending'
+        if finished:
+            listener.put(self)
+
+    def remove_listener(self, listener):
+        with self.lock:
+            if self.listeners and listener in self.listeners:
+                self.listeners.remove(listener)
+
+    def notify(self):
+        """唤醒所有等待该请求的线程和通知队列"""
+        self.event.set()
+        with self.lock:
+            listeners = list(self.listeners or ())
+        for listener in listeners:
+            listener.put(self)
+
+
+class _Shard:
+    __slots__ = ('lock', 'records', 'expiry')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.records = {}
+        # (到期时间, request_id) 的最小堆；记录被提前移除时堆中的条目保留，到期时再跳过
+        self.expiry = []
+
+
+class RecordStore:
+    """分片的请求记录存储
+
+    每个分片有自己的锁、记录字典和到期堆，不同请求的读写只竞争各自分片的锁。
+    记录在 timestamp + ttl 时到期：expire() 从各分片堆顶弹出已到期的条目，
+    开销与到期记录数成正比，而不是与全部记录数成正比。
+    """
+
+    def __init__(self, ttl, shards=64):
+        self.ttl = ttl
+        self._shards = [_Shard() for _ in range(shards)]
+
+    def _shard(self, request_id):
+        return self._shards[hash(request_id) % len(self._shards)]
+
+    def add(self, record):
+        shard = self._shard(record.request_id)
+        with shard.lock:
+            shard.records[record.request_id] = record
+            heapq.heappush(shard.expiry, (record.timestamp + self.ttl, record.request_id))
+
+    def get(self, request_id, default=None):
+        shard = self._shard(request_id)
+        with shard.lock:
+            return shard.records.get(request_id, default)
+
+    def pop(self, request_id, default=None):
+        shard = self._shard(request_id)
+        with shard.lock:
+            return shard.records.pop(request_id, default)
+
+    def __contains__(self, request_id):
+        shard = self._shard(request_id)
+        with shard.lock:
+            return request_id in shard.records
+
+    def __len__(self):
+        return sum(len(shard.records) for shard in self._shards)
+
+    def values(self):
+        """返回所有记录的快照（逐个分片加锁复制）"""
+        records = []
+        for shard in self._shards:
+            with shard.lock:
+                records.extend(shard.records.values())
+        return records
+
+    def expire(self, now=None):
+        """移除已到期的记录，返回 (已移除的记录列表, 到期但仍在等待结果的记录列表)
+
+        仍处于 pending 状态的记录不会被移除，而是以 now + ttl 重新排入到期堆，
+        由调用方决定如何处理（例如标记为超时），使之后的查询能看到最终状态。
+        """
+        now = time.time() if now is None else now
+        removed, overdue = [], []
+        for shard in self._shards:
+            with shard.lock:
+                expiry = shard.expiry
+                while expiry and expiry[0][0] <= now:
+                    _, request_id = heapq.heappop(expiry)
+                    record = shard.records.get(request_id)
+                    if record is None:
+                        # 记录已被提前移除
+                        continue
+                    if record.status == 'pending':
+                        overdue.append(record)
+                        heapq.heappush(expiry, (now + self.ttl, request_id))
+                    else:
+                        del shard.records[request_id]
+                        removed.append(record)
+        return removed, overdue
@@ -0,0 +1,121 @@
+# File: request_trace.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/request_trace.py
+# 请求时间线：web层和worker记录各阶段的时间戳（worker的部分经响应消息的 trace 属性传回），
+# 据此计算每个阶段的耗时，并对慢请求抽样记录日志、保留最慢的若干条
+import heapq
+import json
+import logging
+import random
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 按先后顺序排列的阶段，以及以该阶段结束的时间段名称（该阶段时间戳 - 上一个已记录阶段的时间戳）
+# queue_wait 和 response_queue 跨越web服务器和worker两台机器，包含两者的时钟偏差
+STAGES = (
+    ('accepted', None),                    # web: 开始接收请求体
+    ('created', 'receive'),                # web: 创建请求记录（流式上传的大图像此时已写入S3）
+    ('uploaded', 'upload'),                # web: 图像上传到输入桶（内联图像没有该阶段）
+    ('enqueued', 'enqueue'),               # web: 请求消息发送成功
+    ('worker_received', 'queue_wait'),     # worker: 从请求队列收到消息
+    ('fetched', 'download'),               # worker: 图像读入内存
+    ('decoded', 'preprocess'),             # worker: 解码和预处理完成
+    ('inference_started', 'batch_wait'),   # worker: 所在批次开始前向传播
+    ('inferred', 'inference'),             # worker: 前向传播完成
+    ('published', 'publish'),              # worker: 发送响应消息
+    ('response_received', 'response_queue'),  # web: 收到响应消息
+)
+
+
+def parse_trace_attribute(attributes):
+    """从响应消息属性中解析 worker 的阶段时间戳，缺失或无效时返回空字典"""
+    value = attributes.get('trace', {}).get('StringValue')
+    if not value:
+        return {}
+    try:
+        trace = json.loads(value)
+    except ValueError:
+        return {}
+    return {stage: timestamp for stage, timestamp in trace.items() if isinstance(timestamp, (int, float))}
+
+
+def summarize(trace):
+    """返回 {'stages': 各阶段时间戳, 'durations': 各时间段耗时（秒）, 'total': 首尾阶段间隔}"""
+    trace = trace or {}
+    durations = {}
+    first = previous = None
+    for stage, segment in STAGES:
+        timestamp = trace.get(stage)
+        if timestamp is None:
+            continue
+        if previous is None:
+            first = timestamp
+        elif segment:
+            durations[segment] = round(timestamp - previous, 6)
+        previous = timestamp
+    return {
+        'stages': {stage: trace[stage] for stage, _ in STAGES if stage in trace},
+        'durations': durations,
+        'total': round(previous - first, 6) if previous is not None else None
+    }
+
+
+class SlowRequestLog:
+    """慢请求记录
+
+    总耗时不小于 threshold 秒的请求按 sample_rate 抽样写入日志；
+    同时在内存中保留最慢的 keep 条，进入这一集合的请求无论是否被抽中都写入日志，
+    这样高负载下日志量受抽样比例限制，但最严重的异常值不会漏掉。
+    """
+
+    def __init__(self, threshold, sample_rate=0.1, keep=20, log=logger):
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.keep = keep
+        self.log = log
+        self.slow = 0
+        self.logged = 0
+        # (总耗时, request_id, 摘要) 的最小堆，堆顶是保留的请求中最快的一条
+        self._worst = []
+        self._lock = threading.Lock()
+
+    def observe(self, request_id, trace):
+        """检查一个已完成请求的时间线，返回是否写入了日志"""
+        if not self.threshold:
+            return False
+        summary = summarize(trace)
+        total = summary['total']
+        if total is None or total < self.threshold:
+            return False
+        entry = (total, request_id, summary)
+        with self._lock:
+            self.slow += 1
+            outlier = False
+            if len(self._worst) < self.keep:
+                heapq.heappush(self._worst, entry)
+                outlier = True
+            elif total > self._worst[0][0]:
+                heapq.heapreplace(self._worst, entry)
+                outlier = True
+            sampled = outlier or random.random() < self.sample_rate
+            if sampled:
+                self.logged += 1
+        if sampled:
+            self.log.warning(f"慢请求: {request_id}, 总耗时 {total:.3f} 秒, "
+                             f"{json.dumps(summary['durations'], sort_keys=True)}")
+        return sampled
+
+    def worst(self):
+        """返回保留的最慢请求，按总耗时从大到小排列"""
+        with self._lock:
+            entries = sorted(self._worst, key=lambda entry: entry[0], reverse=True)
+        return [{'request_id': request_id, **summary} for _, request_id, summary in entries]
+
+    def stats(self):
+        return {
+            'threshold': self.threshold,
+            'sample_rate': self.sample_rate,
+            'slow': self.slow,
+            'logged': self.logged,
+            'worst': self.worst()
+        }
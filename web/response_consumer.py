@@ -0,0 +1,198 @@
+# File: response_consumer.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/response_consumer.py
+# 响应队列消费线程池：多个线程并行接收消息，删除由独立线程批量完成（与接收流水线并行），
+# 线程数按观察到的队列积压在 [min_consumers, max_consumers] 之间自动调整
+import logging
+import math
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# SQS delete_message_batch 每批最多10条
+SQS_BATCH_MAX_ENTRIES = 10
+
+
+class ResponseConsumerPool:
+    """并行、自适应的 SQS 队列消费者
+
+    handle_message(message) 处理单条消息，返回后该消息即被排入删除队列；
+    抛出异常的消息不删除，可见性超时后由 SQS 重新投递。
+    """
+
+    def __init__(self, get_client, queue_url, handle_message, shutdown_event,
+                 min_consumers=1, max_consumers=8, backlog_per_consumer=50,
+                 scale_interval=5, max_messages=10, wait_time=20, delete_threads=2,
+                 message_attribute_names=('All',)):
+        self.get_client = get_client
+        self.queue_url = queue_url
+        self.handle_message = handle_message
+        self.shutdown_event = shutdown_event
+        self.min_consumers = min_consumers
+        self.max_consumers = max_consumers
+        self.backlog_per_consumer = backlog_per_consumer
+        self.scale_interval = scale_interval
+        self.max_messages = max_messages
+        self.wait_time = wait_time
+        self.delete_threads = delete_threads
+        self.message_attribute_names = list(message_attribute_names)
+
+        self._lock = threading.Lock()
+        self._target = min_consumers
+        self._running = set()
+        self._threads = []
+        self._deletes = queue.Queue()
+
+        # 指标
+        self.received = 0
+        self.handled = 0
+        self.failed = 0
+        self.deleted = 0
+        self.delete_failures = 0
+        self.backlog = None
+        self.in_flight = None
+        self.drain_rate = 0.0
+        self._last_handled = 0
+        self._last_sample = time.time()
+
+    def start(self):
+        for index in range(self.delete_threads):
+            self._start_thread(self._delete_loop, f"response-deleter-{index}")
+        self._start_thread(self._scale_loop, "response-scaler")
+        self._apply_target()
+
+    def join(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        for thread in list(self._threads):
+            thread.join(None if deadline is None else max(0, deadline - time.time()))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'consumers': len(self._running),
+                'target_consumers': self._target,
+                'received': self.received,
+                'handled': self.handled,
+                'failed': self.failed,
+                'deleted': self.deleted,
+                'delete_failures': self.delete_failures,
+                'pending_deletes': self._deletes.qsize(),
+                'backlog': self.backlog,
+                'in_flight': self.in_flight,
+                'drain_rate': round(self.drain_rate, 2)
+            }
+
+    def _start_thread(self, target, name, *args):
+        thread = threading.Thread(target=target, name=name, args=args, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _apply_target(self):
+        """启动编号小于目标数、当前未运行的消费线程；编号超出目标数的线程在本轮接收后自行退出"""
+        with self._lock:
+            missing = [index for index in range(self._target) if index not in self._running]
+            self._running.update(missing)
+        for index in missing:
+            self._start_thread(self._consume_loop, f"response-consumer-{index}", index)
+
+    def _consume_loop(self, index):
+        sqs = self.get_client()
+        while not self.shutdown_event.is_set():
+            with self._lock:
+                if index >= self._target:
+                    self._running.discard(index)
+                    logger.info(f"响应消费线程 {index} 退出（目标线程数 {self._target}）")
+                    return
+            try:
+                response = sqs.receive_message(
+                    QueueUrl=self.queue_url,
+                    MaxNumberOfMessages=self.max_messages,
+                    WaitTimeSeconds=self.wait_time,
+                    MessageAttributeNames=self.message_attribute_names
+                )
+            except Exception as e:
+                logger.error(f"接收响应消息时出错: {str(e)}")
+                self.shutdown_event.wait(5)  # 短暂暂停后重试
+                continue
+
+            messages = response.get('Messages', [])
+            if messages:
+                logger.debug(f"消费线程 {index} 收到 {len(messages)} 条响应消息")
+            handled = failed = 0
+            for message in messages:
+                try:
+                    self.handle_message(message)
+                except Exception as e:
+                    logger.error(f"响应消息处理错误: {str(e)}")
+                    failed += 1
+                    continue
+                handled += 1
+                # 删除交给删除线程批量完成，当前线程立即开始下一轮接收
+                self._deletes.put({'Id': message['MessageId'], 'ReceiptHandle': message['ReceiptHandle']})
+            with self._lock:
+                self.received += len(messages)
+                self.handled += handled
+                self.failed += failed
+        with self._lock:
+            self._running.discard(index)
+
+    def _delete_loop(self):
+        sqs = self.get_client()
+        while True:
+            try:
+                entries = [self._deletes.get(timeout=1)]
+            except queue.Empty:
+                if self.shutdown_event.is_set():
+                    return
+                continue
+            while len(entries) < SQS_BATCH_MAX_ENTRIES:
+                try:
+                    entries.append(self._deletes.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                response = sqs.delete_message_batch(QueueUrl=self.queue_url, Entries=entries)
+                failures = len(response.get('Failed', []))
+            except Exception as e:
+                logger.error(f"批量删除响应消息失败: {str(e)}")
+                failures = len(entries)
+            if failures:
+                # 未删除的消息会在可见性超时后重新投递，重复处理同一结果不影响正确性
+                logger.warning(f"{failures} 条响应消息删除失败")
+            with self._lock:
+                self.deleted += len(entries) - failures
+                self.delete_failures += failures
+
+    def _scale_loop(self):
+        sqs = self.get_client()
+        while not self.shutdown_event.wait(self.scale_interval):
+            now = time.time()
+            with self._lock:
+                handled = self.handled
+                elapsed = now - self._last_sample
+                self.drain_rate = (handled - self._last_handled) / elapsed if elapsed > 0 else 0.0
+                self._last_handled = handled
+                self._last_sample = now
+
+            try:
+                attributes = sqs.get_queue_attributes(
+                    QueueUrl=self.queue_url,
+                    AttributeNames=['ApproximateNumberOfMessages', 'ApproximateNumberOfMessagesNotVisible']
+                )['Attributes']
+            except Exception as e:
+                logger.error(f"获取响应队列积压失败: {str(e)}")
+                continue
+            backlog = int(attributes.get('ApproximateNumberOfMessages', 0))
+            in_flight = int(attributes.get('ApproximateNumberOfMessagesNotVisible', 0))
+
+            target = max(self.min_consumers,
+                         min(self.max_consumers, math.ceil(backlog / self.backlog_per_consumer)))
+            with self._lock:
+                self.backlog = backlog
+                self.in_flight = in_flight
+                previous, self._target = self._target, target
+            if target != previous:
+                logger.info(f"响应队列积压 {backlog}，消费速率 {self.drain_rate:.1f} 条/秒，"
+                            f"消费线程数 {previous} -> {target}")
+            self._apply_target()
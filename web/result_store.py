@@ -0,0 +1,139 @@
+# File: result_store.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/result_store.py
+# 多个web节点共享的请求结果存储：任何节点都能查询其他节点创建的请求的状态和结果
+#   memory: 进程内存（单节点，默认）
+#   file:   共享目录中每个请求一个JSON文件（同一台机器上运行多个节点时的本地替代）
+#   s3:     S3 桶中每个请求一个JSON对象（多台机器）
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryResultStore:
+    """进程内的结果存储，条目超过 ttl 秒或总数超过 max_entries 后淘汰"""
+
+    def __init__(self, max_entries=100000, ttl=3600):
+        self._cache = LRUCache(max_entries=max_entries, ttl=ttl)
+
+    def put(self, request_id, entry):
+        self._cache.put(request_id, entry)
+
+    def get(self, request_id):
+        return self._cache.get(request_id)
+
+
+class FileResultStore:
+    """共享目录中的结果存储：先写临时文件再原子替换，读取方不会看到写了一半的文件"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, request_id):
+        return os.path.join(self.directory, f"{request_id}.json")
+
+    def put(self, request_id, entry):
+        path = self._path(request_id)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(entry, f)
+        os.replace(temp_path, path)
+
+    def get(self, request_id):
+        try:
+            with open(self._path(request_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+
+class S3ResultStore:
+    """S3 中的结果存储，键为 prefix + request_id + '.json'（过期清理交给桶的生命周期规则）"""
+
+    def __init__(self, get_client, bucket, prefix='requests/'):
+        self.get_client = get_client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def put(self, request_id, entry):
+        self.get_client().put_object(
+            Bucket=self.bucket,
+            Key=f"{self.prefix}{request_id}.json",
+            Body=json.dumps(entry),
+            ContentType='application/json'
+        )
+
+    def get(self, request_id):
+        s3 = self.get_client()
+        try:
+            response = s3.get_object(Bucket=self.bucket, Key=f"{self.prefix}{request_id}.json")
+        except s3.exceptions.NoSuchKey:
+            return None
+        return json.loads(response['Body'].read())
+
+
+def create_result_store(kind, get_client=None, path='', bucket='', prefix='requests/', ttl=3600):
+    """按配置创建结果存储（kind 为 memory、file 或 s3）"""
+    if kind == 'memory':
+        return MemoryResultStore(ttl=ttl)
+    if kind == 'file':
+        if not path:
+            raise ValueError("file result store requires a directory path")
+        return FileResultStore(path)
+    if kind == 's3':
+        return S3ResultStore(get_client, bucket, prefix)
+    raise ValueError(f"Unknown result store: {kind}")
+
+
+def wait_for_entry(store, request_id, timeout, stop_event, interval=0.5, max_interval=5.0):
+    """轮询结果存储直到请求不再是 pending、超过 timeout 秒或 stop_event 置位，返回最后读到的条目
+
+    其他节点创建的请求没有本地的完成事件，只能轮询；间隔从 interval 起每次加倍，不超过 max_interval，
+    使长时间未完成的请求不会对存储（如S3）产生大量读取。
+    """
+    deadline = time.time() + timeout
+    entry = store.get(request_id)
+    while entry is not None and entry['status'] == 'pending':
+        remaining = deadline - time.time()
+        if remaining <= 0 or stop_event.wait(min(interval, remaining)):
+            break
+        interval = min(interval * 2, max_interval)
+        entry = store.get(request_id)
+    return entry
+
+
+class ResultStoreWriter:
+    """在后台线程中写入结果存储，不阻塞请求线程
+
+    同一请求的写入总是交给同一个单线程执行器，按提交顺序完成（pending 不会覆盖之后写入的最终状态），
+    不同请求的写入分散到 threads 个执行器上并行进行。
+    """
+
+    def __init__(self, store, threads=4):
+        self.store = store
+        self._executors = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix=f'result-store-{index}')
+            for index in range(threads)
+        ]
+        self.failures = 0
+
+    def put(self, request_id, entry):
+        executor = self._executors[hash(request_id) % len(self._executors)]
+        return executor.submit(self._put, request_id, entry)
+
+    def _put(self, request_id, entry):
+        try:
+            self.store.put(request_id, entry)
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"写入结果存储失败: {request_id}, {str(e)}")
+
+    def shutdown(self, wait=True):
+        for executor in self._executors:
+            executor.shutdown(wait=wait)
@@ -0,0 +1,139 @@
+# File: sqs_batcher.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/sqs_batcher.py
+# 合并并发的 SQS 发送：调用方各自提交消息，后台线程在短暂的等待窗口内把它们合并为 send_message_batch
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+logger = logging.getLogger(__name__)
+
+# SQS 批量发送的限制：每批最多10条，整批消息总大小不超过256KB
+SQS_BATCH_MAX_ENTRIES = 10
+SQS_BATCH_MAX_BYTES = 256 * 1024
+
+
+class SqsSendError(Exception):
+    """单条消息发送失败（批量调用中该条目失败，或整个批量调用出错）"""
+
+    def __init__(self, message, code=None, sender_fault=None):
+        super().__init__(message)
+        self.code = code
+        self.sender_fault = sender_fault
+
+
+def message_size(body, attributes):
+    """估算一条消息计入SQS大小限制的字节数（消息体 + 属性名、类型和值）"""
+    size = len(body.encode('utf-8'))
+    for name, attribute in (attributes or {}).items():
+        size += len(name) + len(attribute.get('DataType', ''))
+        size += len(attribute.get('StringValue', '')) + len(attribute.get('BinaryValue', b''))
+    return size
+
+
+class SqsBatchSender:
+    """把发往同一队列的并发消息合并为批量发送，每个调用方仍然得到自己的成功或失败结果"""
+
+    def __init__(self, get_client, queue_url, linger=0.005, flush_threads=4, send_timeout=30):
+        # get_client: 返回 SQS 客户端的函数（客户端由调用方共享和管理）
+        # send_timeout: send() 默认的最长等待秒数，应不小于 SQS 客户端一次调用（含重试）的超时
+        self.get_client = get_client
+        self.queue_url = queue_url
+        self.linger = linger
+        self.send_timeout = send_timeout
+        self._pending = queue.Queue()
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.messages = 0
+        for index in range(flush_threads):
+            threading.Thread(target=self._flush_loop, name=f"sqs-batcher-{index}", daemon=True).start()
+
+    def submit(self, body, attributes=None):
+        """提交一条消息，返回 Future，结果为 SQS 分配的 MessageId"""
+        future = Future()
+        self._pending.put((body, attributes or {}, message_size(body, attributes), future))
+        return future
+
+    def send(self, body, attributes=None, timeout=None):
+        """发送一条消息并等待其所在批次发送完成，返回 MessageId
+
+        失败或超过 timeout 秒（默认 send_timeout）仍未完成时抛出 SqsSendError，
+        发送线程卡住时调用方不会无限等待。
+        """
+        future = self.submit(body, attributes)
+        try:
+            return future.result(self.send_timeout if timeout is None else timeout)
+        except TimeoutError:
+            raise SqsSendError("Timed out waiting for send_message_batch") from None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'batches': self.batches,
+                'messages': self.messages,
+                'avg_batch_size': self.messages / self.batches if self.batches else 0.0
+            }
+
+    def _collect(self, carry):
+        """收集一批消息：阻塞等待第一条，再在等待窗口内凑满条数或大小上限"""
+        batch = [carry] if carry else [self._pending.get()]
+        total_bytes = batch[0][2]
+        deadline = time.time() + self.linger
+        while len(batch) < SQS_BATCH_MAX_ENTRIES:
+            remaining = deadline - time.time()
+            try:
+                item = self._pending.get(timeout=remaining) if remaining > 0 else self._pending.get_nowait()
+            except queue.Empty:
+                break
+            if total_bytes + item[2] > SQS_BATCH_MAX_BYTES:
+                # 超出整批大小上限，留到下一批
+                return batch, item
+            batch.append(item)
+            total_bytes += item[2]
+        return batch, None
+
+    def _flush_loop(self):
+        carry = None
+        while True:
+            batch, carry = self._collect(carry)
+            try:
+                self._flush(batch)
+            except Exception as e:
+                # 保持发送线程存活；本批未得到结果的调用方在 send_timeout 后收到超时错误
+                logger.exception(f"SQS批量发送线程出错: {str(e)}")
+
+    def _flush(self, batch):
+        entries = []
+        for index, (body, attributes, _, _) in enumerate(batch):
+            entry = {'Id': str(index), 'MessageBody': body}
+            if attributes:
+                entry['MessageAttributes'] = attributes
+            entries.append(entry)
+
+        try:
+            response = self.get_client().send_message_batch(QueueUrl=self.queue_url, Entries=entries)
+        except Exception as e:
+            logger.error(f"SQS批量发送失败: {str(e)}")
+            for *_, future in batch:
+                future.set_exception(SqsSendError(str(e)))
+            return
+
+        with self._lock:
+            self.batches += 1
+            self.messages += len(batch)
+
+        successful = {item['Id']: item['MessageId'] for item in response.get('Successful', [])}
+        failed = {item['Id']: item for item in response.get('Failed', [])}
+        for index, (*_, future) in enumerate(batch):
+            entry_id = str(index)
+            if entry_id in successful:
+                future.set_result(successful[entry_id])
+            else:
+                failure = failed.get(entry_id, {})
+                logger.warning(f"SQS批量发送条目失败: {failure.get('Code')}, {failure.get('Message')}")
+                future.set_exception(SqsSendError(
+                    failure.get('Message', 'Missing from send_message_batch response'),
+                    code=failure.get('Code'),
+                    sender_fault=failure.get('SenderFault')
+                ))
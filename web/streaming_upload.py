@@ -0,0 +1,157 @@
+# File: streaming_upload.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/streaming_upload.py
+# 流式上传：直接从请求体解析 multipart，边接收边计算哈希并写入S3，不把整个请求体先缓存到内存或临时文件
+import hashlib
+import logging
+import threading
+
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
+
+logger = logging.getLogger(__name__)
+
+# S3 分段上传除最后一段外每段至少 5MB
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+class UploadTooLarge(ValueError):
+    """上传内容超过允许的最大大小"""
+
+
+class IncompleteUpload(ValueError):
+    """请求体在 multipart 结束边界之前就结束了（客户端断开或上传被截断），或 multipart 格式无效"""
+
+
+class StreamingUpload:
+    """把逐块到达的上传数据写入S3
+
+    数据不超过 part_size 时只保留在内存中，由调用方按普通方式处理（内联或一次上传）；
+    超过后改用S3分段上传，每凑满一段就交给线程池上传，最多 max_concurrent_parts 段同时上传，
+    超出时 write() 阻塞（对客户端形成背压），因此每个请求的内存占用不超过
+    part_size * (max_concurrent_parts + 1)，与图像大小无关。
+    """
+
+    def __init__(self, s3, bucket, key, executor, part_size=8 * 1024 * 1024, max_concurrent_parts=4,
+                 max_size=None):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.executor = executor
+        self.part_size = max(part_size, S3_MIN_PART_SIZE)
+        self.max_size = max_size
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._buffer = bytearray()
+        self._slots = threading.BoundedSemaphore(max_concurrent_parts)
+        self._upload_id = None
+        self._parts = []
+
+    @property
+    def digest(self):
+        return self._hash.hexdigest()
+
+    @property
+    def multipart(self):
+        return self._upload_id is not None
+
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.max_size is not None and self.size > self.max_size:
+            raise UploadTooLarge(f"Upload exceeds {self.max_size} bytes")
+        self._hash.update(chunk)
+        self._buffer += chunk
+        # 缓冲区超过一段时才上传，保证最后一段非空
+        while len(self._buffer) > self.part_size:
+            self._upload_part(bytes(self._buffer[:self.part_size]))
+            del self._buffer[:self.part_size]
+
+    def finish(self):
+        """结束上传：未启用分段上传时返回全部数据，否则上传最后一段、完成分段上传并返回 None"""
+        if not self.multipart:
+            return bytes(self._buffer)
+        self._upload_part(bytes(self._buffer))
+        self._buffer = bytearray()
+        parts = [{'PartNumber': number, 'ETag': future.result()} for number, future in self._parts]
+        self.s3.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self._upload_id,
+            MultipartUpload={'Parts': parts}
+        )
+        logger.info(f"分段上传完成: {self.bucket}/{self.key}, {self.size} 字节, {len(parts)} 段")
+        return None
+
+    def abort(self):
+        """放弃上传，删除已上传的分段"""
+        if not self.multipart:
+            return
+        for _, future in self._parts:
+            future.cancel()
+        try:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+        except Exception as e:
+            logger.error(f"放弃分段上传失败: {self.key}, {str(e)}")
+
+    def _upload_part(self, data):
+        if self._upload_id is None:
+            self._upload_id = self.s3.create_multipart_upload(Bucket=self.bucket, Key=self.key)['UploadId']
+        part_number = len(self._parts) + 1
+        self._slots.acquire()
+        try:
+            future = self.executor.submit(self._put_part, part_number, data)
+        except Exception:
+            self._slots.release()
+            raise
+        self._parts.append((part_number, future))
+
+    def _put_part(self, part_number, data):
+        try:
+            response = self.s3.upload_part(
+                Bucket=self.bucket,
+                Key=self.key,
+                UploadId=self._upload_id,
+                PartNumber=part_number,
+                Body=data
+            )
+            return response['ETag']
+        finally:
+            self._slots.release()
+
+
+def receive_multipart_file(stream, boundary, field_name, start_upload, chunk_size=64 * 1024):
+    """从请求体流中解析 multipart，把 field_name 字段的文件内容逐块写入 start_upload(文件名) 返回的上传对象
+
+    返回 (文件名, 上传对象)；请求中没有该字段时返回 (None, None)，文件名为空时不创建上传对象。
+    其他字段的数据被丢弃。请求体在结束边界之前就结束时抛出 IncompleteUpload。
+    """
+    decoder = MultipartDecoder(boundary.encode('latin-1'))
+
+    def next_event():
+        # 数据结束后解码器仍未到达结束边界时，werkzeug 抛出 ValueError
+        try:
+            return decoder.next_event()
+        except ValueError as e:
+            raise IncompleteUpload(str(e)) from e
+
+    filename, upload, receiving = None, None, False
+    while True:
+        chunk = stream.read(chunk_size)
+        decoder.receive_data(chunk or None)
+        event = next_event()
+        while not isinstance(event, (NeedData, Epilogue)):
+            if isinstance(event, File):
+                receiving = event.name == field_name and upload is None and filename is None
+                if receiving:
+                    filename = event.filename
+                    upload = start_upload(filename) if filename else None
+            elif isinstance(event, Data):
+                if receiving and upload is not None:
+                    upload.write(event.data)
+                if not event.more_data:
+                    receiving = False
+            else:
+                receiving = False
+            event = next_event()
+        if isinstance(event, Epilogue):
+            return filename, upload
+        if not chunk:
+            raise IncompleteUpload("Request body ended before the closing multipart boundary")
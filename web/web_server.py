@@ -1,19 +1,48 @@
 # File: web_server.py version 2.0 release 2025-06-28 by Wenguang Zuo
 # wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/web_server.py
 # wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/web_server_config.json
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/cache.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/aws_clients.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/sqs_batcher.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/record_store.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/response_consumer.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/inline_payload.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/streaming_upload.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/metrics.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/request_trace.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/admission.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/result_store.py
+# wget https://raw.githubusercontent.com/HarryZuo2024/cse546-project2/refs/heads/main/web/node_routing.py
 
-from collections import defaultdict, UserDict
+from collections import defaultdict
 from threading import RLock
 import threading
 import time
 import logging
 import json
-from flask import Flask, request, jsonify, Response
-import boto3
-from botocore.config import Config
+from flask import Flask, request, jsonify, Response, stream_with_context
 import uuid
 from functools import wraps
+import hashlib
+import io
 import os
+import queue
+import tarfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from aws_clients import AwsClients
+from cache import ByteBudgetCache, LRUCache
+from sqs_batcher import SqsBatchSender
+from record_store import RecordStore, RequestRecord
+from response_consumer import ResponseConsumerPool
+from inline_payload import build_request_message
+from streaming_upload import IncompleteUpload, StreamingUpload, UploadTooLarge, receive_multipart_file
+from metrics import MetricsRegistry
+from request_trace import SlowRequestLog, parse_trace_attribute, summarize
+from admission import AdmissionController
+from result_store import ResultStoreWriter, create_result_store, wait_for_entry
+from node_routing import NodeRouting, default_node_id
 
 
 # 配置日志
@@ -69,69 +98,207 @@ except FileNotFoundError:
 #         with self.lock:
 #             return key in self.dict
         
-class SafeUserDict(UserDict):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.lock = RLock()
-    def __getitem__(self, key):
-        with self.lock:
-            return super().__getitem__(key)
-    def __setitem__(self, key, value):
-        with self.lock:
-            super().__setitem__(key, value)
-    def __delitem__(self, key):
-        with self.lock:
-            super().__delitem__(key)
-    def get(self, key, default=None):
-        with self.lock:
-            return super().get(key, default)
-    def items(self):
-        with self.lock:
-            return list(super().items())
-    def pop(self, key, default=None):
-        with self.lock:
-            return super().pop(key, default)
-    def update(self, other):
-        with self.lock:
-            super().update(other)
-    def __contains__(self, key):
-        with self.lock:
-            return super().__contains__(key)
-        
 # AWS 配置（带默认值）
 AWS_REGION = config.get("AWS_REGION", "us-east-1")
 INPUT_BUCKET = config.get("INPUT_BUCKET", "project2-input-bucket-abc")
 OUTPUT_BUCKET = config.get("OUTPUT_BUCKET", "project2-output-bucket-xyz")
 REQUEST_QUEUE_URL = config.get("REQUEST_QUEUE_URL", "https://sqs.us-east-1.amazonaws.com/257288819129/request-queue")
 RESPONSE_QUEUE_URL = config.get("RESPONSE_QUEUE_URL", "https://sqs.us-east-1.amazonaws.com/257288819129/response-queue")
+# 非空时 S3/SQS 使用该地址（本地测试时指向 LocalStack、ElasticMQ、MinIO 等兼容实现）
+AWS_ENDPOINT_URL = config.get("AWS_ENDPOINT_URL", "")
+
+# 多节点参数（带默认值）
+# NODE_ID 为空时使用主机名；NODE_RESPONSE_QUEUE_PREFIX 非空时每个节点使用自己的响应队列
+# （名为 前缀 + NODE_ID，启动时创建），为空时使用 RESPONSE_QUEUE_URL，只适用于单节点部署：
+# 未知请求ID的响应会被删除，因此运行多个节点时必须设置 NODE_RESPONSE_QUEUE_PREFIX
+NODE_ID = config.get("NODE_ID", "") or default_node_id()
+NODE_RESPONSE_QUEUE_PREFIX = config.get("NODE_RESPONSE_QUEUE_PREFIX", "")
+NODE_RESPONSE_QUEUE_DELETE_ON_EXIT = config.get("NODE_RESPONSE_QUEUE_DELETE_ON_EXIT", False)
+
+# 共享结果存储参数（带默认值）
+# RESULT_STORE: memory（仅本节点）、file（RESULT_STORE_PATH 目录，同一台机器上的多个节点共享）
+# 或 s3（RESULT_STORE_BUCKET 桶中 RESULT_STORE_PREFIX 前缀下，多台机器共享）；
+# 本节点没有记录的请求ID到结果存储中查询，因此任一节点都能回答 /status
+RESULT_STORE = config.get("RESULT_STORE", "memory")
+RESULT_STORE_PATH = config.get("RESULT_STORE_PATH", "")
+RESULT_STORE_BUCKET = config.get("RESULT_STORE_BUCKET", "") or OUTPUT_BUCKET
+RESULT_STORE_PREFIX = config.get("RESULT_STORE_PREFIX", "requests/")
+RESULT_STORE_TTL = config.get("RESULT_STORE_TTL", 3600)
+RESULT_STORE_WRITE_THREADS = config.get("RESULT_STORE_WRITE_THREADS", 4)
+# 其他节点创建的请求在结果存储中轮询等待，间隔从 RESULT_STORE_POLL_INTERVAL 秒起加倍，不超过 RESULT_STORE_POLL_MAX_INTERVAL 秒
+RESULT_STORE_POLL_INTERVAL = config.get("RESULT_STORE_POLL_INTERVAL", 0.5)
+RESULT_STORE_POLL_MAX_INTERVAL = config.get("RESULT_STORE_POLL_MAX_INTERVAL", 5)
 
 # 性能优化参数（带默认值）
-POLLING_INTERVAL = config.get("POLLING_INTERVAL", 0.5)
 SQS_MAX_MESSAGES = config.get("SQS_MAX_MESSAGES", 10)
 CLEANUP_INTERVAL = config.get("CLEANUP_INTERVAL", 300)
 REQUEST_TIMEOUT = config.get("REQUEST_TIMEOUT", 360)
 LONG_POLL_TIMEOUT = config.get("LONG_POLL_TIMEOUT", 300)
-INITIAL_POLLING_DELAY = config.get("INITIAL_POLLING_DELAY", 10)
+# 请求记录存储的分片数（带默认值），分片越多并发请求间的锁竞争越少
+RECORD_STORE_SHARDS = config.get("RECORD_STORE_SHARDS", 64)
+
+# 结果缓存参数（带默认值）
+# 以上传内容的SHA-256为键缓存分类结果，相同图片再次提交时直接返回
+RESULT_CACHE_MAX_ENTRIES = config.get("RESULT_CACHE_MAX_ENTRIES", 10000)
+RESULT_CACHE_TTL = config.get("RESULT_CACHE_TTL", 3600)
+# 以输出桶中的结果键（xxx.csv）缓存 /result 的内容，总大小不超过 OUTPUT_CACHE_MAX_BYTES
+OUTPUT_CACHE_MAX_BYTES = config.get("OUTPUT_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+OUTPUT_CACHE_TTL = config.get("OUTPUT_CACHE_TTL", 3600)
+
+# AWS 客户端连接池大小（带默认值），应不小于并发请求线程数
+MAX_POOL_CONNECTIONS = config.get("MAX_POOL_CONNECTIONS", 100)
+# AWS 客户端单次尝试的连接和读取超时（秒）
+AWS_CONNECT_TIMEOUT = config.get("AWS_CONNECT_TIMEOUT", 5)
+AWS_READ_TIMEOUT = config.get("AWS_READ_TIMEOUT", 10)
+
+# 请求消息批量发送参数（带默认值）
+# 并发请求的消息在等待窗口内合并为 send_message_batch（每批最多10条）
+SQS_SEND_LINGER_SECONDS = config.get("SQS_SEND_LINGER_SECONDS", 0.005)
+SQS_SEND_FLUSH_THREADS = config.get("SQS_SEND_FLUSH_THREADS", 4)
+# 请求线程等待消息发送结果的最长秒数，超时时请求以 5xx 结束（默认允许两次完整的连接+读取超时）
+SQS_SEND_TIMEOUT = config.get("SQS_SEND_TIMEOUT", 2 * (AWS_CONNECT_TIMEOUT + AWS_READ_TIMEOUT))
+
+# 响应队列消费参数（带默认值）
+# 消费线程数 = 积压消息数 / RESPONSE_BACKLOG_PER_CONSUMER，限制在 [MIN, MAX] 之间，每 RESPONSE_SCALE_INTERVAL 秒调整一次
+RESPONSE_CONSUMERS_MIN = config.get("RESPONSE_CONSUMERS_MIN", 1)
+RESPONSE_CONSUMERS_MAX = config.get("RESPONSE_CONSUMERS_MAX", 8)
+RESPONSE_BACKLOG_PER_CONSUMER = config.get("RESPONSE_BACKLOG_PER_CONSUMER", 50)
+RESPONSE_SCALE_INTERVAL = config.get("RESPONSE_SCALE_INTERVAL", 5)
+RESPONSE_DELETE_THREADS = config.get("RESPONSE_DELETE_THREADS", 2)
+
+# 内联传输参数（带默认值）
+# 编码后的消息不超过 INLINE_MAX_MESSAGE_BYTES 的图像直接放入请求消息，跳过S3上传和worker端的下载
+INLINE_PAYLOADS = config.get("INLINE_PAYLOADS", True)
+INLINE_MAX_MESSAGE_BYTES = config.get("INLINE_MAX_MESSAGE_BYTES", 262144)
+INLINE_COMPRESSION = config.get("INLINE_COMPRESSION", False)
+
+# 批量分类接口参数（带默认值）
+# 单次请求最多 BATCH_MAX_ITEMS 张图像、解压后共 BATCH_MAX_BYTES 字节，用 BATCH_SUBMIT_THREADS 个线程并行提交，
+# 等待结果期间每 BATCH_HEARTBEAT_INTERVAL 秒输出一行进度
+BATCH_MAX_ITEMS = config.get("BATCH_MAX_ITEMS", 1000)
+BATCH_MAX_BYTES = config.get("BATCH_MAX_BYTES", 256 * 1024 * 1024)
+BATCH_SUBMIT_THREADS = config.get("BATCH_SUBMIT_THREADS", 16)
+BATCH_HEARTBEAT_INTERVAL = config.get("BATCH_HEARTBEAT_INTERVAL", 15)
+
+# 流式上传参数（带默认值）
+# /classify 边接收边处理请求体：不超过 UPLOAD_PART_SIZE 的图像保留在内存中，更大的图像用S3分段上传，
+# 每个请求最多 UPLOAD_CONCURRENT_PARTS 段同时上传；超过 UPLOAD_MAX_BYTES 的上传返回 413
+UPLOAD_MAX_BYTES = config.get("UPLOAD_MAX_BYTES", 64 * 1024 * 1024)
+UPLOAD_PART_SIZE = config.get("UPLOAD_PART_SIZE", 8 * 1024 * 1024)
+UPLOAD_CONCURRENT_PARTS = config.get("UPLOAD_CONCURRENT_PARTS", 4)
+UPLOAD_PART_THREADS = config.get("UPLOAD_PART_THREADS", 32)
+
+# 状态推送参数（带默认值）
+# 一个 /events 连接最多跟踪 SSE_MAX_IDS 个请求，空闲时每 SSE_KEEPALIVE_INTERVAL 秒发送一次保活注释
+SSE_MAX_IDS = config.get("SSE_MAX_IDS", 1000)
+SSE_KEEPALIVE_INTERVAL = config.get("SSE_KEEPALIVE_INTERVAL", 15)
+
+# 慢请求日志参数（带默认值）
+# 总耗时不小于 SLOW_REQUEST_THRESHOLD 秒的请求按 SLOW_REQUEST_SAMPLE_RATE 抽样记录阶段耗时（0 表示不启用），
+# 最慢的 SLOW_REQUEST_KEEP 条总是记录并可通过 /traces/slow 查看；SLOW_REQUEST_LOG_FILE 非空时另写入该文件
+SLOW_REQUEST_THRESHOLD = config.get("SLOW_REQUEST_THRESHOLD", 10)
+SLOW_REQUEST_SAMPLE_RATE = config.get("SLOW_REQUEST_SAMPLE_RATE", 0.1)
+SLOW_REQUEST_KEEP = config.get("SLOW_REQUEST_KEEP", 20)
+SLOW_REQUEST_LOG_FILE = config.get("SLOW_REQUEST_LOG_FILE", "")
+
+# 准入控制参数（带默认值，0 表示不启用对应的检查）
+# 同时处理的分类请求（含长轮询等待）超过 ADMISSION_MAX_INFLIGHT，或估计的排队时间
+# （请求队列深度 / worker处理速率）超过 ADMISSION_MAX_WAIT 秒时，立即返回 429 和 Retry-After；
+# 队列深度每 ADMISSION_SAMPLE_INTERVAL 秒采样一次。排队时间检查默认关闭，
+# 且只在观察到worker正在处理请求后生效（冷启动时的突发请求由自动伸缩器消化）
+ADMISSION_MAX_INFLIGHT = config.get("ADMISSION_MAX_INFLIGHT", 500)
+ADMISSION_MAX_WAIT = config.get("ADMISSION_MAX_WAIT", 0)
+ADMISSION_SAMPLE_INTERVAL = config.get("ADMISSION_SAMPLE_INTERVAL", 5)
+# 共用请求队列的web节点数，用于把队列深度均分到各节点；0 表示按节点响应队列的数量自动估计
+ADMISSION_NODE_COUNT = config.get("ADMISSION_NODE_COUNT", 0)
+ADMISSION_MAX_RETRY_AFTER = config.get("ADMISSION_MAX_RETRY_AFTER", 60)
 
 app = Flask(__name__)
 
-# 配置重试策略
-s3_config = Config(
-    retries={
-        'max_attempts': 5,
-        'mode': 'adaptive'
-    },
-    max_pool_connections=100
+# 共享的 S3/SQS 客户端（只创建一次，线程安全，带自适应重试策略）
+aws = AwsClients(AWS_REGION, max_pool_connections=MAX_POOL_CONNECTIONS, endpoint_url=AWS_ENDPOINT_URL,
+                 connect_timeout=AWS_CONNECT_TIMEOUT, read_timeout=AWS_READ_TIMEOUT)
+
+# 本节点的身份和响应队列（启动时 setup() 创建节点响应队列）
+node = NodeRouting(
+    lambda: aws.sqs,
+    NODE_ID,
+    RESPONSE_QUEUE_URL,
+    queue_prefix=NODE_RESPONSE_QUEUE_PREFIX,
+    retention_seconds=REQUEST_TIMEOUT
+)
+
+# 各节点共享的请求结果存储（后台线程写入，同一请求的写入按顺序完成）
+result_store = create_result_store(
+    RESULT_STORE,
+    get_client=lambda: aws.s3,
+    path=RESULT_STORE_PATH,
+    bucket=RESULT_STORE_BUCKET,
+    prefix=RESULT_STORE_PREFIX,
+    ttl=RESULT_STORE_TTL
 )
+result_store_writer = ResultStoreWriter(result_store, threads=RESULT_STORE_WRITE_THREADS)
+
+# 请求队列的批量发送器（每个调用方仍然得到自己的发送结果）
+request_sender = SqsBatchSender(
+    lambda: aws.sqs,
+    REQUEST_QUEUE_URL,
+    linger=SQS_SEND_LINGER_SECONDS,
+    flush_threads=SQS_SEND_FLUSH_THREADS,
+    send_timeout=SQS_SEND_TIMEOUT
+)
+
+# 分段上传的共享线程池（各请求的并发段数由 StreamingUpload 单独限制）
+upload_part_executor = ThreadPoolExecutor(max_workers=UPLOAD_PART_THREADS, thread_name_prefix='upload-part')
 
 # 记录所有请求及其状态
 # request_records = ThreadSafeDict()
-request_records = SafeUserDict()
+# request_records = SafeUserDict()
+request_records = RecordStore(REQUEST_TIMEOUT, shards=RECORD_STORE_SHARDS)
+
+# 内容哈希 -> 分类结果 的缓存
+label_cache = LRUCache(RESULT_CACHE_MAX_ENTRIES, RESULT_CACHE_TTL)
+# 输出桶结果键 -> 结果文件内容 的缓存（响应到达时写入，/result 未命中时回源S3）
+output_cache = ByteBudgetCache(OUTPUT_CACHE_MAX_BYTES, OUTPUT_CACHE_TTL)
+# 内容哈希 -> 正在处理中的request_id，相同内容的并发请求共用同一个任务
+inflight_requests = {}
+inflight_lock = RLock()
+coalesced_count = 0
+
+# 指标（通过 /metrics 导出）
+metrics = MetricsRegistry()
+submitted_total = metrics.counter('web_requests_submitted_total', '提交到请求队列的分类请求数')
+cache_hits_total = metrics.counter('web_result_cache_hits_total', '内容哈希命中结果缓存的请求数')
+coalesced_total = metrics.counter('web_requests_coalesced_total', '合并到相同内容在途请求的请求数')
+upload_seconds = {
+    mode: metrics.histogram('web_upload_seconds', '图像写入输入桶的耗时（put: 一次上传, stream: 流式分段上传）',
+                            labels={'mode': mode})
+    for mode in ('put', 'stream')
+}
+enqueue_seconds = metrics.histogram('web_enqueue_seconds', '请求消息入队（含批量发送等待窗口）的耗时')
+request_seconds = metrics.histogram('web_request_seconds', '从记录创建到收到结果的端到端耗时')
+long_poll_waiters = metrics.gauge('web_long_poll_waiters', '正在长轮询等待结果的连接数')
+metrics.gauge('web_inflight_requests', '正在处理中的不同内容的请求数', function=lambda: len(inflight_requests))
+metrics.gauge('web_request_records', '请求记录存储中的记录数', function=lambda: len(request_records))
+admission_rejected_total = {
+    reason: metrics.counter('web_admission_rejected_total', '被准入控制拒绝的请求数（inflight: 在途请求过多, wait: 估计排队时间过长）',
+                            labels={'reason': reason})
+    for reason in ('inflight', 'wait')
+}
+
+# 慢请求日志（独立的 logger，便于单独输出到文件）
+slow_request_logger = logging.getLogger('slow_requests')
+if SLOW_REQUEST_LOG_FILE:
+    slow_request_handler = logging.FileHandler(SLOW_REQUEST_LOG_FILE)
+    slow_request_handler.setFormatter(logging.Formatter('%(asctime)s - %(message)s'))
+    slow_request_logger.addHandler(slow_request_handler)
+slow_requests = SlowRequestLog(
+    SLOW_REQUEST_THRESHOLD,
+    sample_rate=SLOW_REQUEST_SAMPLE_RATE,
+    keep=SLOW_REQUEST_KEEP,
+    log=slow_request_logger
+)
 
-# 创建锁
-s3_lock = RLock()
-sqs_request_lock = RLock()  # 保护请求队列操作
-sqs_response_lock = RLock()  # 保护响应队列操作
 shutdown_event = threading.Event()
 
 # 统一错误处理装饰器
@@ -148,110 +315,644 @@ def handle_errors(func):
             }), 500
     return wrapper
 
+def release_inflight(digest, request_id):
+    """请求结束后移除内容哈希到request_id的在途映射"""
+    with inflight_lock:
+        if inflight_requests.get(digest) == request_id:
+            del inflight_requests[digest]
+
+def store_result(request_id, status, result, filename, timestamp):
+    """把请求状态写入共享结果存储，供其他节点查询"""
+    result_store_writer.put(request_id, {
+        'request_id': request_id,
+        'status': status,
+        'result': result,
+        'filename': filename,
+        'node_id': NODE_ID,
+        'timestamp': timestamp
+    })
+
+def store_record(record):
+    store_result(record.request_id, record.status, record.result, record.filename, record.timestamp)
+
+def finish_request(record, **updates):
+    """结束请求并唤醒所有等待该请求的线程；只有第一次离开 pending 的状态变化生效，返回是否生效"""
+    if not record.finish(**updates):
+        return False
+    store_record(record)
+    metrics.counter('web_requests_finished_total', '已结束的请求数（按最终状态）',
+                    labels={'status': record.status}).inc()
+    if record.status == 'completed':
+        request_seconds.observe(time.time() - record.timestamp)
+    record.notify()
+    return True
+
+def wake_all_waiters():
+    """关闭时唤醒所有仍在长轮询的线程"""
+    for record in request_records.values():
+        record.notify()
+
 # 处理请求状态检查和响应构建
-def process_request_status(request_id, poll_timeout=LONG_POLL_TIMEOUT):
-    """处理请求状态并返回标准化响应"""
+def process_request_status(request_id, poll_timeout=LONG_POLL_TIMEOUT, trace=False):
+    """处理请求状态并返回标准化响应；trace 为真时以JSON返回状态、结果和各阶段耗时"""
     # 获取请求记录
     record = request_records.get(request_id)
     if not record:
+        # 其他节点创建的（或本节点已清理的）请求，在共享结果存储中按退避间隔轮询，直到结束或长轮询超时
+        long_poll_waiters.inc()
+        try:
+            entry = wait_stored_entry(request_id, poll_timeout)
+        finally:
+            long_poll_waiters.dec()
+        if entry is not None:
+            return stored_status_response(entry)
         return jsonify({
             'request_id': request_id,
             'status': 'not_found',
             'message': 'Request ID not found'
         }), 404
     
-    # 长轮询逻辑
-    start_time = time.time()
-    while (time.time() - start_time < poll_timeout and 
-           record['status'] == 'pending' and 
-           not shutdown_event.is_set()):
-        time.sleep(POLLING_INTERVAL)
-        record = request_records.get(request_id)  # 重新获取最新状态
+    # 长轮询逻辑：等待完成事件（由响应队列消费线程在结果到达时置位），无需轮询
+    if record.status == 'pending' and not shutdown_event.is_set():
+        long_poll_waiters.inc()
+        try:
+            record.event.wait(poll_timeout)
+        finally:
+            long_poll_waiters.dec()
     
     # 检查请求是否超时
-    if record['status'] == 'pending' and (time.time() - record['timestamp'] > REQUEST_TIMEOUT):
-        request_records[request_id]['status'] = 'timeout'
-        record = request_records[request_id]
+    if record.status == 'pending' and (time.time() - record.timestamp > REQUEST_TIMEOUT):
+        finish_request(record, status='timeout')
     
     # 构建并返回标准化响应
-    if record['status'] == 'completed':
-        return Response(record['result'], content_type='text/plain'), 200
+    if trace:
+        return jsonify({**status_payload(record), 'trace': summarize(record.trace)}), \
+            200 if record.status == 'completed' else 202
+    if record.status == 'completed':
+        return Response(record.result, content_type='text/plain'), 200
     else:
         return jsonify({
             'request_id': request_id,
-            'status': record['status'],
+            'status': record.status,
             'message': 'Result not ready yet'
         }), 202
 
+def wait_stored_entry(request_id, timeout):
+    return wait_for_entry(result_store, request_id, timeout, shutdown_event,
+                          interval=RESULT_STORE_POLL_INTERVAL, max_interval=RESULT_STORE_POLL_MAX_INTERVAL)
+
+def stored_status_response(entry):
+    """根据结果存储中的条目构建与本地记录相同格式的响应"""
+    if entry['status'] == 'completed':
+        return Response(entry['result'], content_type='text/plain'), 200
+    return jsonify({
+        'request_id': entry['request_id'],
+        'status': entry['status'],
+        'node_id': entry.get('node_id'),
+        'message': 'Result not ready yet'
+    }), 202
+
+def discard_upload(uploaded_key):
+    """删除已流式上传但不会被处理的输入对象（缓存命中或合并到进行中的请求时）"""
+    if not uploaded_key:
+        return
+    try:
+        aws.s3.delete_object(Bucket=INPUT_BUCKET, Key=uploaded_key)
+        logger.info(f"删除不需要处理的上传对象: {INPUT_BUCKET}/{uploaded_key}")
+    except Exception as e:
+        logger.error(f"删除上传对象失败: {uploaded_key}, {str(e)}")
+
+def submit_image(original_filename, data, digest=None, uploaded_key=None, trace=None):
+    """提交一张图像进行分类，返回 (request_id, 缓存结果)
+
+    相同内容最近已分类过时返回 (None, 缓存结果)；相同内容的请求正在处理中时返回其 request_id；
+    否则把图像内联在消息中或上传到S3，再发送到请求队列。提交失败时记录标记为 error 并抛出异常。
+    图像已由流式上传写入输入桶时传入 uploaded_key 和 digest，data 为 None。
+    trace 为调用方已记录的阶段时间戳（如开始接收请求体的时间），合并到新建的请求记录中。
+    """
+    if digest is None:
+        digest = hashlib.sha256(data).hexdigest()
+
+    # 相同内容最近已分类过，直接返回缓存结果
+    cached_result = label_cache.get(digest)
+    if cached_result is not None:
+        logger.info(f"结果缓存命中: {digest}")
+        cache_hits_total.inc()
+        discard_upload(uploaded_key)
+        return None, cached_result
+
+    # 生成唯一ID
+    filename = uploaded_key or f"{uuid.uuid4()}_{original_filename}"
+    request_id = str(uuid.uuid4())
+
+    # 相同内容的请求正在处理中时，复用其request_id而不是创建新任务
+    global coalesced_count
+    with inflight_lock:
+        inflight_id = inflight_requests.get(digest)
+        inflight_record = request_records.get(inflight_id) if inflight_id else None
+        if inflight_record and inflight_record.status == 'pending':
+            coalesced_count += 1
+            coalesced_total.inc()
+        else:
+            inflight_id = None
+            inflight_requests[digest] = request_id
+            # 记录请求状态（在上传前记录，使并发的相同请求可以等待它）
+            record = RequestRecord(request_id, filename, digest=digest)
+            record.trace.update(trace or {})
+            record.trace['created'] = record.timestamp
+            request_records.add(record)
+    if inflight_id:
+        logger.info(f"相同内容的请求正在处理中，合并到 RequestID: {inflight_id}")
+        discard_upload(uploaded_key)
+        return inflight_id, None
+
+    logger.info(f"生成文件名: {filename}, RequestID: {request_id}")
+    store_record(record)
+
+    try:
+        body, attributes, inline = build_request_message(
+            filename, request_id, data,
+            inline=INLINE_PAYLOADS and uploaded_key is None,
+            max_message_bytes=INLINE_MAX_MESSAGE_BYTES,
+            compress=INLINE_COMPRESSION,
+            node_id=NODE_ID,
+            reply_to=node.reply_to
+        )
+        if inline:
+            logger.info(f"图像内联在请求消息中: {filename}, {len(data)} 字节")
+        elif uploaded_key:
+            logger.info(f"文件已流式上传: {INPUT_BUCKET}/{filename}")
+        else:
+            # 上传到S3
+            with upload_seconds['put'].time():
+                aws.s3.upload_fileobj(io.BytesIO(data), INPUT_BUCKET, filename)
+            record.trace['uploaded'] = time.time()
+            logger.info(f"文件上传成功: {INPUT_BUCKET}/{filename}")
+
+        # 发送到SQS请求队列（与并发请求合并为批量发送，等待本条消息的发送结果）
+        with enqueue_seconds.time():
+            request_sender.send(body, attributes)
+        record.trace['enqueued'] = time.time()
+        submitted_total.inc()
+        logger.info(f"请求发送到SQS队列: {REQUEST_QUEUE_URL}")
+    except Exception:
+        # 提交失败，合并到该请求的等待者也会看到错误状态
+        finish_request(record, status='error')
+        release_inflight(digest, request_id)
+        raise
+
+    return request_id, None
+
+def reject_request(retry_after, reason, cost=1):
+    """准入控制拒绝：返回 429，Retry-After 为建议的重试等待秒数"""
+    admission_rejected_total[reason].inc()
+    logger.warning(f"服务繁忙，拒绝 {cost} 个请求（{reason}），建议 {retry_after} 秒后重试")
+    return 'Server busy, retry later', 429, {'Retry-After': str(retry_after)}
+
 @app.route('/classify', methods=['POST'])
 @handle_errors
 def upload_file():
     logger.info("收到新的分类请求")
-    
-    if 'myfile' not in request.files:
+
+    # 准入控制：在读取请求体之前决定，被拒绝的请求不占用上传带宽和等待线程
+    admitted, retry_after, reason = admission.try_acquire()
+    if not admitted:
+        return reject_request(retry_after, reason)
+    try:
+        return classify_upload()
+    finally:
+        admission.release()
+
+def classify_upload():
+    """/classify 的处理过程：接收上传、提交请求并长轮询等待结果"""
+    # 在读取请求体之前按 Content-Length 拒绝过大的上传
+    if request.content_length and request.content_length > UPLOAD_MAX_BYTES + 64 * 1024:
+        logger.warning(f"上传过大: {request.content_length} 字节")
+        return 'File too large', 413
+
+    boundary = request.mimetype_params.get('boundary') if request.mimetype == 'multipart/form-data' else None
+    if not boundary:
         logger.warning("请求缺少文件部分")
         return 'No myfile part', 400
     
-    file = request.files['myfile']
-    if not file.filename:
-        logger.warning("请求包含空文件名")
-        return 'No selected file', 400
-    
-    # 生成唯一ID
-    filename = f"{uuid.uuid4()}_{file.filename}"
-    request_id = str(uuid.uuid4())
-    logger.info(f"生成文件名: {filename}, RequestID: {request_id}")
-    
-    # 上传到S3
-    with s3_lock:
-        s3 = boto3.client('s3', region_name=AWS_REGION, config=s3_config)
-        s3.upload_fileobj(file, INPUT_BUCKET, filename)
-    logger.info(f"文件上传成功: {INPUT_BUCKET}/{filename}")
-    
-    # 发送到SQS请求队列
-    with sqs_request_lock:
-        sqs = boto3.client('sqs', region_name=AWS_REGION)
-        sqs.send_message(
-            QueueUrl=REQUEST_QUEUE_URL,
-            MessageBody=json.dumps({
-                'filename': filename,
-                'request_id': request_id,
-                'timestamp': time.time()
-            }),
-            MessageAttributes={
-                'request_id': {
-                    'StringValue': request_id,
-                    'DataType': 'String'
-                }
-            }
-        )
-    logger.info(f"请求发送到SQS队列: {REQUEST_QUEUE_URL}")
-    
-    # 记录请求状态
-    request_records[request_id] = {
-        'filename': filename,
-        'status': 'pending',
-        'timestamp': time.time(),
-        'result': None
-    }
-
-    # 添加初始延迟（让worker有时间处理）
-    logger.debug(f"等待 {INITIAL_POLLING_DELAY} 秒后开始轮询结果")
-    time.sleep(INITIAL_POLLING_DELAY)
-        
     # 获取长轮询超时参数
     poll_timeout = int(request.args.get('timeout', LONG_POLL_TIMEOUT))
+
+    # 直接从请求体流中读取 myfile：小图像留在内存中，大图像边接收边分段上传到S3
+    uploads = []
+
+    def start_upload(original_filename):
+        uploads.append(StreamingUpload(
+            aws.s3, INPUT_BUCKET, f"{uuid.uuid4()}_{original_filename}", upload_part_executor,
+            part_size=UPLOAD_PART_SIZE,
+            max_concurrent_parts=UPLOAD_CONCURRENT_PARTS,
+            max_size=UPLOAD_MAX_BYTES
+        ))
+        return uploads[0]
+
+    try:
+        accepted_at = time.time()
+        start_time = time.perf_counter()
+        original_filename, upload = receive_multipart_file(request.stream, boundary, 'myfile', start_upload)
+        data = upload.finish() if upload is not None else None
+        if upload is not None and upload.multipart:
+            upload_seconds['stream'].observe(time.perf_counter() - start_time)
+    except UploadTooLarge as e:
+        uploads[0].abort()
+        logger.warning(f"上传过大: {str(e)}")
+        return 'File too large', 413
+    except IncompleteUpload as e:
+        if uploads:
+            uploads[0].abort()
+        logger.warning(f"上传不完整: {str(e)}")
+        return 'Incomplete upload', 400
+    except Exception:
+        if uploads:
+            uploads[0].abort()
+        raise
+
+    if original_filename is None:
+        logger.warning("请求缺少文件部分")
+        return 'No myfile part', 400
+    if not original_filename:
+        logger.warning("请求包含空文件名")
+        return 'No selected file', 400
+
+    # 提交分类请求（缓存命中时直接返回结果）
+    request_id, cached_result = submit_image(
+        original_filename, data,
+        digest=upload.digest,
+        uploaded_key=upload.key if upload.multipart else None,
+        trace={'accepted': accepted_at}
+    )
+    if cached_result is not None:
+        return Response(cached_result, content_type='text/plain'), 200
+
     # 使用公共函数处理状态响应
-    return process_request_status(request_id, poll_timeout)    
+    return process_request_status(request_id, poll_timeout, trace=request.args.get('trace') == '1')    
+
+def extract_archive(name, fileobj, count=0, total_bytes=0):
+    """从 zip/tar 归档中读取所有文件，返回 [(文件名, 数据)]
+
+    count、total_bytes 为归档之外已接收的文件数和字节数。按归档声明的大小预先检查数量和总大小，
+    解压时再按实际读出的字节累计检查（声明的大小可以伪造），超出时立即停止解压。
+    """
+    lower = name.lower()
+    if lower.endswith('.zip'):
+        with zipfile.ZipFile(fileobj) as archive:
+            members = [info for info in archive.infolist() if not info.is_dir()]
+            check_batch_limits(count + len(members), total_bytes + sum(info.file_size for info in members))
+            items = []
+            for info in members:
+                with archive.open(info) as member_file:
+                    data = read_within_limit(member_file, total_bytes)
+                total_bytes += len(data)
+                if not os.path.basename(info.filename).startswith('.'):
+                    items.append((os.path.basename(info.filename), data))
+            return items
+    if lower.endswith(('.tar', '.tar.gz', '.tgz')):
+        with tarfile.open(fileobj=fileobj, mode='r:*') as archive:
+            members = [member for member in archive.getmembers() if member.isfile()]
+            check_batch_limits(count + len(members), total_bytes + sum(member.size for member in members))
+            items = []
+            for member in members:
+                data = read_within_limit(archive.extractfile(member), total_bytes)
+                total_bytes += len(data)
+                if not os.path.basename(member.name).startswith('.'):
+                    items.append((os.path.basename(member.name), data))
+            return items
+    raise ValueError(f"Unsupported archive type: {name}")
+
+def read_within_limit(fileobj, total_bytes):
+    """读取一个文件，已读 total_bytes 字节加上该文件超过 BATCH_MAX_BYTES 时抛出 ValueError（最多多读1字节）"""
+    data = fileobj.read(BATCH_MAX_BYTES - total_bytes + 1)
+    check_batch_limits(0, total_bytes + len(data))
+    return data
+
+def check_batch_limits(count, total_bytes):
+    if count > BATCH_MAX_ITEMS:
+        raise ValueError(f"Too many files: {count} > {BATCH_MAX_ITEMS}")
+    if total_bytes > BATCH_MAX_BYTES:
+        raise ValueError(f"Batch too large: {total_bytes} > {BATCH_MAX_BYTES} bytes")
+
+def watch_records(notifications, waiting, deadline, heartbeat_interval):
+    """从通知队列中按完成顺序产出已结束的记录
+
+    waiting 为仍在等待的 request_id 集合（或以其为键的字典），由调用方在处理产出的记录后移除；
+    同一记录的重复通知和仍为 pending 的通知被忽略。超过 heartbeat_interval 没有新结果时产出 None，
+    全部结束、到达 deadline 或服务关闭时返回。
+    """
+    while waiting and not shutdown_event.is_set():
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return
+        try:
+            record = notifications.get(timeout=min(remaining, heartbeat_interval))
+        except queue.Empty:
+            yield None
+            continue
+        if record.status == 'pending' or record.request_id not in waiting:
+            continue
+        yield record
+
+def stream_batch_results(items, batch_timeout):
+    """批量分类的结果流：先并行提交所有图像，再在每个请求结束时输出一行 JSON（NDJSON）
+
+    行类型: accepted（收到的图像数）、item（单张图像的状态，queued 之后是 completed/error/timeout）、
+    heartbeat（等待期间的进度）、summary（最终统计）。
+    """
+    total = len(items)
+    counts = defaultdict(int)
+    done = 0
+    # request_id -> [(序号, 文件名)]，相同内容的图像合并为同一个请求
+    waiting = defaultdict(list)
+    notifications = queue.Queue()
+    registered = []
+
+    def item_line(index, name, status, request_id=None, **fields):
+        nonlocal done
+        if status != 'queued':
+            done += 1
+            counts[status] += 1
+        return json.dumps({
+            'type': 'item', 'index': index, 'filename': name, 'request_id': request_id,
+            'status': status, **fields, 'done': done, 'total': total
+        }) + '\n'
+
+    yield json.dumps({'type': 'accepted', 'total': total}) + '\n'
+
+    # 并行提交：S3上传并行进行，SQS消息由 request_sender 合并为批量发送
+    with ThreadPoolExecutor(max_workers=BATCH_SUBMIT_THREADS) as executor:
+        futures = {
+            executor.submit(submit_image, name, data): (index, name)
+            for index, (name, data) in enumerate(items)
+        }
+        items.clear()
+        for future in as_completed(futures):
+            index, name = futures.pop(future)
+            try:
+                request_id, cached_result = future.result()
+            except Exception as e:
+                logger.error(f"批量请求中的图像提交失败: {name}, {str(e)}")
+                yield item_line(index, name, 'error', error=str(e))
+                continue
+            if cached_result is not None:
+                yield item_line(index, name, 'completed', result=cached_result)
+                continue
+            yield item_line(index, name, 'queued', request_id)
+            if request_id not in waiting:
+                record = request_records.get(request_id)
+                if record is None:
+                    yield item_line(index, name, 'error', request_id, error='Request record not found')
+                    continue
+                registered.append(record)
+                record.add_listener(notifications)
+            waiting[request_id].append((index, name))
+
+    # 按完成顺序输出结果
+    try:
+        for record in watch_records(notifications, waiting, time.time() + batch_timeout, BATCH_HEARTBEAT_INTERVAL):
+            if record is None:
+                yield json.dumps({'type': 'heartbeat', 'done': done, 'total': total}) + '\n'
+                continue
+            for index, name in waiting.pop(record.request_id):
+                if record.status == 'completed':
+                    yield item_line(index, name, 'completed', record.request_id, result=record.result)
+                else:
+                    yield item_line(index, name, record.status, record.request_id)
+    finally:
+        for record in registered:
+            record.remove_listener(notifications)
+
+    # 超时仍未完成的图像，客户端可以用 request_id 继续查询 /status
+    for request_id, entries in waiting.items():
+        for index, name in entries:
+            yield item_line(index, name, 'timeout', request_id)
+
+    yield json.dumps({'type': 'summary', 'total': total, **counts}) + '\n'
+
+@app.route('/classify_batch', methods=['POST'])
+@handle_errors
+def classify_batch():
+    """批量分类：接收多个 myfile 文件或一个 archive（zip/tar）归档，以 NDJSON 流式返回每张图像的结果"""
+    logger.info("收到新的批量分类请求")
+
+    # 在解析请求体之前按 Content-Length 拒绝过大（或未声明长度）的请求，
+    # 允许每个文件约1KB的 multipart 头部开销
+    max_body_bytes = BATCH_MAX_BYTES + BATCH_MAX_ITEMS * 1024 + 64 * 1024
+    if not request.content_length or request.content_length > max_body_bytes:
+        logger.warning(f"批量请求过大或缺少 Content-Length: {request.content_length}")
+        return 'Batch too large or missing Content-Length', 413
+
+    # 准入控制：读取请求体之前先按1个请求检查，被拒绝的请求不占用上传带宽和解压开销；
+    # 得到图像数后再计入其余部分，整批计入在途请求，直到响应关闭（结果流结束或客户端断开）
+    admitted, retry_after, reason = admission.try_acquire()
+    if not admitted:
+        return reject_request(retry_after, reason)
+    held = 1
+    try:
+        try:
+            items = read_batch_items()
+        except (ValueError, zipfile.BadZipFile, tarfile.TarError) as e:
+            logger.warning(f"批量请求无效: {str(e)}")
+            return f'Invalid batch: {str(e)}', 400
+
+        if not items:
+            logger.warning("批量请求不包含文件")
+            return 'No myfile or archive part', 400
+
+        batch_timeout = float(request.args.get('timeout', REQUEST_TIMEOUT))
+
+        cost = len(items)
+        if cost > held:
+            admitted, retry_after, reason = admission.try_acquire(cost - held, held=held)
+            if not admitted:
+                return reject_request(retry_after, reason, cost)
+            held = cost
+
+        logger.info(f"批量请求包含 {len(items)} 张图像")
+        response = Response(stream_with_context(stream_batch_results(items, batch_timeout)),
+                            mimetype='application/x-ndjson')
+        response.call_on_close(lambda: admission.release(cost))
+        held = 0
+        return response
+    finally:
+        if held:
+            admission.release(held)
+
+def read_batch_items():
+    """读取批量请求中的 myfile 文件和 archive 归档，返回 [(文件名, 数据)]；超出限制时抛出 ValueError"""
+    items = [(file.filename, file.read()) for file in request.files.getlist('myfile') if file.filename]
+    total_bytes = sum(len(data) for _, data in items)
+    check_batch_limits(len(items), total_bytes)
+    archive = request.files.get('archive')
+    if archive is not None and archive.filename:
+        items.extend(extract_archive(archive.filename, archive, len(items), total_bytes))
+    return items
+
+@app.route('/cache/stats', methods=['GET'])
+@handle_errors
+def get_cache_stats():
+    """返回结果缓存和 /result 缓存的命中率、淘汰次数，以及请求合并次数"""
+    stats = label_cache.stats()
+    with inflight_lock:
+        stats['coalesced'] = coalesced_count
+        stats['inflight'] = len(inflight_requests)
+    stats['output'] = output_cache.stats()
+    return jsonify(stats)
+
+@app.route('/queue/stats', methods=['GET'])
+@handle_errors
+def get_queue_stats():
+    """返回响应队列的积压、消费速率和消费线程数，以及准入控制和本节点的状态"""
+    return jsonify({**response_consumers.stats(), 'admission': admission.stats(), 'node': node.stats()})
+
+@app.route('/metrics', methods=['GET'])
+@handle_errors
+def get_metrics():
+    """导出指标：默认为 Prometheus 文本格式，?format=json 时返回 JSON（直方图给出 p50/p90/p99 估计）"""
+    if request.args.get('format') == 'json':
+        return jsonify(metrics.snapshot())
+    return Response(metrics.render_prometheus(), content_type='text/plain; version=0.0.4')
 
 @app.route('/status/<request_id>', methods=['GET'])
 @handle_errors
 def get_status(request_id):
-    """长轮询检查请求状态"""
+    """长轮询检查请求状态；?trace=1 时以JSON返回，并附带各阶段时间戳和耗时"""
     # 获取长轮询超时参数
     poll_timeout = int(request.args.get('timeout', LONG_POLL_TIMEOUT))
     # 使用公共函数处理状态响应
-    return process_request_status(request_id, poll_timeout)
+    return process_request_status(request_id, poll_timeout, trace=request.args.get('trace') == '1')
+
+@app.route('/traces/slow', methods=['GET'])
+@handle_errors
+def get_slow_traces():
+    """返回慢请求统计和保留的最慢请求的时间线"""
+    return jsonify(slow_requests.stats())
+
+def status_payload(record):
+    payload = {'request_id': record.request_id, 'status': record.status}
+    if record.status == 'completed':
+        payload['result'] = record.result
+    return payload
+
+def sse_event(event, data, event_id=None):
+    """格式化一条 Server-Sent Events 消息"""
+    message = f"event: {event}\n"
+    if event_id:
+        message += f"id: {event_id}\n"
+    return message + f"data: {json.dumps(data)}\n\n"
+
+class StoredRecord:
+    """结果存储中的条目，提供 watch_records 和 status_payload 需要的属性"""
+
+    def __init__(self, entry):
+        self.request_id = entry['request_id']
+        self.status = entry['status']
+        self.result = entry.get('result')
+
+def watch_stored_requests(request_ids, notifications, deadline, stop_event):
+    """后台线程函数：按退避间隔轮询结果存储，其他节点的请求结束时作为 StoredRecord 推入通知队列"""
+    pending = list(request_ids)
+    interval = RESULT_STORE_POLL_INTERVAL
+    while pending and not shutdown_event.is_set():
+        remaining = deadline - time.time()
+        if remaining <= 0 or stop_event.wait(min(interval, remaining)):
+            return
+        interval = min(interval * 2, RESULT_STORE_POLL_MAX_INTERVAL)
+        still_pending = []
+        for request_id in pending:
+            try:
+                entry = result_store.get(request_id)
+            except Exception as e:
+                logger.error(f"查询结果存储失败: {request_id}, {str(e)}")
+                still_pending.append(request_id)
+                continue
+            if entry is not None and entry['status'] == 'pending':
+                still_pending.append(request_id)
+            elif entry is not None:
+                notifications.put(StoredRecord(entry))
+        pending = still_pending
+
+def stream_status_events(request_ids, timeout):
+    """状态推送流：先推送每个请求的当前状态，之后每个请求结束时推送一条 status 事件，最后推送 done 事件
+
+    本节点没有记录的请求到结果存储中查询，仍为 pending 的由后台线程轮询结果存储等待其结束。
+    """
+    notifications = queue.Queue()
+    waiting = set()
+    registered = []
+    remote = []
+    deadline = time.time() + timeout
+
+    for request_id in request_ids:
+        record = request_records.get(request_id)
+        if record is None:
+            entry = result_store.get(request_id)
+            if entry is None:
+                yield sse_event('status', {'request_id': request_id, 'status': 'not_found'}, request_id)
+                continue
+            record = StoredRecord(entry)
+            yield sse_event('status', status_payload(record), request_id)
+            if record.status == 'pending':
+                waiting.add(request_id)
+                remote.append(request_id)
+            continue
+        yield sse_event('status', status_payload(record), request_id)
+        if record.status == 'pending':
+            waiting.add(request_id)
+            registered.append(record)
+            # 注册后才结束的请求由响应队列消费线程推入通知队列，注册前已结束的立即推入
+            record.add_listener(notifications)
+
+    stop_watching = threading.Event()
+    if remote:
+        threading.Thread(target=watch_stored_requests, args=(remote, notifications, deadline, stop_watching),
+                         daemon=True).start()
+
+    try:
+        for record in watch_records(notifications, waiting, deadline, SSE_KEEPALIVE_INTERVAL):
+            if record is None:
+                # 注释行，保持连接不被代理断开
+                yield ': keepalive\n\n'
+                continue
+            waiting.discard(record.request_id)
+            yield sse_event('status', status_payload(record), record.request_id)
+    finally:
+        stop_watching.set()
+        for record in registered:
+            record.remove_listener(notifications)
+
+    yield sse_event('done', {'pending': sorted(waiting)})
+
+@app.route('/events', methods=['GET', 'POST'])
+@app.route('/events/<request_id>', methods=['GET'])
+@handle_errors
+def stream_events(request_id=None):
+    """通过 Server-Sent Events 推送一个或多个请求的状态变化，一个连接可以代替多个长轮询
+
+    GET /events/<request_id>、GET /events?ids=id1,id2 或 POST /events {"request_ids": [...]}
+    """
+    if request_id:
+        request_ids = [request_id]
+    elif request.method == 'POST':
+        request_ids = (request.get_json(silent=True) or {}).get('request_ids', [])
+    else:
+        request_ids = request.args.get('ids', '').split(',')
+    request_ids = list(dict.fromkeys(str(rid) for rid in request_ids if rid))
+
+    if not request_ids:
+        return 'No request ids', 400
+    if len(request_ids) > SSE_MAX_IDS:
+        return f'Too many request ids: {len(request_ids)} > {SSE_MAX_IDS}', 413
+
+    timeout = float(request.args.get('timeout', REQUEST_TIMEOUT))
+    logger.info(f"状态推送连接: {len(request_ids)} 个请求")
+    return Response(
+        stream_with_context(stream_status_events(request_ids, timeout)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 @app.route('/result/<filename>', methods=['GET'])
 @handle_errors
@@ -259,98 +960,121 @@ def get_result(filename):
     """通过文件名获取结果"""
     logger.info(f"获取结果请求: {filename}")
     
-    try:
-        with s3_lock:
-            s3 = boto3.client('s3', region_name=AWS_REGION, config=s3_config)
-            response = s3.get_object(Bucket=OUTPUT_BUCKET, Key=filename)
-        result = response['Body'].read().decode('utf-8')
-        
-        logger.info(f"成功返回结果: {filename}")
-        return jsonify({
-            'filename': filename,
-            'result': result
-        })
-        
-    except s3.exceptions.NoSuchKey:
+    result = output_cache.get_or_load(filename, load_output)
+    if result is None:
         logger.warning(f"结果尚未就绪: {filename}")
         return jsonify({
             'message': 'Result not ready yet',
             'filename': filename
         }), 404
 
-def process_sqs_messages():
-    """后台线程函数：处理SQS响应队列消息"""
-    logger.info("SQS消息处理线程启动")
-    sqs = boto3.client('sqs', region_name=AWS_REGION)
-    
-    while not shutdown_event.is_set():
-        try:
-            with sqs_response_lock:  # 使用sqs_response_lock
-                response = sqs.receive_message(
-                    QueueUrl=RESPONSE_QUEUE_URL,
-                    MaxNumberOfMessages=SQS_MAX_MESSAGES,
-                    WaitTimeSeconds=20,  # 长轮询
-                    MessageAttributeNames=['request_id']
-                )
-            
-            messages = response.get('Messages', [])
-            if messages:
-                logger.info(f"收到 {len(messages)} 条响应消息")
-            
-            processed_messages = []
-            for message in messages:
-                try:
-                    # 解析消息
-                    attrs = message.get('MessageAttributes', {})
-                    msg_request_id = attrs.get('request_id', {}).get('StringValue')
-                    
-                    if not msg_request_id:
-                        logger.warning("收到的消息缺少request_id属性，丢弃")
-                        processed_messages.append({
-                            'Id': message['MessageId'],
-                            'ReceiptHandle': message['ReceiptHandle']
-                        })
-                        continue
-                    
-                    # 更新请求状态
-                    body = json.loads(message['Body'])
-                    result = body.get('result')
-                    
-                    if msg_request_id in request_records:
-                        request_records[msg_request_id].update({
-                            'result': result,
-                            'status': 'completed'
-                        })
-                        logger.info(f"更新请求状态: {msg_request_id} -> completed")
-                    else:
-                        logger.warning(f"收到未知请求ID的响应: {msg_request_id}")
-                    
-                    processed_messages.append({
-                        'Id': message['MessageId'],
-                        'ReceiptHandle': message['ReceiptHandle']
-                    })
-                    
-                except (json.JSONDecodeError, KeyError) as e:
-                    logger.error(f"消息处理错误: {str(e)}，丢弃消息")
-                    processed_messages.append({
-                        'Id': message['MessageId'],
-                        'ReceiptHandle': message['ReceiptHandle']
-                    })
-            
-            # 批量删除已处理消息
-            if processed_messages:
-                with sqs_response_lock:  # 使用sqs_response_lock
-                    sqs.delete_message_batch(
-                        QueueUrl=RESPONSE_QUEUE_URL,
-                        Entries=processed_messages
-                    )
-                logger.debug(f"成功删除 {len(processed_messages)} 条SQS消息")
-                
-        except Exception as e:
-            logger.error(f"处理SQS消息时出错: {str(e)}")
-            time.sleep(5)  # 短暂暂停后重试
+    logger.info(f"成功返回结果: {filename}")
+    return jsonify({
+        'filename': filename,
+        'result': result
+    })
+
+def output_key(filename):
+    """输入文件名对应的输出桶结果键（与 worker 的 save_result 一致）"""
+    return os.path.splitext(filename)[0] + '.csv'
+
+def load_output(key):
+    """从输出桶读取结果文件，不存在时返回 None"""
+    s3 = aws.s3
+    try:
+        response = s3.get_object(Bucket=OUTPUT_BUCKET, Key=key)
+    except s3.exceptions.NoSuchKey:
+        return None
+    return response['Body'].read().decode('utf-8')
+
+def handle_response_message(message):
+    """处理一条响应队列消息：更新请求状态并唤醒等待线程（返回后消息由消费线程池批量删除）"""
+    try:
+        # 解析消息
+        attrs = message.get('MessageAttributes', {})
+        msg_request_id = attrs.get('request_id', {}).get('StringValue')
+        
+        if not msg_request_id:
+            logger.warning("收到的消息缺少request_id属性，丢弃")
+            return
+        
+        # 更新请求状态
+        body = json.loads(message['Body'])
+        result = body.get('result')
+        filename = body.get('filename')
+        worker_trace = parse_trace_attribute(attrs)
+    except (json.JSONDecodeError, KeyError) as e:
+        logger.error(f"消息处理错误: {str(e)}，丢弃消息")
+        return
     
-    logger.info("SQS消息处理线程停止")
+    record = request_records.get(msg_request_id)
+    if record is not None:
+        # 合并 worker 的阶段时间戳，在唤醒等待线程之前完成，使 ?trace=1 的响应包含完整时间线
+        record.trace.update(worker_trace)
+        record.trace['response_received'] = time.time()
+        if finish_request(record, result=result, status='completed'):
+            logger.info(f"更新请求状态: {msg_request_id} -> completed")
+            slow_requests.observe(msg_request_id, record.trace)
+        elif result is not None:
+            # 已超时（或已出错）的请求的迟到响应：本地记录保持最终状态，结果仍写入结果存储
+            logger.warning(f"收到已结束请求的迟到响应: {msg_request_id} ({record.status})")
+            store_result(msg_request_id, 'completed', result, record.filename, record.timestamp)
+
+        # 写入 /result 缓存，内容与 worker 写入输出桶的结果文件相同
+        if result is not None:
+            output_cache.put(output_key(record.filename), f'{record.filename},{result}')
+
+        # 写入结果缓存，后续相同内容的请求直接命中
+        digest = record.digest
+        if digest and result is not None:
+            label_cache.put(digest, result)
+            release_inflight(digest, msg_request_id)
+    elif filename and result is not None:
+        # 记录已超时清理（或节点重启后丢失）的迟到响应：结果仍写入 /result 缓存和结果存储，
+        # 之后的 /status 和 /result 查询可以得到结果
+        logger.warning(f"收到已清理请求的迟到响应: {msg_request_id}")
+        output_cache.put(output_key(filename), f'{filename},{result}')
+        store_result(msg_request_id, 'completed', result, filename, time.time())
+    else:
+        logger.warning(f"收到未知请求ID的响应: {msg_request_id}")
+
+# 响应队列消费线程池：线程数随队列积压在最小值和最大值之间调整，删除与接收流水线并行
+response_consumers = ResponseConsumerPool(
+    lambda: aws.sqs,
+    RESPONSE_QUEUE_URL,
+    handle_response_message,
+    shutdown_event,
+    min_consumers=RESPONSE_CONSUMERS_MIN,
+    max_consumers=RESPONSE_CONSUMERS_MAX,
+    backlog_per_consumer=RESPONSE_BACKLOG_PER_CONSUMER,
+    scale_interval=RESPONSE_SCALE_INTERVAL,
+    max_messages=SQS_MAX_MESSAGES,
+    delete_threads=RESPONSE_DELETE_THREADS,
+    message_attribute_names=['request_id', 'trace']
+)
+metrics.gauge('web_response_backlog', '响应队列中等待消费的消息数（近似值）',
+              function=lambda: response_consumers.stats()['backlog'])
+metrics.gauge('web_response_drain_rate', '响应队列的消费速率（条/秒）',
+              function=lambda: response_consumers.stats()['drain_rate'])
+metrics.gauge('web_response_consumers', '响应队列消费线程数',
+              function=lambda: response_consumers.stats()['consumers'])
+
+# 准入控制：处理速率取响应队列的消费速率（即worker完成本节点请求的速率），
+# 相应地只把请求队列深度中本节点的份额计入排队时间
+admission = AdmissionController(
+    lambda: aws.sqs,
+    REQUEST_QUEUE_URL,
+    shutdown_event,
+    lambda: response_consumers.drain_rate,
+    get_node_count=(lambda: ADMISSION_NODE_COUNT) if ADMISSION_NODE_COUNT else node.count_nodes,
+    max_inflight=ADMISSION_MAX_INFLIGHT,
+    max_wait=ADMISSION_MAX_WAIT,
+    sample_interval=ADMISSION_SAMPLE_INTERVAL,
+    max_retry_after=ADMISSION_MAX_RETRY_AFTER
+)
+metrics.gauge('web_admission_inflight', '准入控制计入的在途请求数', function=lambda: admission.inflight)
+metrics.gauge('web_admission_estimated_wait_seconds', '按请求队列深度和处理速率估计的排队时间',
+              function=lambda: admission.estimated_wait(0))
 
 def cleanup_expired_records():
     """后台线程函数：清理过期的请求记录"""
@@ -358,22 +1082,24 @@ def cleanup_expired_records():
     
     while not shutdown_event.is_set():
         try:
-            now = time.time()
-            expired_ids = []
-            
-            # 识别过期记录
-            for rid, record in request_records.items():
-                if (record['status'] in ('completed', 'error', 'timeout') and
-                    now - record['timestamp'] > REQUEST_TIMEOUT):
-                    expired_ids.append(rid)
+            # 只弹出到期堆中已到期的记录，无需遍历全部记录
+            removed, overdue = request_records.expire()
             
             # 删除过期记录
-            for rid in expired_ids:
-                request_records.pop(rid, None)
-                logger.debug(f"清理过期记录: {rid}")
+            for record in removed:
+                if record.digest:
+                    release_inflight(record.digest, record.request_id)
+                logger.debug(f"清理过期记录: {record.request_id}")
+            
+            # 超过 REQUEST_TIMEOUT 仍未收到结果的请求标记为超时，下一轮到期时删除
+            for record in overdue:
+                if record.status == 'pending':
+                    finish_request(record, status='timeout')
+                if record.digest:
+                    release_inflight(record.digest, record.request_id)
             
-            if expired_ids:
-                logger.info(f"清理了 {len(expired_ids)} 条过期记录")
+            if removed or overdue:
+                logger.info(f"清理了 {len(removed)} 条过期记录，{len(overdue)} 条请求超时")
                 
         except Exception as e:
             logger.error(f"清理记录时出错: {str(e)}")
@@ -388,10 +1114,15 @@ if __name__ == '__main__':
     logger.info("File: web_server.py version 2.0 release 2025-06-28 by Wenguang Zuo")
     logger.info(f"配置文件路径: {CONFIG_PATH}")
 
+    logger.info(f"节点ID: {NODE_ID}")
+
+    # 创建本节点的响应队列（共用响应队列时不变）
+    response_consumers.queue_url = node.setup()
+
     # 启动后台线程
-    sqs_processor = threading.Thread(target=process_sqs_messages, daemon=True)
     cleaner = threading.Thread(target=cleanup_expired_records, daemon=True)
-    sqs_processor.start()
+    response_consumers.start()
+    admission.start()
     cleaner.start()
     
     logger.info("Web服务器启动")
@@ -400,6 +1131,9 @@ if __name__ == '__main__':
     finally:
         # 优雅关闭
         shutdown_event.set()
-        sqs_processor.join(timeout=10)
+        wake_all_waiters()
+        response_consumers.join(timeout=30)
         cleaner.join(timeout=10)
+        result_store_writer.shutdown()
+        node.teardown(delete=NODE_RESPONSE_QUEUE_DELETE_ON_EXIT)
         logger.info("Web服务器已停止")